@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from ai.engine import ClientDisconnected
+from ai.prompts import PROMPT_TEMPLATES, prompt_version
+from planets.cache.tile_cache import get_redis_client
+from service.query_cache import decode_body, encode_body
+
+# Content-addressed cache for model analyses.
+#
+# Key: ai:<method>:<prompt digest>:<generation>:<sha256 of model, tile bytes
+# and normalized inputs>. The same tile reached through different (z, x, y) or
+# datasets shares an entry; an edited prompt template gets a new digest and
+# therefore new keys. POST /api/ai/cache/invalidate bumps ai:gen:<method> to
+# drop a method's entries explicitly (e.g. after a model upgrade).
+# Identical concurrent requests in this worker share one model call.
+
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", 7 * 24 * 3600))
+
+analysis_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "shared": 0,
+    "invalidations": 0,
+}
+
+in_flight: Dict[str, asyncio.Future] = {}
+
+
+def method_ttl(method: str) -> int:
+    """AI_CACHE_TTL_<METHOD> overrides the default, e.g. AI_CACHE_TTL_ANALYZE_MARS_TILE=86400"""
+    return int(os.getenv(f"AI_CACHE_TTL_{method.upper()}", AI_CACHE_TTL))
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.split()).casefold()
+
+
+def normalize_features(features: Iterable[str]) -> List[str]:
+    return sorted({" ".join(f.split()).casefold() for f in features if f.strip()})
+
+
+def tile_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+async def get_generation(client, method: str) -> int:
+    return int(await client.get(f"ai:gen:{method}") or 0)
+
+
+def analysis_key(method: str, generation: int, model: str, images: List[bytes], inputs: dict) -> str:
+    digest = hashlib.sha256()
+    digest.update(model.encode())
+    for image in images:
+        digest.update(tile_digest(image).encode())
+    digest.update(json.dumps(inputs, sort_keys=True, separators=(",", ":")).encode())
+    return f"ai:{method}:{prompt_version(method)}:{generation}:{digest.hexdigest()}"
+
+
+class AnalysisLookup:
+    """Outcome of a cache lookup; a miss is then computed through begin/finish or fail"""
+
+    __slots__ = ("method", "key", "cacheable", "text", "status", "future")
+
+    def __init__(self, method: str, key: str, cacheable: bool):
+        self.method = method
+        self.key = key
+        self.cacheable = cacheable
+        self.text: Optional[str] = None
+        self.status: Optional[str] = None
+        self.future: Optional[asyncio.Future] = None
+
+    def begin(self):
+        """Register this call so identical requests wait for it instead of calling the model"""
+        analysis_cache_stats["misses"] += 1
+        self.status = "MISS"
+        self.future = asyncio.get_running_loop().create_future()
+        in_flight[self.key] = self.future
+
+    def fail(self, error: BaseException):
+        in_flight.pop(self.key, None)
+        if isinstance(error, asyncio.CancelledError):
+            # Waiters retry on their own rather than inherit this client's cancellation
+            error = ClientDisconnected("Client closed the connection")
+        self.future.set_exception(error)
+        # Nobody else may be waiting; don't warn about an unretrieved exception
+        self.future.exception()
+
+    def share(self, text: str):
+        """Hand waiting requests a result that isn't this key's own (a similar tile's analysis), without caching it"""
+        in_flight.pop(self.key, None)
+        self.future.set_result(text)
+
+    async def finish(self, text: str):
+        in_flight.pop(self.key, None)
+        self.future.set_result(text)
+        self.text = text
+        if not self.cacheable:
+            return
+        try:
+            client = await get_redis_client()
+            await client.setex(self.key, method_ttl(self.method), encode_body(text.encode()))
+        except RedisError:
+            pass
+
+
+async def find_analysis(method: str, model: str, images: List[bytes], inputs: dict) -> AnalysisLookup:
+    """Cached text ("HIT"), the result of an identical in-flight call ("SHARED"), or a miss (text None)"""
+    try:
+        client = await get_redis_client()
+        lookup = AnalysisLookup(method, analysis_key(method, await get_generation(client, method), model, images, inputs), True)
+        stored = await client.get(lookup.key)
+    except RedisError:
+        lookup, stored = AnalysisLookup(method, analysis_key(method, -1, model, images, inputs), False), None
+    if stored:
+        analysis_cache_stats["hits"] += 1
+        lookup.text, lookup.status = decode_body(stored).decode(), "HIT"
+        return lookup
+
+    while lookup.key in in_flight:
+        try:
+            lookup.text = await asyncio.shield(in_flight[lookup.key])
+            analysis_cache_stats["shared"] += 1
+            lookup.status = "SHARED"
+            return lookup
+        except ClientDisconnected:
+            # The leading request went away; run the call for this client instead
+            continue
+    return lookup
+
+
+async def cached_analysis(method: str, model: str, images: List[bytes], inputs: dict,
+                          compute: Callable[[], Awaitable[str]]) -> Tuple[str, str]:
+    """(analysis text, "HIT" | "MISS" | "SHARED")"""
+    lookup = await find_analysis(method, model, images, inputs)
+    if lookup.text is not None:
+        return lookup.text, lookup.status
+
+    lookup.begin()
+    try:
+        text = await compute()
+    except BaseException as e:
+        lookup.fail(e)
+        raise
+    await lookup.finish(text)
+    return text, "MISS"
+
+
+async def invalidate(methods: Optional[Iterable[str]] = None) -> List[str]:
+    methods = list(methods or PROMPT_TEMPLATES)
+    client = await get_redis_client()
+    pipe = client.pipeline()
+    for method in methods:
+        pipe.incr(f"ai:gen:{method}")
+    await pipe.execute()
+    analysis_cache_stats["invalidations"] += len(methods)
+    return methods
+
+
+def get_analysis_cache_stats() -> dict:
+    lookups = analysis_cache_stats["hits"] + analysis_cache_stats["misses"] + analysis_cache_stats["shared"]
+    return {
+        **analysis_cache_stats,
+        "in_flight": len(in_flight),
+        "hit_rate": (analysis_cache_stats["hits"] + analysis_cache_stats["shared"]) / lookups if lookups else None,
+        "prompt_versions": {method: prompt_version(method) for method in PROMPT_TEMPLATES},
+    }
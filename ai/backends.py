@@ -0,0 +1,89 @@
+import importlib
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Any
+
+# Analyzer backends, chosen by AI_BACKEND and built on first use.
+#
+# A backend implements the four analysis methods and `stream` (an incomplete
+# one can't be instantiated, so it fails in get_analyzer()); routes and jobs
+# call get_analyzer() instead of holding an instance, so importing the app
+# never imports a model SDK or needs its credentials. Backends are registered
+# as "module:Class" paths and only imported when selected:
+#
+#   gemini   ai.gemini_analyzer:MarsImageAnalyzer (GEMINI_API_KEY, network)
+#   stub     ai.stub_analyzer:StubAnalyzer (deterministic, offline; for load tests)
+
+AI_BACKEND = os.getenv("AI_BACKEND", "gemini")
+
+ANALYZER_BACKENDS: Dict[str, str] = {
+    "gemini": "ai.gemini_analyzer:MarsImageAnalyzer",
+    "stub": "ai.stub_analyzer:StubAnalyzer",
+}
+
+analyzer: Optional["AnalyzerBackend"] = None
+analyzer_lock = threading.Lock()
+analyzer_stats = {"backend": None, "init_ms": None}
+
+
+class AnalyzerBackend(ABC):
+    """Interface shared by the analyzer backends; `model_name` is part of analysis cache keys"""
+
+    model_name: str
+
+    @abstractmethod
+    async def analyze_mars_tile(self, image_data: bytes, question: str, tile_info: Optional[Dict[str, Any]] = None) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def analyze_general_features(self, image_data: bytes) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def detect_specific_features(self, image_data: bytes, features: List[str]) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def compare_tiles(self, image1_data: bytes, image2_data: bytes, tile1_info: Optional[Dict] = None, tile2_info: Optional[Dict] = None) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stream(self, method: str, **kwargs) -> AsyncIterator[str]:
+        """Text chunks of `method`'s analysis as they are generated"""
+        raise NotImplementedError
+
+
+def register_backend(name: str, path: str):
+    """Make a backend selectable by AI_BACKEND; `path` is "module:Class" """
+    ANALYZER_BACKENDS[name] = path
+
+
+def load_backend(name: str) -> type:
+    try:
+        module_name, class_name = ANALYZER_BACKENDS[name].split(":")
+    except KeyError:
+        raise ValueError(f"Unknown analyzer backend {name!r}; expected one of {sorted(ANALYZER_BACKENDS)}")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_analyzer() -> AnalyzerBackend:
+    """The configured backend, constructed by the first caller"""
+    global analyzer
+    if analyzer is None:
+        with analyzer_lock:
+            if analyzer is None:
+                start = time.perf_counter()
+                backend = load_backend(AI_BACKEND)()
+                analyzer_stats["init_ms"] = (time.perf_counter() - start) * 1000
+                analyzer_stats["backend"] = AI_BACKEND
+                analyzer = backend
+    return analyzer
+
+
+def get_analyzer_stats() -> dict:
+    stats = dict(analyzer_stats)
+    if analyzer is not None:
+        stats["model"] = analyzer.model_name
+    return stats
@@ -0,0 +1,210 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from fastapi import Request
+
+from service.tracing import span
+
+# Admission, concurrency and deadlines for model calls.
+#
+# At most AI_MAX_CONCURRENCY calls run at once across the worker and at most
+# AI_PER_USER_LIMIT per client (running or queued). Up to AI_QUEUE_LIMIT more
+# wait for a slot; beyond that callers are rejected straight away rather than
+# holding a connection open. Each call has a deadline covering queue wait and
+# model time, and is cancelled if the HTTP client disconnects.
+
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", 4))
+AI_QUEUE_LIMIT = int(os.getenv("AI_QUEUE_LIMIT", 32))
+AI_PER_USER_LIMIT = int(os.getenv("AI_PER_USER_LIMIT", 2))
+AI_DEADLINE_SECONDS = float(os.getenv("AI_DEADLINE_SECONDS", 60))
+DISCONNECT_POLL_SECONDS = 0.5
+LATENCY_SAMPLES = 500
+
+T = TypeVar("T")
+
+
+class AnalysisRejected(Exception):
+    """Too many queued calls overall, or too many for this client"""
+
+    def __init__(self, message: str, per_user: bool = False):
+        super().__init__(message)
+        self.per_user = per_user
+
+
+class AnalysisTimeout(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def client_key(request: Request) -> str:
+    """Per-user limit key: explicit user id header, else the client address"""
+    user_id = request.headers.get("x-user-id")
+    if user_id:
+        return f"user:{user_id}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def percentile(samples, fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class AnalysisEngine:
+
+    def __init__(self, max_concurrency: int = AI_MAX_CONCURRENCY, queue_limit: int = AI_QUEUE_LIMIT,
+                 per_user_limit: int = AI_PER_USER_LIMIT, deadline: float = AI_DEADLINE_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.queue_limit = queue_limit
+        self.per_user_limit = per_user_limit
+        self.deadline = deadline
+        # Created on first use so it binds to the serving loop
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.admitted = 0
+        self.queued = 0
+        self.running = 0
+        self.per_user: Dict[str, int] = {}
+        self.queue_wait_ms = deque(maxlen=LATENCY_SAMPLES)
+        self.model_ms = deque(maxlen=LATENCY_SAMPLES)
+        self.ttft_ms = deque(maxlen=LATENCY_SAMPLES)
+        self.stats = {
+            "completed": 0,
+            "errors": 0,
+            "rejected": 0,
+            "rejected_per_user": 0,
+            "timeouts": 0,
+            "disconnects": 0,
+            "streams": 0,
+        }
+
+    def admit(self, key: str, limit: Optional[int] = None):
+        if self.per_user.get(key, 0) >= (limit or self.per_user_limit):
+            self.stats["rejected_per_user"] += 1
+            raise AnalysisRejected("Too many concurrent analyses for this client", per_user=True)
+        if self.admitted >= self.max_concurrency + self.queue_limit:
+            self.stats["rejected"] += 1
+            raise AnalysisRejected("Analysis queue is full")
+        self.admitted += 1
+        self.per_user[key] = self.per_user.get(key, 0) + 1
+
+    def release(self, key: str):
+        self.admitted -= 1
+        remaining = self.per_user.get(key, 1) - 1
+        if remaining:
+            self.per_user[key] = remaining
+        else:
+            self.per_user.pop(key, None)
+
+    @asynccontextmanager
+    async def slot(self, timeout: Optional[float] = None):
+        """Wait for and hold one of the max_concurrency model slots"""
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_concurrency)
+        queued_at = time.perf_counter()
+        self.queued += 1
+        try:
+            with span("ai-queue"):
+                await asyncio.wait_for(self.slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise AnalysisTimeout("No analysis slot became free before the deadline")
+        finally:
+            self.queued -= 1
+        started = time.perf_counter()
+        self.queue_wait_ms.append((started - queued_at) * 1000)
+        self.running += 1
+        try:
+            with span("model"):
+                yield
+        finally:
+            self.running -= 1
+            self.slots.release()
+            self.model_ms.append((time.perf_counter() - started) * 1000)
+
+    async def execute(self, call: Callable[[], Awaitable[T]]) -> T:
+        async with self.slot():
+            return await call()
+
+    @asynccontextmanager
+    async def reserve(self, key: str, limit: Optional[int] = None, deadline: Optional[float] = None):
+        """Hold a slot for a streamed call; the caller enforces the deadline while streaming"""
+        self.admit(key, limit)
+        try:
+            async with self.slot(deadline or self.deadline):
+                yield
+        finally:
+            self.release(key)
+
+    def record_stream(self, ttft_ms: Optional[float]):
+        """Time to first token of a completed or abandoned stream"""
+        self.stats["streams"] += 1
+        if ttft_ms is not None:
+            self.ttft_ms.append(ttft_ms)
+
+    async def run(self, key: str, call: Callable[[], Awaitable[T]], request: Optional[Request] = None,
+                  deadline: Optional[float] = None, limit: Optional[int] = None) -> T:
+        """Run call() under the limits; `call` is only invoked once a slot is free.
+
+        `limit` overrides the per-key cap, e.g. for a region job's own parallelism.
+        """
+        self.admit(key, limit)
+        try:
+            work = asyncio.ensure_future(asyncio.wait_for(self.execute(call), deadline or self.deadline))
+            watcher = asyncio.ensure_future(self.watch_disconnect(request)) if request is not None else None
+            try:
+                done, _ = await asyncio.wait({work, watcher} - {None}, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                work.cancel()
+                raise
+            finally:
+                if watcher is not None:
+                    watcher.cancel()
+            if work not in done:
+                work.cancel()
+                self.stats["disconnects"] += 1
+                raise ClientDisconnected("Client closed the connection")
+            try:
+                result = work.result()
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                raise AnalysisTimeout("Analysis did not finish before its deadline")
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+            self.stats["completed"] += 1
+            return result
+        finally:
+            self.release(key)
+
+    @staticmethod
+    async def watch_disconnect(request: Request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "running": self.running,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "queue_limit": self.queue_limit,
+            "per_user_limit": self.per_user_limit,
+            "deadline_s": self.deadline,
+            "queue_wait_ms_p50": percentile(self.queue_wait_ms, 0.5),
+            "queue_wait_ms_p95": percentile(self.queue_wait_ms, 0.95),
+            "model_ms_p50": percentile(self.model_ms, 0.5),
+            "model_ms_p95": percentile(self.model_ms, 0.95),
+            "ttft_ms_p50": percentile(self.ttft_ms, 0.5),
+            "ttft_ms_p95": percentile(self.ttft_ms, 0.95),
+        }
+
+
+analysis_engine = AnalysisEngine()
@@ -1,11 +1,15 @@
+import asyncio
 from dotenv import load_dotenv
 import google.generativeai as genai
-from PIL import Image
-from io import BytesIO
 import os   
-from typing import Optional, List, Dict, Any
+from typing import AsyncIterator, Optional, List, Dict, Any
 
-class MarsImageAnalyzer:
+from ai.backends import AnalyzerBackend
+from ai.preprocess import prepare_tile
+from ai.prompts import ANALYZE_TILE_PROMPT, COMPARE_TILES_PROMPT, DETECT_FEATURES_PROMPT, GENERAL_FEATURES_PROMPT
+
+
+class MarsImageAnalyzer(AnalyzerBackend):
 
     load_dotenv()
     
@@ -15,106 +19,84 @@ class MarsImageAnalyzer:
             raise ValueError("GEMINI_API_KEY environment variable not set")
         
         genai.configure(api_key=api_key)
+        self.model_name = model_name
         self.model = genai.GenerativeModel(model_name)
     
+    async def analyze_mars_tile_parts(self, image_data: bytes, question: str, tile_info: Optional[Dict[str, Any]] = None) -> list:
+        img = await prepare_tile(image_data)
+        
+        context = ""
+        if tile_info:
+            z, x, y = tile_info.get('z'), tile_info.get('x'), tile_info.get('y')
+            dataset = tile_info.get('dataset', 'global')
+            context = f"\n\nContext: This is a Mars surface tile from the {dataset} dataset at zoom level {z}, tile coordinates ({x}, {y})."
+            if tile_info.get('mosaic'):
+                context += " The image shows that tile outlined in yellow at the centre of its neighbouring tiles; answer about the outlined tile and use the surroundings as context."
+        
+        return [ANALYZE_TILE_PROMPT.format(question=question, context=context), img]
+    
+    async def analyze_general_features_parts(self, image_data: bytes) -> list:
+        img = await prepare_tile(image_data)
+        return [GENERAL_FEATURES_PROMPT, img]
+    
+    async def detect_specific_features_parts(self, image_data: bytes, features: List[str]) -> list:
+        img = await prepare_tile(image_data)
+        features_str = ", ".join(features)
+        return [DETECT_FEATURES_PROMPT.format(features=features_str), img]
+    
+    async def compare_tiles_parts(self, image1_data: bytes, image2_data: bytes, tile1_info: Optional[Dict] = None, tile2_info: Optional[Dict] = None) -> list:
+        img1, img2 = await asyncio.gather(prepare_tile(image1_data), prepare_tile(image2_data))
+        
+        context = ""
+        if tile1_info and tile2_info:
+            context = f"""
+                Tile 1: {tile1_info.get('dataset')} dataset, zoom {tile1_info.get('z')}, coordinates ({tile1_info.get('x')}, {tile1_info.get('y')})
+                Tile 2: {tile2_info.get('dataset')} dataset, zoom {tile2_info.get('z')}, coordinates ({tile2_info.get('x')}, {tile2_info.get('y')})
+                """
+        
+        return [
+            COMPARE_TILES_PROMPT.format(context=context),
+            "First Mars tile:", img1,
+            "Second Mars tile:", img2
+        ]
+    
+    async def generate(self, parts: list) -> str:
+        response = await self.model.generate_content_async(parts)
+        return response.text
+    
     async def analyze_mars_tile(self, image_data: bytes, question: str,tile_info: Optional[Dict[str, Any]] = None) -> str:
         try:
-            img = Image.open(BytesIO(image_data))
-            
-            context = ""
-            if tile_info:
-                z, x, y = tile_info.get('z'), tile_info.get('x'), tile_info.get('y')
-                dataset = tile_info.get('dataset', 'global')
-                context = f"\n\nContext: This is a Mars surface tile from the {dataset} dataset at zoom level {z}, tile coordinates ({x}, {y})."
-            
-            prompt = f"""You are analyzing a Mars surface image. Please answer the following question with detailed, scientific observations.
-                Question: {question}{context}
-                Provide a thorough analysis including:
-                - Direct answer to the question
-                - Observable surface features (craters, rocks, terrain patterns)
-                - Geological characteristics
-                - Any notable formations or anomalies
-                - Scale and context of visible features
-                Be specific, accurate, and scientific in your response."""
-
-            response = self.model.generate_content([prompt, img])
-            return response.text
-        
+            return await self.generate(await self.analyze_mars_tile_parts(image_data, question, tile_info))
         except Exception as e:
             raise Exception(f"Failed to analyze image: {str(e)}")
     
     async def analyze_general_features(self, image_data: bytes) -> str:
         try:
-            img = Image.open(BytesIO(image_data))
-            
-            prompt = """Analyze this Mars surface image and provide a comprehensive description:
-
-                1. **Terrain Type**: Identify the type of terrain (plains, highlands, crater field, etc.)
-                2. **Surface Features**: List all visible geological features
-                3. **Craters**: Describe any impact craters (size, distribution, preservation state)
-                4. **Rocks and Boulders**: Note any visible rocks or boulder fields
-                5. **Color and Texture**: Describe surface coloration and texture patterns
-                6. **Geological Processes**: Identify signs of erosion, deposition, or other processes
-                7. **Notable Observations**: Any interesting or unusual features
-
-                Be detailed and scientific in your analysis."""
-
-            response = self.model.generate_content([prompt, img])
-            return response.text
-        
+            return await self.generate(await self.analyze_general_features_parts(image_data))
         except Exception as e:
             raise Exception(f"Failed to analyze features: {str(e)}")
     
     async def detect_specific_features(self, image_data: bytes, features: List[str]) -> str:
         try:
-            img = Image.open(BytesIO(image_data))
-            
-            features_str = ", ".join(features)
-            prompt = f"""Examine this Mars surface image and detect the following features: {features_str}
-
-                For each requested feature:
-                1. Presence: Is it visible in this image? (Yes/No/Possibly)
-                2. Location: Where in the image? (e.g., center, top-left, scattered)
-                3. Characteristics: Describe its appearance, size, and condition
-                4. Count/Distribution: If multiple, how many and how are they distributed?
-                5. Additional Notes: Any interesting observations
-
-                Be precise and thorough in your detection."""
-
-            response = self.model.generate_content([prompt, img])
-            return response.text
-        
+            return await self.generate(await self.detect_specific_features_parts(image_data, features))
         except Exception as e:
             raise Exception(f"Failed to detect features: {str(e)}")
     
     async def compare_tiles(self, image1_data: bytes, image2_data: bytes,tile1_info: Optional[Dict] = None,tile2_info: Optional[Dict] = None) -> str:
         try:
-            img1 = Image.open(BytesIO(image1_data))
-            img2 = Image.open(BytesIO(image2_data))
-            
-            context = ""
-            if tile1_info and tile2_info:
-                context = f"""
-                    Tile 1: {tile1_info.get('dataset')} dataset, zoom {tile1_info.get('z')}, coordinates ({tile1_info.get('x')}, {tile1_info.get('y')})
-                    Tile 2: {tile2_info.get('dataset')} dataset, zoom {tile2_info.get('z')}, coordinates ({tile2_info.get('x')}, {tile2_info.get('y')})
-                    """
-            
-            prompt = f"""Compare these two Mars surface images and identify:
-                {context}
-                1. **Similarities**: Common features, terrain types, or patterns
-                2. **Differences**: Distinct characteristics between the images
-                3. **Terrain Variation**: How does the landscape differ?
-                4. **Geological Features**: Different or similar geological structures
-                5. **Surface Conditions**: Variations in surface texture, color, or composition
-                6. **Scale Differences**: If at different zoom levels, describe what changes
-                Provide a detailed comparative analysis."""
-
-            response = self.model.generate_content([
-                prompt, 
-                "First Mars tile:", img1, 
-                "Second Mars tile:", img2
-            ])
-            return response.text
-        
+            return await self.generate(await self.compare_tiles_parts(image1_data, image2_data, tile1_info, tile2_info))
         except Exception as e:
-            raise Exception(f"Failed to compare images: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Failed to compare images: {str(e)}")
+    
+    async def stream(self, method: str, **kwargs) -> AsyncIterator[str]:
+        """Text chunks of `method`'s analysis as the model generates them"""
+        parts = await getattr(self, f"{method}_parts")(**kwargs)
+        response = await self.model.generate_content_async(parts, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety or finish metadata only)
+                continue
+            if text:
+                yield text
@@ -0,0 +1,423 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from redis.exceptions import RedisError
+
+from ai.backends import AnalyzerBackend
+from ai.analysis_cache import cached_analysis, normalize_features
+from ai.engine import AnalysisRejected, AnalysisTimeout, analysis_engine
+from planets.cache.tile_cache import get_redis_client
+from planets.service.tile_geometry import bbox_cover
+from planets.service.tile_service import acquire_tile
+from service.tracing import start_background
+
+# Region-scale feature detection jobs.
+#
+# A job covers a bbox at one zoom with tiles and runs detect_specific_features
+# on each, at most AI_JOB_CONCURRENCY at a time, through the analysis cache
+# and engine (so interactive requests still get their share of model slots).
+# Job state, per-tile results and their completion order live in Redis:
+#
+#   aijob:<id>           hash: status, dataset, zoom, bbox, features, counts
+#   aijob:<id>:results   hash: "x,y" -> result JSON
+#   aijob:<id>:order     list of "x,y" in completion order (result cursor)
+#   aijob:<id>:lease     owner token of the worker running the job
+#   aijob:active         ids of queued/running jobs
+#
+# Every worker periodically claims active jobs whose lease has lapsed, so a
+# job interrupted by a restart resumes and skips tiles that already have results.
+
+AI_JOB_CONCURRENCY = int(os.getenv("AI_JOB_CONCURRENCY", 4))
+AI_JOB_MAX_TILES = int(os.getenv("AI_JOB_MAX_TILES", 2000))
+JOB_TTL = 7 * 24 * 3600
+JOB_LEASE_MS = 30000
+JOB_SCAN_SECONDS = 15
+RETRY_DELAY = 2.0
+
+TERMINAL = ("done", "cancelled", "failed")
+
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+Tile = Tuple[int, int]
+
+
+def tile_field(tile: Tile) -> str:
+    return f"{tile[0]},{tile[1]}"
+
+
+def job_tiles(job: dict) -> List[Tile]:
+    west, south, east, north = job["bbox"]
+    return [(int(x), int(y)) for x, y in bbox_cover(west, south, east, north, job["zoom"])]
+
+
+def decode_job(raw: dict) -> dict:
+    job = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+           for k, v in raw.items()}
+    for field in ("bbox", "features"):
+        job[field] = json.loads(job[field])
+    for field in ("zoom", "total", "completed", "failed"):
+        job[field] = int(job.get(field, 0))
+    for field in ("created_at", "updated_at"):
+        job[field] = float(job[field])
+    return job
+
+
+class RedisJobStore:
+
+    def key(self, job_id: str, suffix: str = "") -> str:
+        return f"aijob:{job_id}{suffix}"
+
+    async def create(self, job: dict):
+        client = await get_redis_client()
+        fields = {**job, "bbox": json.dumps(job["bbox"]), "features": json.dumps(job["features"])}
+        pipe = client.pipeline()
+        pipe.hset(self.key(job["id"]), mapping=fields)
+        pipe.expire(self.key(job["id"]), JOB_TTL)
+        pipe.sadd("aijob:active", job["id"])
+        await pipe.execute()
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        client = await get_redis_client()
+        raw = await client.hgetall(self.key(job_id))
+        if not raw:
+            # The hash expired (JOB_TTL) while the id was still listed as active;
+            # drop it or the supervisor would keep claiming it forever
+            await client.srem("aijob:active", job_id)
+            return None
+        return decode_job(raw)
+
+    async def get_status(self, job_id: str) -> Optional[str]:
+        client = await get_redis_client()
+        status = await client.hget(self.key(job_id), "status")
+        return status.decode() if status else None
+
+    async def set_status(self, job_id: str, status: str, error: Optional[str] = None):
+        client = await get_redis_client()
+        pipe = client.pipeline()
+        pipe.hset(self.key(job_id), mapping={"status": status, "updated_at": time.time(), "error": error or ""})
+        if status in TERMINAL:
+            pipe.srem("aijob:active", job_id)
+        await pipe.execute()
+
+    async def record(self, job_id: str, tile: Tile, result: dict):
+        client = await get_redis_client()
+        field = tile_field(tile)
+        if not await client.hsetnx(self.key(job_id, ":results"), field, json.dumps(result)):
+            return
+        pipe = client.pipeline()
+        pipe.rpush(self.key(job_id, ":order"), field)
+        pipe.hincrby(self.key(job_id), "completed" if result["status"] == "ok" else "failed", 1)
+        pipe.hset(self.key(job_id), "updated_at", time.time())
+        for suffix in (":results", ":order"):
+            pipe.expire(self.key(job_id, suffix), JOB_TTL)
+        await pipe.execute()
+
+    async def done_tiles(self, job_id: str) -> Set[str]:
+        client = await get_redis_client()
+        return {field.decode() for field in await client.hkeys(self.key(job_id, ":results"))}
+
+    async def results(self, job_id: str, start: int, count: int) -> List[dict]:
+        client = await get_redis_client()
+        fields = await client.lrange(self.key(job_id, ":order"), start, start + count - 1)
+        if not fields:
+            return []
+        values = await client.hmget(self.key(job_id, ":results"), fields)
+        return [json.loads(value) for value in values if value]
+
+    async def active_ids(self) -> List[str]:
+        client = await get_redis_client()
+        return [job_id.decode() for job_id in await client.smembers("aijob:active")]
+
+    async def claim(self, job_id: str, token: str) -> bool:
+        client = await get_redis_client()
+        return bool(await client.set(self.key(job_id, ":lease"), token, nx=True, px=JOB_LEASE_MS))
+
+    async def renew(self, job_id: str, token: str) -> bool:
+        client = await get_redis_client()
+        return bool(await client.eval(RENEW_SCRIPT, 1, self.key(job_id, ":lease"), token, JOB_LEASE_MS))
+
+    async def release(self, job_id: str, token: str):
+        client = await get_redis_client()
+        await client.eval(RELEASE_SCRIPT, 1, self.key(job_id, ":lease"), token)
+
+
+class MemoryJobStore:
+    """Same interface as RedisJobStore, in process; for local runs and tests"""
+
+    def __init__(self):
+        self.jobs: Dict[str, dict] = {}
+        self.tile_results: Dict[str, Dict[str, dict]] = {}
+        self.order: Dict[str, List[str]] = {}
+        self.leases: Dict[str, str] = {}
+
+    async def create(self, job: dict):
+        self.jobs[job["id"]] = dict(job)
+        self.tile_results[job["id"]] = {}
+        self.order[job["id"]] = []
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
+
+    async def get_status(self, job_id: str) -> Optional[str]:
+        job = self.jobs.get(job_id)
+        return job["status"] if job else None
+
+    async def set_status(self, job_id: str, status: str, error: Optional[str] = None):
+        self.jobs[job_id].update(status=status, updated_at=time.time(), error=error or "")
+
+    async def record(self, job_id: str, tile: Tile, result: dict):
+        field = tile_field(tile)
+        if field in self.tile_results[job_id]:
+            return
+        self.tile_results[job_id][field] = result
+        self.order[job_id].append(field)
+        self.jobs[job_id]["completed" if result["status"] == "ok" else "failed"] += 1
+
+    async def done_tiles(self, job_id: str) -> Set[str]:
+        return set(self.tile_results[job_id])
+
+    async def results(self, job_id: str, start: int, count: int) -> List[dict]:
+        return [self.tile_results[job_id][field] for field in self.order[job_id][start:start + count]]
+
+    async def active_ids(self) -> List[str]:
+        return [job_id for job_id, job in self.jobs.items() if job["status"] not in TERMINAL]
+
+    async def claim(self, job_id: str, token: str) -> bool:
+        return self.leases.setdefault(job_id, token) == token
+
+    async def renew(self, job_id: str, token: str) -> bool:
+        return self.leases.get(job_id) == token
+
+    async def release(self, job_id: str, token: str):
+        if self.leases.get(job_id) == token:
+            del self.leases[job_id]
+
+
+class JobRunner:
+
+    def __init__(self, store, analyzer: Callable[[], AnalyzerBackend], acquire=acquire_tile,
+                 concurrency: int = AI_JOB_CONCURRENCY):
+        self.store = store
+        self.analyzer = analyzer
+        self.acquire = acquire
+        self.concurrency = concurrency
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.supervisor: Optional[asyncio.Task] = None
+
+    async def submit(self, dataset: str, bbox: Tuple[float, float, float, float], zoom: int,
+                     features: List[str], owner: str) -> dict:
+        """Create a job and start it here; raises ValueError for an empty or oversized region"""
+        features = normalize_features(features)
+        if not features:
+            raise ValueError("No features specified")
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "dataset": dataset,
+            "zoom": zoom,
+            "bbox": list(bbox),
+            "features": features,
+            "owner": owner,
+            "total": 0,
+            "completed": 0,
+            "failed": 0,
+            "error": "",
+            "created_at": now,
+            "updated_at": now,
+        }
+        job["total"] = len(job_tiles(job))
+        if job["total"] > AI_JOB_MAX_TILES:
+            raise ValueError(f"Region covers {job['total']} tiles; the limit is {AI_JOB_MAX_TILES}")
+        await self.store.create(job)
+        await self.start(job["id"])
+        return job
+
+    async def start(self, job_id: str):
+        if job_id in self.tasks:
+            return
+        token = uuid.uuid4().hex
+        if await self.store.claim(job_id, token):
+            # Started from a request (submit) or the supervisor; either way not part of a trace
+            task = start_background(self.run(job_id, token))
+            self.tasks[job_id] = task
+            task.add_done_callback(lambda _: self.tasks.pop(job_id, None))
+
+    async def cancel(self, job_id: str) -> bool:
+        """Mark the job cancelled; whichever worker runs it stops at its next tile"""
+        status = await self.store.get_status(job_id)
+        if status is None or status in TERMINAL:
+            return False
+        await self.store.set_status(job_id, "cancelled")
+        return True
+
+    async def run(self, job_id: str, token: str):
+        renewer = asyncio.create_task(self.keep_lease(job_id, token, asyncio.current_task()))
+        try:
+            job = await self.store.get(job_id)
+            if job is None or job["status"] in TERMINAL:
+                return
+            await self.store.set_status(job_id, "running")
+
+            done = await self.store.done_tiles(job_id)
+            pending = [tile for tile in job_tiles(job) if tile_field(tile) not in done]
+            slots = asyncio.Semaphore(self.concurrency)
+
+            async def process(tile: Tile):
+                async with slots:
+                    if await self.store.get_status(job_id) == "cancelled":
+                        return
+                    await self.store.record(job_id, tile, await self.analyze_tile(job, tile))
+
+            tasks = [asyncio.ensure_future(process(tile)) for tile in pending]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                # A store error (or losing the lease) ends the job here; stop the
+                # other tiles before it is marked failed or handed to another worker
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            if await self.store.get_status(job_id) == "running":
+                await self.store.set_status(job_id, "done")
+        except asyncio.CancelledError:
+            # Shutdown or lost lease: leave the job active so it resumes elsewhere
+            raise
+        except Exception as e:
+            await self.store.set_status(job_id, "failed", str(e))
+        finally:
+            renewer.cancel()
+            try:
+                await self.store.release(job_id, token)
+            except RedisError:
+                pass
+
+    async def keep_lease(self, job_id: str, token: str, task: asyncio.Task):
+        while True:
+            await asyncio.sleep(JOB_LEASE_MS / 3000)
+            try:
+                renewed = await self.store.renew(job_id, token)
+            except RedisError:
+                renewed = False
+            if not renewed:
+                task.cancel()
+                return
+
+    async def analyze_tile(self, job: dict, tile: Tile) -> dict:
+        x, y = tile
+        result = {"x": x, "y": y, "z": job["zoom"]}
+        try:
+            acquired = await self.acquire(job["dataset"], job["zoom"], x, y)
+        except Exception as e:
+            # One tile's fetch error is that tile's result, not the job's
+            return {**result, "status": "error", "error": f"Tile unavailable: {e}"}
+        if not acquired.data:
+            return {**result, "status": "error", "error": "Tile unavailable"}
+        image, features = acquired.data, job["features"]
+        analyzer = self.analyzer()
+
+        async def call_engine():
+            # Jobs yield to interactive requests: back off while the engine is full
+            while True:
+                try:
+                    return await analysis_engine.run(
+                        f"job:{job['id']}", lambda: analyzer.detect_specific_features(image, features), limit=self.concurrency
+                    )
+                except AnalysisRejected:
+                    await asyncio.sleep(RETRY_DELAY)
+
+        try:
+            analysis, status = await cached_analysis(
+                "detect_specific_features", analyzer.model_name, [image], {"features": features}, call_engine
+            )
+        except AnalysisTimeout as e:
+            return {**result, "status": "error", "error": str(e)}
+        except Exception as e:
+            return {**result, "status": "error", "error": f"Feature detection failed: {e}"}
+        return {**result, "status": "ok", "analysis": analysis, "analysis_cache": status}
+
+    async def supervise(self):
+        """Pick up active jobs nobody holds a lease on (e.g. after a restart)"""
+        while True:
+            try:
+                for job_id in await self.store.active_ids():
+                    await self.start(job_id)
+            except RedisError:
+                pass
+            await asyncio.sleep(JOB_SCAN_SECONDS)
+
+    def start_supervisor(self):
+        if self.supervisor is None:
+            self.supervisor = asyncio.create_task(self.supervise())
+
+    async def stop(self):
+        tasks = [task for task in (self.supervisor, *self.tasks.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.supervisor = None
+
+    def get_stats(self) -> dict:
+        return {"running_here": sorted(self.tasks), "concurrency": self.concurrency, "max_tiles": AI_JOB_MAX_TILES}
+
+
+# Local run with the stub model and synthetic tiles: no network, Redis or API key
+#   python -m ai.jobs --bbox=-80,-15,-30,0 --zoom 4 --features canyons,craters
+
+class FakeTile:
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+async def fake_acquire(dataset: str, z: int, x: int, y: int) -> FakeTile:
+    return FakeTile(f"{dataset}/{z}/{x}/{y}".encode())
+
+
+async def run_local(args):
+    from ai import analysis_cache
+    from ai.stub_analyzer import StubAnalyzer
+
+    async def no_redis():
+        raise RedisError("local run")
+
+    analysis_cache.get_redis_client = no_redis
+    stub = StubAnalyzer(latency_ms=args.latency * 1000, failure_rate=args.failure_rate)
+    runner = JobRunner(MemoryJobStore(), lambda: stub, acquire=fake_acquire, concurrency=args.concurrency)
+    west, south, east, north = (float(v) for v in args.bbox.split(","))
+    start = time.perf_counter()
+    job = await runner.submit(args.dataset, (west, south, east, north), args.zoom, args.features.split(","), "cli")
+    await asyncio.gather(*runner.tasks.values())
+    job = await runner.store.get(job["id"])
+    print(json.dumps({k: job[k] for k in ("status", "total", "completed", "failed")}))
+    print(f"{job['total']} tiles in {time.perf_counter() - start:.2f}s at concurrency {args.concurrency}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a region job locally against the stub model")
+    parser.add_argument("--dataset", default="global")
+    parser.add_argument("--bbox", required=True, help="west,south,east,north")
+    parser.add_argument("--zoom", type=int, default=4)
+    parser.add_argument("--features", default="craters,dunes")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=AI_JOB_CONCURRENCY)
+    asyncio.run(run_local(parser.parse_args()))
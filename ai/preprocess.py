@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from cachetools import LRUCache
+from PIL import Image, ImageDraw
+
+from planets.service.tile_geometry import grid_size
+from planets.service.tile_service import TileResult, acquire_tiles
+from service.tracing import span
+
+# Model inputs, prepared once per tile in a worker pool.
+#
+# Tiles are decoded, converted to RGB, scaled to at most AI_IMAGE_MAX_SIDE and
+# re-encoded as JPEG, then handed to the model as inline JPEG bytes instead of
+# PIL images (which the client SDK would re-encode on the event loop). A tile
+# that is already a small enough RGB JPEG is passed through untouched.
+# Prepared inputs are kept in an LRU keyed by the tile's sha256, so a tile
+# analyzed by several methods or users is only processed once per worker.
+#
+# Context mosaics put the target tile and its ring of neighbours on one canvas,
+# outline the target, and scale the result to AI_MOSAIC_PIXEL_BUDGET pixels.
+
+AI_IMAGE_MAX_SIDE = int(os.getenv("AI_IMAGE_MAX_SIDE", 768))
+AI_IMAGE_QUALITY = int(os.getenv("AI_IMAGE_QUALITY", 85))
+AI_MOSAIC_PIXEL_BUDGET = int(os.getenv("AI_MOSAIC_PIXEL_BUDGET", 768 * 768))
+AI_PREPROCESS_WORKERS = int(os.getenv("AI_PREPROCESS_WORKERS", 2))
+PREPARED_CACHE_SIZE = 512
+
+preprocess_executor: Optional[ProcessPoolExecutor] = None
+prepared_cache = LRUCache(maxsize=PREPARED_CACHE_SIZE)
+prepared_lock = threading.Lock()
+
+preprocess_stats = {
+    "prepared": 0,
+    "passthrough": 0,
+    "cache_hits": 0,
+    "mosaics": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "prepare_ms_total": 0.0,
+}
+
+
+def get_preprocess_executor() -> ProcessPoolExecutor:
+    global preprocess_executor
+    if preprocess_executor is None:
+        preprocess_executor = ProcessPoolExecutor(max_workers=AI_PREPROCESS_WORKERS)
+    return preprocess_executor
+
+
+def shutdown_preprocess_executor():
+    global preprocess_executor
+    if preprocess_executor is not None:
+        preprocess_executor.shutdown(wait=False, cancel_futures=True)
+        preprocess_executor = None
+
+
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def prepare_image(data: bytes, max_side: int, quality: int) -> Tuple[bytes, bool]:
+    """(JPEG bytes, passed through unchanged). Runs in the worker pool."""
+    img = Image.open(BytesIO(data))
+    if img.format == "JPEG" and img.mode in ("RGB", "L") and max(img.size) <= max_side:
+        return data, True
+    img = img.convert("RGB")
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    return encode_jpeg(img, quality), False
+
+
+def build_mosaic(tiles: Dict[Tuple[int, int], bytes], radius: int, pixel_budget: int, quality: int) -> bytes:
+    """tiles maps (dx, dy) offsets from the target to tile bytes; missing ones stay black.
+    Runs in the worker pool."""
+    decoded = {offset: Image.open(BytesIO(data)).convert("RGB") for offset, data in tiles.items()}
+    tile_size = max(max(img.size) for img in decoded.values())
+    side = 2 * radius + 1
+    scale = min(1.0, math.sqrt(pixel_budget) / (side * tile_size))
+    cell = max(1, int(tile_size * scale))
+
+    canvas = Image.new("RGB", (side * cell, side * cell))
+    for (dx, dy), img in decoded.items():
+        if img.size != (cell, cell):
+            img = img.resize((cell, cell), Image.LANCZOS)
+        canvas.paste(img, ((dx + radius) * cell, (dy + radius) * cell))
+
+    left = top = radius * cell
+    ImageDraw.Draw(canvas).rectangle(
+        [left, top, left + cell - 1, top + cell - 1], outline=(255, 255, 0), width=max(1, cell // 128)
+    )
+    return encode_jpeg(canvas, quality)
+
+
+def model_part(data: bytes) -> dict:
+    """Inline image part for generate_content"""
+    return {"mime_type": "image/jpeg", "data": data}
+
+
+async def prepare_tile(data: bytes) -> dict:
+    """Prepared model part for a tile, from the per-worker cache when possible"""
+    key = (hashlib.sha256(data).digest(), AI_IMAGE_MAX_SIDE, AI_IMAGE_QUALITY)
+    with prepared_lock:
+        prepared = prepared_cache.get(key)
+    if prepared is not None:
+        preprocess_stats["cache_hits"] += 1
+        return model_part(prepared)
+
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    with span("ai-prep"):
+        prepared, passthrough = await loop.run_in_executor(
+            get_preprocess_executor(), prepare_image, data, AI_IMAGE_MAX_SIDE, AI_IMAGE_QUALITY
+        )
+    preprocess_stats["prepare_ms_total"] += (time.perf_counter() - start) * 1000
+    preprocess_stats["passthrough" if passthrough else "prepared"] += 1
+    preprocess_stats["bytes_in"] += len(data)
+    preprocess_stats["bytes_out"] += len(prepared)
+    with prepared_lock:
+        prepared_cache[key] = prepared
+    return model_part(prepared)
+
+
+async def prepare_mosaic(dataset: str, z: int, x: int, y: int, radius: int = 1) -> Tuple[Optional[bytes], TileResult]:
+    """(JPEG of the target tile with its neighbours, the target tile's acquisition).
+    The mosaic is None if the target tile is unavailable."""
+    cols, rows = grid_size(z)
+    # At low zooms several offsets can wrap onto the same tile
+    placements = [
+        ((dataset, z, (x + dx) % cols, y + dy), (dx, dy))
+        for dy in range(-radius, radius + 1)
+        for dx in range(-radius, radius + 1)
+        if 0 <= y + dy < rows
+    ]
+
+    acquired = await acquire_tiles([tile for tile, _ in placements])
+    tiles = {offset: acquired[tile].data for tile, offset in placements if acquired[tile].data}
+    target = acquired[(dataset, z, x % cols, y)]
+    if (0, 0) not in tiles:
+        return None, target
+
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    with span("ai-prep"):
+        mosaic = await loop.run_in_executor(
+            get_preprocess_executor(), build_mosaic, tiles, radius, AI_MOSAIC_PIXEL_BUDGET, AI_IMAGE_QUALITY
+        )
+    preprocess_stats["prepare_ms_total"] += (time.perf_counter() - start) * 1000
+    preprocess_stats["mosaics"] += 1
+    return mosaic, target
+
+
+def get_preprocess_stats() -> dict:
+    stats = dict(preprocess_stats)
+    if stats["bytes_in"]:
+        stats["bytes_ratio"] = stats["bytes_out"] / stats["bytes_in"]
+    stats["cached"] = len(prepared_cache)
+    stats["max_side"] = AI_IMAGE_MAX_SIDE
+    stats["mosaic_pixel_budget"] = AI_MOSAIC_PIXEL_BUDGET
+    return stats
@@ -0,0 +1,59 @@
+import hashlib
+
+# Prompt templates for the analyzer methods. Cached analyses are keyed by a
+# digest of their template (ai/analysis_cache.py), so editing a template here
+# retires its cached results without a manual flush.
+
+ANALYZE_TILE_PROMPT = """You are analyzing a Mars surface image. Please answer the following question with detailed, scientific observations.
+                Question: {question}{context}
+                Provide a thorough analysis including:
+                - Direct answer to the question
+                - Observable surface features (craters, rocks, terrain patterns)
+                - Geological characteristics
+                - Any notable formations or anomalies
+                - Scale and context of visible features
+                Be specific, accurate, and scientific in your response."""
+
+GENERAL_FEATURES_PROMPT = """Analyze this Mars surface image and provide a comprehensive description:
+
+                1. **Terrain Type**: Identify the type of terrain (plains, highlands, crater field, etc.)
+                2. **Surface Features**: List all visible geological features
+                3. **Craters**: Describe any impact craters (size, distribution, preservation state)
+                4. **Rocks and Boulders**: Note any visible rocks or boulder fields
+                5. **Color and Texture**: Describe surface coloration and texture patterns
+                6. **Geological Processes**: Identify signs of erosion, deposition, or other processes
+                7. **Notable Observations**: Any interesting or unusual features
+
+                Be detailed and scientific in your analysis."""
+
+DETECT_FEATURES_PROMPT = """Examine this Mars surface image and detect the following features: {features}
+
+                For each requested feature:
+                1. Presence: Is it visible in this image? (Yes/No/Possibly)
+                2. Location: Where in the image? (e.g., center, top-left, scattered)
+                3. Characteristics: Describe its appearance, size, and condition
+                4. Count/Distribution: If multiple, how many and how are they distributed?
+                5. Additional Notes: Any interesting observations
+
+                Be precise and thorough in your detection."""
+
+COMPARE_TILES_PROMPT = """Compare these two Mars surface images and identify:
+                {context}
+                1. **Similarities**: Common features, terrain types, or patterns
+                2. **Differences**: Distinct characteristics between the images
+                3. **Terrain Variation**: How does the landscape differ?
+                4. **Geological Features**: Different or similar geological structures
+                5. **Surface Conditions**: Variations in surface texture, color, or composition
+                6. **Scale Differences**: If at different zoom levels, describe what changes
+                Provide a detailed comparative analysis."""
+
+PROMPT_TEMPLATES = {
+    "analyze_mars_tile": ANALYZE_TILE_PROMPT,
+    "analyze_general_features": GENERAL_FEATURES_PROMPT,
+    "detect_specific_features": DETECT_FEATURES_PROMPT,
+    "compare_tiles": COMPARE_TILES_PROMPT,
+}
+
+
+def prompt_version(method: str) -> str:
+    return hashlib.sha1(PROMPT_TEMPLATES[method].encode()).hexdigest()[:12]
@@ -1,22 +1,26 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel, Field
-from typing import List
+from contextlib import contextmanager
+from typing import Awaitable, Callable, List, Optional, Tuple
 
-from ai.gemini_analyzer import MarsImageAnalyzer
-from planets.cache.tile_cache import get_cached_tile_data
-from planets.service.mars_service import get_nasa_tile_url
-from service.image_service import fetch_data_from_url
+from ai.backends import get_analyzer, get_analyzer_stats
+from ai.engine import AnalysisRejected, AnalysisTimeout, ClientDisconnected, analysis_engine, client_key
+from ai import analysis_cache
+from ai.prompts import PROMPT_TEMPLATES
+from ai.preprocess import get_preprocess_stats, prepare_mosaic
+from ai.analysis_cache import cached_analysis, find_analysis, get_analysis_cache_stats, normalize_features, normalize_question
+from ai.similarity import find_similar, get_similarity_stats, remember
+from planets.service.tile_service import TileResult, acquire_tile, acquire_tiles
 
 router = APIRouter(prefix="/ai", tags=["AI Analysis"])
 
-analyzer = MarsImageAnalyzer()
-
 class TileAnalysisRequest(BaseModel):
     dataset: str = Field(default="global", description="Dataset name (e.g., 'global')")
     z: int = Field(..., ge=0, le=14, description="Zoom level (0-14)")
     x: int = Field(..., ge=0, description="Tile X coordinate")
     y: int = Field(..., ge=0, description="Tile Y coordinate")
     question: str = Field(..., min_length=1, description="Question about the Mars surface")
+    context_mosaic: bool = Field(default=False, description="Send the tile inside a mosaic of its neighbours")
 
 class GeneralAnalysisRequest(BaseModel):
     dataset: str = Field(default="global")
@@ -40,41 +44,120 @@ class AnalysisResponse(BaseModel):
     analysis: str
     tile_info: dict
     cache_status: str
+    analysis_cache: Optional[str] = None
+    tile_provenance: Optional[dict] = None
+    similar_tile: Optional[dict] = None
 
 class ComparisonResponse(BaseModel):
     status: str
     comparison: str
     tile1_info: dict
     tile2_info: dict
+    analysis_cache: Optional[str] = None
+    tile_provenance: Optional[dict] = None
 
 
-async def fetch_tile_image(dataset: str, z: int, x: int, y: int) -> bytes:
-    cached_data = await get_cached_tile_data(dataset, z, x, y)
-    if cached_data:
-        return cached_data
-    
-    # Fetch from NASA
-    nasa_url = get_nasa_tile_url(z, x, y, dataset)
-    data = await fetch_data_from_url(nasa_url)
-    
-    if not data:
+async def fetch_tile_image(dataset: str, z: int, x: int, y: int) -> TileResult:
+    tile = await acquire_tile(dataset, z, x, y)
+    if not tile.data:
         raise HTTPException(
             status_code=404, 
             detail=f"Could not fetch tile: {dataset}/{z}/{x}/{y}"
         )
-    
-    return data
+    return tile
+
+
+async def fetch_tile_images(*tiles: Tuple[str, int, int, int]) -> List[TileResult]:
+    """Acquire several tiles concurrently, in the order given"""
+    acquired = await acquire_tiles(list(tiles))
+    for dataset, z, x, y in tiles:
+        if not acquired[(dataset, z, x, y)].data:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Could not fetch tile: {dataset}/{z}/{x}/{y}"
+            )
+    return [acquired[tile] for tile in tiles]
+
+
+async def run_analysis(http_request: Request, method: str, images: List[bytes], inputs: dict,
+                       call: Callable[[], Awaitable[str]]) -> Tuple[str, str]:
+    """(analysis, analysis cache status); misses queue on the analysis engine, whose limits map to HTTP errors"""
+    with engine_errors():
+        return await cached_analysis(
+            method, get_analyzer().model_name, images, inputs,
+            lambda: analysis_engine.run(client_key(http_request), call, request=http_request)
+        )
+
+
+async def run_similar_analysis(http_request: Request, method: str, image: bytes, source: dict,
+                               call: Callable[[], Awaitable[str]]) -> Tuple[str, str, Optional[dict]]:
+    """run_analysis for a single-tile method without inputs, where an exact-cache miss may be
+    served from a perceptually similar tile: (analysis, status incl. "SIMILAR", similar tile marker)"""
+    model = get_analyzer().model_name
+    lookup = await find_analysis(method, model, [image], {})
+    value = None
+    if lookup.text is None:
+        # Register before fingerprinting so identical requests arriving meanwhile wait for this one
+        lookup.begin()
+        try:
+            match, value = await find_similar(lookup, model, image)
+        except BaseException as e:
+            lookup.fail(e)
+            raise
+        if match is not None:
+            lookup.share(match.text)
+            return match.text, "SIMILAR", match.marker()
+        with engine_errors():
+            try:
+                text = await analysis_engine.run(client_key(http_request), call, request=http_request)
+            except BaseException as e:
+                lookup.fail(e)
+                raise
+        await lookup.finish(text)
+    await remember(lookup, model, image, source, value)
+    return lookup.text, lookup.status, None
+
+
+@contextmanager
+def engine_errors():
+    try:
+        yield
+    except AnalysisRejected as e:
+        raise HTTPException(status_code=429 if e.per_user else 503, detail=str(e), headers={"Retry-After": "5"})
+    except AnalysisTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientDisconnected as e:
+        raise HTTPException(status_code=499, detail=str(e))
+
+
+@router.get("/stats")
+async def analysis_stats():
+    """Analysis queue depth, rejections, latency percentiles and cache hit rate"""
+    return {
+        **analysis_engine.get_stats(),
+        "cache": get_analysis_cache_stats(),
+        "preprocess": get_preprocess_stats(),
+        "backend": get_analyzer_stats(),
+        "similarity": get_similarity_stats(),
+    }
+
+
+@router.post("/cache/invalidate")
+async def invalidate_analysis_cache(
+    method: Optional[str] = Query(None, description="Analyzer method; all methods if omitted")
+):
+    if method is not None and method not in PROMPT_TEMPLATES:
+        raise HTTPException(status_code=400, detail=f"Unknown method {method}")
+    try:
+        invalidated = await analysis_cache.invalidate([method] if method else None)
+        return {"message": "Analysis cache invalidated.", "methods": invalidated}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/analyze-tile", response_model=AnalysisResponse)
-async def analyze_mars_tile(request: TileAnalysisRequest):
+async def analyze_mars_tile(request: TileAnalysisRequest, http_request: Request):
     try:
-        image_data = await fetch_tile_image(request.dataset, request.z, request.x, request.y)
-        
-        cache_status = "HIT" if await get_cached_tile_data(
-            request.dataset, request.z, request.x, request.y
-        ) else "MISS"
-        
         tile_info = {
             "dataset": request.dataset,
             "z": request.z,
@@ -82,17 +165,35 @@ async def analyze_mars_tile(request: TileAnalysisRequest):
             "y": request.y
         }
         
-        analysis = await analyzer.analyze_mars_tile(
-            image_data=image_data,
-            question=request.question,
-            tile_info=tile_info
+        if request.context_mosaic:
+            image_data, tile = await prepare_mosaic(request.dataset, request.z, request.x, request.y)
+            if image_data is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Could not fetch tile: {request.dataset}/{request.z}/{request.x}/{request.y}"
+                )
+            tile_info["mosaic"] = True
+        else:
+            tile = await fetch_tile_image(request.dataset, request.z, request.x, request.y)
+            image_data = tile.data
+        
+        analysis, analysis_status = await run_analysis(
+            http_request, "analyze_mars_tile", [image_data],
+            {"question": normalize_question(request.question), "tile": tile_info},
+            lambda: get_analyzer().analyze_mars_tile(
+                image_data=image_data,
+                question=request.question,
+                tile_info=tile_info
+            )
         )
         
         return AnalysisResponse(
             status="success",
             analysis=analysis,
             tile_info=tile_info,
-            cache_status=cache_status
+            cache_status=tile.cache_status,
+            analysis_cache=analysis_status,
+            tile_provenance=tile.provenance()
         )
     
     except HTTPException:
@@ -105,15 +206,10 @@ async def analyze_mars_tile(request: TileAnalysisRequest):
 
 
 @router.post("/analyze-features", response_model=AnalysisResponse)
-async def analyze_general_features(request: GeneralAnalysisRequest):
+async def analyze_general_features(request: GeneralAnalysisRequest, http_request: Request):
     try:
-        image_data = await fetch_tile_image(request.dataset, request.z, request.x, request.y)
-        
-        cache_status = "HIT" if await get_cached_tile_data(
-            request.dataset, request.z, request.x, request.y
-        ) else "MISS"
-        
-        analysis = await analyzer.analyze_general_features(image_data)
+        tile = await fetch_tile_image(request.dataset, request.z, request.x, request.y)
+        image_data = tile.data
         
         tile_info = {
             "dataset": request.dataset,
@@ -122,11 +218,19 @@ async def analyze_general_features(request: GeneralAnalysisRequest):
             "y": request.y
         }
         
+        analysis, analysis_status, similar_tile = await run_similar_analysis(
+            http_request, "analyze_general_features", image_data, tile_info,
+            lambda: get_analyzer().analyze_general_features(image_data)
+        )
+        
         return AnalysisResponse(
             status="success",
             analysis=analysis,
             tile_info=tile_info,
-            cache_status=cache_status
+            cache_status=tile.cache_status,
+            analysis_cache=analysis_status,
+            tile_provenance=tile.provenance(),
+            similar_tile=similar_tile
         )
     
     except HTTPException:
@@ -139,18 +243,19 @@ async def analyze_general_features(request: GeneralAnalysisRequest):
 
 
 @router.post("/detect-features", response_model=AnalysisResponse)
-async def detect_specific_features(request: FeatureDetectionRequest):
+async def detect_specific_features(request: FeatureDetectionRequest, http_request: Request):
     try:
         if not request.features:
             raise HTTPException(status_code=400, detail="No features specified")
         
-        image_data = await fetch_tile_image(request.dataset, request.z, request.x, request.y)
+        tile = await fetch_tile_image(request.dataset, request.z, request.x, request.y)
+        image_data = tile.data
         
-        cache_status = "HIT" if await get_cached_tile_data(
-            request.dataset, request.z, request.x, request.y
-        ) else "MISS"
-        
-        analysis = await analyzer.detect_specific_features(image_data, request.features)
+        features = normalize_features(request.features)
+        analysis, analysis_status = await run_analysis(
+            http_request, "detect_specific_features", [image_data], {"features": features},
+            lambda: get_analyzer().detect_specific_features(image_data, features)
+        )
         
         tile_info = {
             "dataset": request.dataset,
@@ -164,7 +269,9 @@ async def detect_specific_features(request: FeatureDetectionRequest):
             status="success",
             analysis=analysis,
             tile_info=tile_info,
-            cache_status=cache_status
+            cache_status=tile.cache_status,
+            analysis_cache=analysis_status,
+            tile_provenance=tile.provenance()
         )
     
     except HTTPException:
@@ -177,7 +284,7 @@ async def detect_specific_features(request: FeatureDetectionRequest):
 
 
 @router.post("/compare-tiles", response_model=ComparisonResponse)
-async def compare_mars_tiles(request: TileComparisonRequest):
+async def compare_mars_tiles(request: TileComparisonRequest, http_request: Request):
     try:
         tile1 = request.tile1
         tile2 = request.tile2
@@ -190,25 +297,29 @@ async def compare_mars_tiles(request: TileComparisonRequest):
                     detail=f"{name} missing required keys: {required_keys}"
                 )
         
-        image1_data = await fetch_tile_image(
-            tile1['dataset'], tile1['z'], tile1['x'], tile1['y']
-        )
-        image2_data = await fetch_tile_image(
-            tile2['dataset'], tile2['z'], tile2['x'], tile2['y']
+        first, second = await fetch_tile_images(
+            (tile1['dataset'], tile1['z'], tile1['x'], tile1['y']),
+            (tile2['dataset'], tile2['z'], tile2['x'], tile2['y'])
         )
+        image1_data, image2_data = first.data, second.data
         
-        comparison = await analyzer.compare_tiles(
-            image1_data=image1_data,
-            image2_data=image2_data,
-            tile1_info=tile1,
-            tile2_info=tile2
+        comparison, analysis_status = await run_analysis(
+            http_request, "compare_tiles", [image1_data, image2_data], {"tile1": tile1, "tile2": tile2},
+            lambda: get_analyzer().compare_tiles(
+                image1_data=image1_data,
+                image2_data=image2_data,
+                tile1_info=tile1,
+                tile2_info=tile2
+            )
         )
         
         return ComparisonResponse(
             status="success",
             comparison=comparison,
             tile1_info=tile1,
-            tile2_info=tile2
+            tile2_info=tile2,
+            analysis_cache=analysis_status,
+            tile_provenance={"tile1": first.provenance(), "tile2": second.provenance()}
         )
     
     except HTTPException:
@@ -222,17 +333,20 @@ async def compare_mars_tiles(request: TileComparisonRequest):
 
 @router.get("/analyze", response_model=AnalysisResponse)
 async def analyze_tile_get(
+    http_request: Request,
     dataset: str = Query(default="global"),
     z: int = Query(..., ge=0, le=14),
     x: int = Query(..., ge=0),
     y: int = Query(..., ge=0),
-    question: str = Query(..., min_length=1)
+    question: str = Query(..., min_length=1),
+    context_mosaic: bool = Query(default=False)
 ):
     request = TileAnalysisRequest(
         dataset=dataset,
         z=z,
         x=x,
         y=y,
-        question=question
+        question=question,
+        context_mosaic=context_mosaic
     )
-    return await analyze_mars_tile(request)
\ No newline at end of file
+    return await analyze_mars_tile(request, http_request)
\ No newline at end of file
@@ -0,0 +1,114 @@
+import asyncio
+import json
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from redis.exceptions import RedisError
+
+from ai.engine import client_key
+from ai.jobs import TERMINAL, JobRunner, RedisJobStore
+from ai.backends import get_analyzer
+from planets.service.tile_geometry import parse_bbox
+
+router = APIRouter(prefix="/ai/jobs", tags=["AI Analysis"])
+
+job_runner = JobRunner(RedisJobStore(), get_analyzer)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+STREAM_POLL_SECONDS = 1.0
+
+
+class RegionJobRequest(BaseModel):
+    dataset: str = Field(default="global")
+    bbox: str = Field(..., description="west,south,east,north; west > east crosses the antimeridian")
+    z: int = Field(..., ge=0, le=14)
+    features: List[str] = Field(..., description="Features to detect (e.g., ['craters', 'dunes'])")
+
+
+async def get_job_or_404(job_id: str) -> dict:
+    try:
+        job = await job_runner.store.get(job_id)
+    except RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("")
+async def create_region_job(request: RegionJobRequest, http_request: Request):
+    try:
+        bbox = parse_bbox(request.bbox)
+        return await job_runner.submit(request.dataset, bbox, request.z, request.features, client_key(http_request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@router.get("/{job_id}")
+async def get_region_job(job_id: str):
+    return await get_job_or_404(job_id)
+
+
+@router.delete("/{job_id}")
+async def cancel_region_job(job_id: str):
+    await get_job_or_404(job_id)
+    if not await job_runner.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job already finished")
+    return {"message": "Job cancelled."}
+
+
+@router.get("/{job_id}/results")
+async def get_region_job_results(
+    job_id: str,
+    cursor: Optional[int] = Query(None, ge=0, description="next_cursor from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    job = await get_job_or_404(job_id)
+    start = cursor or 0
+    results = await job_runner.store.results(job_id, start, limit)
+    finished = job["completed"] + job["failed"]
+    more = start + len(results) < finished or job["status"] not in TERMINAL
+    return {
+        "job": job,
+        "results": results,
+        # Results are appended as tiles finish; a running job keeps handing out a cursor
+        "next_cursor": start + len(results) if more else None,
+    }
+
+
+async def stream_job(request: Request, job_id: str, start: int):
+    position = start
+    while True:
+        job = await job_runner.store.get(job_id)
+        if job is None:
+            return
+        results = await job_runner.store.results(job_id, position, MAX_PAGE_SIZE)
+        for result in results:
+            yield f"event: result\ndata: {json.dumps(result)}\n\n".encode()
+        position += len(results)
+        progress = {k: job[k] for k in ("status", "total", "completed", "failed")}
+        yield f"event: progress\ndata: {json.dumps(progress)}\n\n".encode()
+        if job["status"] in TERMINAL and position >= job["completed"] + job["failed"]:
+            return
+        if not results:
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(STREAM_POLL_SECONDS)
+
+
+@router.get("/{job_id}/stream")
+async def stream_region_job(
+    request: Request,
+    job_id: str,
+    cursor: Optional[int] = Query(None, ge=0, description="Resume after this many results")
+):
+    await get_job_or_404(job_id)
+    return StreamingResponse(
+        stream_job(request, job_id, cursor or 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
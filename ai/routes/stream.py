@@ -0,0 +1,254 @@
+import asyncio
+import json
+from contextlib import suppress
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, List, Optional
+
+from ai.backends import get_analyzer
+from ai.analysis_cache import find_analysis, normalize_features, normalize_question
+from ai.engine import AnalysisRejected, AnalysisTimeout, ClientDisconnected, analysis_engine, client_key
+from ai.preprocess import prepare_mosaic
+from ai.similarity import find_similar, remember
+from ai.routes.gemeni import (
+    FeatureDetectionRequest, GeneralAnalysisRequest, TileAnalysisRequest, TileComparisonRequest,
+    fetch_tile_image, fetch_tile_images,
+)
+
+# Server-Sent Event variants of the /ai analysis endpoints.
+#
+# Events: `chunk` ({"text"}) as the model produces text, `done` with the same
+# metadata as the JSON endpoints, and `error` ({"status", "detail"}) carrying
+# the HTTP status the JSON endpoint would have returned. A `: heartbeat`
+# comment is sent whenever the model is quiet for HEARTBEAT_SECONDS, which is
+# also when a silently closed connection is noticed and the model call dropped.
+# Cached analyses, and ones an identical in-flight request is producing, arrive
+# as a single chunk; a completed stream is written to the analysis cache.
+
+router = APIRouter(prefix="/ai/stream", tags=["AI Analysis"])
+
+HEARTBEAT_SECONDS = 15
+
+
+def sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def event_stream(body: AsyncIterator[bytes]) -> StreamingResponse:
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def generate_chunks(request: Request, method: str, kwargs: dict, deadline: float) -> AsyncIterator[Optional[str]]:
+    """Model text chunks, with None for each quiet HEARTBEAT_SECONDS; enforces the deadline
+    (an event-loop time) between chunks and stops the call if the client went away"""
+    loop = asyncio.get_running_loop()
+    chunks = get_analyzer().stream(method, **kwargs)
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(chunks.__anext__())
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise AnalysisTimeout("Analysis did not finish before its deadline")
+            done, _ = await asyncio.wait({pending}, timeout=min(HEARTBEAT_SECONDS, remaining))
+            if not done:
+                if await request.is_disconnected():
+                    raise ClientDisconnected("Client closed the connection")
+                yield None
+                continue
+            try:
+                text = pending.result()
+            except StopAsyncIteration:
+                return
+            pending = None
+            yield text
+    finally:
+        if pending is not None:
+            pending.cancel()
+            with suppress(BaseException):
+                await pending
+        with suppress(Exception):
+            await chunks.aclose()
+
+
+async def stream_analysis(request: Request, method: str, images: List[bytes], inputs: dict,
+                          kwargs: dict, summary: dict, similar_source: Optional[dict] = None) -> AsyncIterator[bytes]:
+    """SSE body for one analysis; `summary` is merged into the `done` event. With `similar_source`
+    (the tile's info) a miss may be served from a perceptually similar tile, as in run_similar_analysis."""
+    model = get_analyzer().model_name
+    lookup = await find_analysis(method, model, images, inputs)
+    value = None
+    if lookup.text is None and similar_source is not None:
+        # Register before fingerprinting so identical requests arriving meanwhile wait for this one
+        lookup.begin()
+        try:
+            match, value = await find_similar(lookup, model, images[0])
+        except BaseException as e:
+            lookup.fail(e)
+            raise
+        if match is not None:
+            lookup.share(match.text)
+            yield sse("chunk", {"text": match.text})
+            yield sse("done", {**summary, "analysis_cache": "SIMILAR", "similar_tile": match.marker()})
+            return
+    if lookup.text is not None:
+        if similar_source is not None:
+            await remember(lookup, model, images[0], similar_source)
+        yield sse("chunk", {"text": lookup.text})
+        yield sse("done", {**summary, "analysis_cache": lookup.status})
+        return
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + analysis_engine.deadline
+    ttft_ms: Optional[float] = None
+    pieces: List[str] = []
+    if lookup.future is None:
+        lookup.begin()
+    try:
+        async with analysis_engine.reserve(client_key(request), deadline=analysis_engine.deadline):
+            async for text in generate_chunks(request, method, kwargs, deadline):
+                if text is None:
+                    yield b": heartbeat\n\n"
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = (loop.time() - started) * 1000
+                pieces.append(text)
+                yield sse("chunk", {"text": text})
+    except AnalysisRejected as e:
+        lookup.fail(e)
+        yield sse("error", {"status": 429 if e.per_user else 503, "detail": str(e)})
+        return
+    except AnalysisTimeout as e:
+        lookup.fail(e)
+        analysis_engine.stats["timeouts"] += 1
+        analysis_engine.record_stream(ttft_ms)
+        yield sse("error", {"status": 504, "detail": str(e)})
+        return
+    except ClientDisconnected as e:
+        lookup.fail(e)
+        analysis_engine.stats["disconnects"] += 1
+        analysis_engine.record_stream(ttft_ms)
+        return
+    except Exception as e:
+        lookup.fail(e)
+        analysis_engine.stats["errors"] += 1
+        analysis_engine.record_stream(ttft_ms)
+        yield sse("error", {"status": 500, "detail": f"Analysis failed: {str(e)}"})
+        return
+    except BaseException:
+        # Cancelled or closed by the server when the client disconnected mid-write
+        lookup.fail(ClientDisconnected("Client closed the connection"))
+        analysis_engine.stats["disconnects"] += 1
+        analysis_engine.record_stream(ttft_ms)
+        raise
+
+    analysis_engine.stats["completed"] += 1
+    analysis_engine.record_stream(ttft_ms)
+    await lookup.finish("".join(pieces))
+    if similar_source is not None:
+        await remember(lookup, model, images[0], similar_source, value)
+    yield sse("done", {**summary, "analysis_cache": "MISS"})
+
+
+@router.post("/analyze-tile")
+async def stream_mars_tile(request: TileAnalysisRequest, http_request: Request):
+    tile_info = {
+        "dataset": request.dataset,
+        "z": request.z,
+        "x": request.x,
+        "y": request.y
+    }
+
+    if request.context_mosaic:
+        image_data, tile = await prepare_mosaic(request.dataset, request.z, request.x, request.y)
+        if image_data is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Could not fetch tile: {request.dataset}/{request.z}/{request.x}/{request.y}"
+            )
+        tile_info["mosaic"] = True
+    else:
+        tile = await fetch_tile_image(request.dataset, request.z, request.x, request.y)
+        image_data = tile.data
+
+    return event_stream(stream_analysis(
+        http_request, "analyze_mars_tile", [image_data],
+        {"question": normalize_question(request.question), "tile": tile_info},
+        {"image_data": image_data, "question": request.question, "tile_info": tile_info},
+        {"tile_info": tile_info, "cache_status": tile.cache_status, "tile_provenance": tile.provenance()}
+    ))
+
+
+@router.post("/analyze-features")
+async def stream_general_features(request: GeneralAnalysisRequest, http_request: Request):
+    tile = await fetch_tile_image(request.dataset, request.z, request.x, request.y)
+    tile_info = {
+        "dataset": request.dataset,
+        "z": request.z,
+        "x": request.x,
+        "y": request.y
+    }
+
+    return event_stream(stream_analysis(
+        http_request, "analyze_general_features", [tile.data], {},
+        {"image_data": tile.data},
+        {"tile_info": tile_info, "cache_status": tile.cache_status, "tile_provenance": tile.provenance()},
+        similar_source=tile_info
+    ))
+
+
+@router.post("/detect-features")
+async def stream_specific_features(request: FeatureDetectionRequest, http_request: Request):
+    if not request.features:
+        raise HTTPException(status_code=400, detail="No features specified")
+
+    tile = await fetch_tile_image(request.dataset, request.z, request.x, request.y)
+    features = normalize_features(request.features)
+    tile_info = {
+        "dataset": request.dataset,
+        "z": request.z,
+        "x": request.x,
+        "y": request.y,
+        "features_searched": request.features
+    }
+
+    return event_stream(stream_analysis(
+        http_request, "detect_specific_features", [tile.data], {"features": features},
+        {"image_data": tile.data, "features": features},
+        {"tile_info": tile_info, "cache_status": tile.cache_status, "tile_provenance": tile.provenance()}
+    ))
+
+
+@router.post("/compare-tiles")
+async def stream_tile_comparison(request: TileComparisonRequest, http_request: Request):
+    tile1 = request.tile1
+    tile2 = request.tile2
+
+    required_keys = ['dataset', 'z', 'x', 'y']
+    for tile, name in [(tile1, 'tile1'), (tile2, 'tile2')]:
+        if not all(k in tile for k in required_keys):
+            raise HTTPException(
+                status_code=400,
+                detail=f"{name} missing required keys: {required_keys}"
+            )
+
+    first, second = await fetch_tile_images(
+        (tile1['dataset'], tile1['z'], tile1['x'], tile1['y']),
+        (tile2['dataset'], tile2['z'], tile2['x'], tile2['y'])
+    )
+
+    return event_stream(stream_analysis(
+        http_request, "compare_tiles", [first.data, second.data], {"tile1": tile1, "tile2": tile2},
+        {"image1_data": first.data, "image2_data": second.data, "tile1_info": tile1, "tile2_info": tile2},
+        {
+            "tile1_info": tile1,
+            "tile2_info": tile2,
+            "tile_provenance": {"tile1": first.provenance(), "tile2": second.provenance()}
+        }
+    ))
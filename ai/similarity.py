@@ -0,0 +1,199 @@
+import asyncio
+import os
+import threading
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ai.analysis_cache import AnalysisLookup
+from ai.preprocess import get_preprocess_executor
+from service.tracing import traced
+
+# Reuse of general-feature analyses across visually near-identical tiles.
+#
+# Every tile that gets a general-feature analysis is fingerprinted with a 64-bit
+# DCT perceptual hash (pHash) and added to a per-worker index: one contiguous
+# uint64 array of hashes, searched by XOR + popcount over the whole array, so a
+# lookup is a few vectorized passes even at AI_SIMILAR_MAX_ENTRIES. When a tile
+# misses the exact analysis cache, an indexed tile within AI_SIMILAR_MAX_DISTANCE
+# differing bits (out of 64) lends its analysis, marked as coming from a similar
+# tile. Entries only match lookups with the same model, prompt version and
+# cache generation, so invalidation and prompt edits also retire them. The
+# index is a ring: once full, the oldest entries are overwritten.
+#
+# AI_SIMILAR_MAX_DISTANCE=-1 turns reuse off (tiles are then not fingerprinted).
+
+AI_SIMILAR_MAX_DISTANCE = int(os.getenv("AI_SIMILAR_MAX_DISTANCE", 4))
+AI_SIMILAR_MAX_ENTRIES = int(os.getenv("AI_SIMILAR_MAX_ENTRIES", 50000))
+PHASH_SIZE = 32
+PHASH_BITS = 8
+
+
+def dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+DCT = dct_matrix(PHASH_SIZE)
+BIT_WEIGHTS = (np.uint64(1) << np.arange(PHASH_BITS * PHASH_BITS, dtype=np.uint64)).reshape(PHASH_BITS, PHASH_BITS)
+POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def phash(data: bytes) -> int:
+    """64-bit perceptual hash: low frequencies of the 32x32 grayscale DCT against their median.
+    Runs in the worker pool."""
+    img = Image.open(BytesIO(data)).convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS)
+    pixels = np.asarray(img, dtype=np.float64)
+    low = (DCT @ pixels @ DCT.T)[:PHASH_BITS, :PHASH_BITS]
+    # The DC term is overall brightness; leave it out of the median
+    bits = low > np.median(low.ravel()[1:])
+    return int(BIT_WEIGHTS[bits].sum(dtype=np.uint64))
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return POPCOUNT8[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class SimilarMatch:
+
+    __slots__ = ("text", "source", "distance")
+
+    def __init__(self, text: str, source: dict, distance: int):
+        self.text = text
+        self.source = source
+        self.distance = distance
+
+    def marker(self) -> dict:
+        return {"tile": self.source, "distance": self.distance, "max_distance": AI_SIMILAR_MAX_DISTANCE}
+
+
+class SimilarityIndex:
+
+    def __init__(self, capacity: int = AI_SIMILAR_MAX_ENTRIES):
+        self.capacity = capacity
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.tags = np.zeros(0, dtype=np.int32)
+        self.entries: List[Optional[Tuple[bytes, str, dict]]] = []
+        self.by_digest: Dict[Tuple[bytes, int], int] = {}
+        self.tag_ids: Dict[str, int] = {}
+        self.size = 0
+        self.next = 0
+        self.text_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "added": 0, "evicted": 0}
+
+    def tag_id(self, tag: str) -> int:
+        return self.tag_ids.setdefault(tag, len(self.tag_ids))
+
+    def contains(self, digest: bytes, tag: str) -> bool:
+        return (digest, self.tag_ids.get(tag, -1)) in self.by_digest
+
+    def grow(self):
+        size = min(self.capacity, max(1024, 2 * len(self.hashes)))
+        self.hashes = np.concatenate([self.hashes, np.zeros(size - len(self.hashes), dtype=np.uint64)])
+        self.tags = np.concatenate([self.tags, np.full(size - len(self.tags), -1, dtype=np.int32)])
+        self.entries.extend([None] * (size - len(self.entries)))
+
+    def add(self, fingerprint: int, digest: bytes, tag: str, text: str, source: dict):
+        with self.lock:
+            tag = self.tag_id(tag)
+            if (digest, tag) in self.by_digest:
+                return
+            if self.next >= len(self.hashes):
+                self.grow()
+            slot = self.next
+            old = self.entries[slot]
+            if old is not None:
+                del self.by_digest[(old[0], int(self.tags[slot]))]
+                self.text_bytes -= len(old[1])
+                self.stats["evicted"] += 1
+            self.hashes[slot] = fingerprint
+            self.tags[slot] = tag
+            self.entries[slot] = (digest, text, source)
+            self.by_digest[(digest, tag)] = slot
+            self.text_bytes += len(text)
+            self.size = max(self.size, slot + 1)
+            self.next = (slot + 1) % self.capacity
+            self.stats["added"] += 1
+
+    def nearest(self, fingerprint: int, tag: str, max_distance: int = AI_SIMILAR_MAX_DISTANCE) -> Optional[SimilarMatch]:
+        with self.lock:
+            self.stats["lookups"] += 1
+            tag = self.tag_ids.get(tag)
+            if tag is None or not self.size:
+                return None
+            distances = popcount(self.hashes[:self.size] ^ np.uint64(fingerprint)).astype(np.int16)
+            distances[self.tags[:self.size] != tag] = PHASH_BITS * PHASH_BITS + 1
+            best = int(distances.argmin())
+            if distances[best] > max_distance:
+                return None
+            self.stats["hits"] += 1
+            _, text, source = self.entries[best]
+            return SimilarMatch(text, source, int(distances[best]))
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["lookups"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / lookups if lookups else None,
+            "entries": len(self.by_digest),
+            "capacity": self.capacity,
+            "max_distance": AI_SIMILAR_MAX_DISTANCE,
+            "index_bytes": self.hashes.nbytes + self.tags.nbytes,
+            "text_bytes": self.text_bytes,
+        }
+
+
+similarity_index = SimilarityIndex()
+
+
+def enabled() -> bool:
+    return AI_SIMILAR_MAX_DISTANCE >= 0
+
+
+def lookup_tag(lookup: AnalysisLookup, model: str) -> str:
+    """Model, method, prompt version and generation of an analysis cache lookup"""
+    return f"{lookup.key.rsplit(':', 1)[0]}:{model}"
+
+
+@traced("ai-prep")
+async def fingerprint(data: bytes) -> int:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_preprocess_executor(), phash, data)
+
+
+async def find_similar(lookup: AnalysisLookup, model: str, image: bytes) -> Tuple[Optional[SimilarMatch], Optional[int]]:
+    """(prior analysis of a near-identical tile, the tile's fingerprint) for an exact-cache miss"""
+    if not enabled():
+        return None, None
+    try:
+        value = await fingerprint(image)
+    except Exception:
+        # Undecodable image: nothing to compare it with
+        return None, None
+    return similarity_index.nearest(value, lookup_tag(lookup, model)), value
+
+
+async def remember(lookup: AnalysisLookup, model: str, image: bytes, source: dict, value: Optional[int] = None):
+    """Index an analysis, computed or served from the exact cache, for later similar tiles"""
+    if not enabled() or lookup.text is None:
+        return
+    digest, tag = bytes.fromhex(lookup.key.rsplit(":", 1)[1]), lookup_tag(lookup, model)
+    if similarity_index.contains(digest, tag):
+        return
+    if value is None:
+        try:
+            value = await fingerprint(image)
+        except Exception:
+            return
+    similarity_index.add(value, digest, tag, lookup.text, source)
+
+
+def get_similarity_stats() -> dict:
+    return similarity_index.get_stats()
@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import os
+import random
+from typing import AsyncIterator, Optional, List, Dict, Any
+
+from ai.backends import AnalyzerBackend
+
+# Offline analyzer for load tests and benchmarks (AI_BACKEND=stub).
+#
+# Answers are derived from a hash of the image bytes and inputs, so the same
+# request always gets the same text. Each call takes AI_STUB_LATENCY_MS plus
+# up to AI_STUB_JITTER_MS and fails with probability AI_STUB_FAILURE_RATE;
+# jitter and failures are drawn from a generator seeded with AI_STUB_SEED, so
+# a run with the same request sequence is reproducible. Images are hashed, not
+# decoded, and the preprocessing pool is not used.
+
+AI_STUB_LATENCY_MS = float(os.getenv("AI_STUB_LATENCY_MS", 200))
+AI_STUB_JITTER_MS = float(os.getenv("AI_STUB_JITTER_MS", 0))
+AI_STUB_FAILURE_RATE = float(os.getenv("AI_STUB_FAILURE_RATE", 0))
+AI_STUB_SEED = int(os.getenv("AI_STUB_SEED", 0))
+
+SURFACE_FEATURES = [
+    "impact craters", "sand dunes", "layered deposits", "channels", "ridges",
+    "boulder fields", "dust devil tracks", "lava flows", "polygonal terrain", "mesas",
+]
+
+
+class StubAnalyzerError(Exception):
+    pass
+
+
+class StubAnalyzer(AnalyzerBackend):
+
+    def __init__(self, latency_ms: float = AI_STUB_LATENCY_MS, jitter_ms: float = AI_STUB_JITTER_MS,
+                 failure_rate: float = AI_STUB_FAILURE_RATE, seed: int = AI_STUB_SEED):
+        self.model_name = "stub"
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+
+    def next_call(self) -> float:
+        """Latency in seconds for the next call; raises for a simulated failure"""
+        latency = (self.latency_ms + self.rng.uniform(0, self.jitter_ms)) / 1000
+        if self.rng.random() < self.failure_rate:
+            raise StubAnalyzerError("Simulated model failure")
+        return latency
+
+    @staticmethod
+    def digest(*parts: Any) -> bytes:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(part if isinstance(part, bytes) else repr(part).encode())
+        return h.digest()
+
+    @staticmethod
+    def pick(digest: bytes, count: int) -> List[str]:
+        start = digest[0] % len(SURFACE_FEATURES)
+        return [SURFACE_FEATURES[(start + i * (digest[1] % 3 + 1)) % len(SURFACE_FEATURES)] for i in range(count)]
+
+    def analyze_mars_tile_text(self, image_data: bytes, question: str, tile_info: Optional[Dict[str, Any]] = None) -> str:
+        digest = self.digest(image_data, question, tile_info)
+        features = self.pick(digest, 2)
+        return (
+            f"Regarding \"{question}\": the tile shows {features[0]} alongside {features[1]}. "
+            f"Confidence: {['Low', 'Medium', 'High'][digest[2] % 3]}."
+        )
+
+    def analyze_general_features_text(self, image_data: bytes) -> str:
+        digest = self.digest(image_data)
+        return "\n".join(f"- {feature}" for feature in self.pick(digest, 3 + digest[3] % 3))
+
+    def detect_specific_features_text(self, image_data: bytes, features: List[str]) -> str:
+        digest = self.digest(image_data)
+        return "\n".join(
+            f"{feature}: {'Yes' if digest[i % len(digest)] % 2 else 'No'}" for i, feature in enumerate(features)
+        )
+
+    def compare_tiles_text(self, image1_data: bytes, image2_data: bytes, tile1_info: Optional[Dict] = None, tile2_info: Optional[Dict] = None) -> str:
+        first, second = self.pick(self.digest(image1_data), 2), self.pick(self.digest(image2_data), 2)
+        shared = sorted(set(first) & set(second))
+        return (
+            f"Tile 1 features: {', '.join(first)}\n"
+            f"Tile 2 features: {', '.join(second)}\n"
+            f"Shared: {', '.join(shared) or 'none'}"
+        )
+
+    async def respond(self, method: str, **kwargs) -> str:
+        await asyncio.sleep(self.next_call())
+        return getattr(self, f"{method}_text")(**kwargs)
+
+    async def analyze_mars_tile(self, image_data: bytes, question: str, tile_info: Optional[Dict[str, Any]] = None) -> str:
+        return await self.respond("analyze_mars_tile", image_data=image_data, question=question, tile_info=tile_info)
+
+    async def analyze_general_features(self, image_data: bytes) -> str:
+        return await self.respond("analyze_general_features", image_data=image_data)
+
+    async def detect_specific_features(self, image_data: bytes, features: List[str]) -> str:
+        return await self.respond("detect_specific_features", image_data=image_data, features=features)
+
+    async def compare_tiles(self, image1_data: bytes, image2_data: bytes, tile1_info: Optional[Dict] = None, tile2_info: Optional[Dict] = None) -> str:
+        return await self.respond("compare_tiles", image1_data=image1_data, image2_data=image2_data,
+                                  tile1_info=tile1_info, tile2_info=tile2_info)
+
+    async def stream(self, method: str, **kwargs) -> AsyncIterator[str]:
+        """The same text as `method`, word by word, spread over the call's latency"""
+        latency = self.next_call()
+        words = getattr(self, f"{method}_text")(**kwargs).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(latency / len(words))
+            yield word if i == len(words) - 1 else word + " "
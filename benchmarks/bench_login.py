@@ -0,0 +1,70 @@
+"""Login burst benchmark.
+
+Fires concurrent logins at /user/login while probing another route and
+reports login throughput, rejections and the probe's latency percentiles.
+Run it against a server before and after a change:
+
+    python benchmarks/bench_login.py --url http://127.0.0.1:8000 --concurrency 64 --duration 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def login_worker(client, deadline, credentials, statuses, latencies):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.post("/user/login", json=credentials)
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses[response.status_code] += 1
+
+
+async def probe_worker(client, deadline, path, latencies):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await client.get(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.05)
+
+
+async def main(args):
+    credentials = {"username": f"bench-{uuid.uuid4().hex[:8]}", "password": "bench-password"}
+    limits = httpx.Limits(max_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=limits) as client:
+        await client.post("/user/register", json={**credentials, "email": f"{credentials['username']}@example.com"})
+
+        statuses = Counter()
+        login_latencies, probe_latencies = [], []
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            probe_worker(client, deadline, args.probe, probe_latencies),
+            *(login_worker(client, deadline, credentials, statuses, login_latencies) for _ in range(args.concurrency)),
+        )
+
+    print(f"logins/s:        {statuses[200] / args.duration:.1f}")
+    print(f"status counts:   {dict(statuses)}")
+    print(f"login p50/p95:   {percentile(login_latencies, 50):.0f} / {percentile(login_latencies, 95):.0f} ms")
+    print(f"{args.probe} p50/p95/max: {percentile(probe_latencies, 50):.1f} / "
+          f"{percentile(probe_latencies, 95):.1f} / {max(probe_latencies or [0]):.1f} ms "
+          f"(mean {statistics.mean(probe_latencies or [0]):.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--probe", default="/forum/feed", help="Route whose latency is watched during the burst")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,107 @@
+"""Tile-hit throughput with print() versus queued logging.
+
+Serves L1 tile hits through acquire_tile in-process and writes one line per
+hit in three ways: print(..., flush=True) as the request handlers used to,
+an enabled logger.info through the queued JSON logger, and a logger.debug
+below the configured level (what the per-request prints became). Output goes
+to a pipe drained by a deliberately slow reader, standing in for a busy
+terminal or log shipper. No Redis, Postgres or network is needed:
+
+    python benchmarks/bench_tile_hits.py --duration 5 --concurrency 64
+    python benchmarks/bench_tile_hits.py --reader-delay 0   # fast sink
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from planets.cache.tile_cache import cache_lock, get_cache_key, memory_cache  # noqa: E402
+from planets.service.tile_service import acquire_tile  # noqa: E402
+from service import log_service  # noqa: E402
+
+TILES = [("global", 5, x, y) for x in range(20) for y in range(20)]
+
+
+def slow_pipe(delay: float, chunk: int):
+    """Writable text stream whose reader takes `delay` seconds per `chunk` bytes"""
+    read_fd, write_fd = os.pipe()
+
+    def drain():
+        with os.fdopen(read_fd, "rb", buffering=0) as reader:
+            while reader.read(chunk):
+                time.sleep(delay)
+
+    threading.Thread(target=drain, daemon=True).start()
+    return io.TextIOWrapper(os.fdopen(write_fd, "wb", buffering=0), write_through=True)
+
+
+async def worker(index, deadline, counts, emit):
+    n = 0
+    while time.perf_counter() < deadline:
+        dataset, z, x, y = TILES[(index + n) % len(TILES)]
+        result = await acquire_tile(dataset, z, x, y, use_archive=False)
+        emit(dataset, z, x, y, result.source)
+        n += 1
+        if n % 32 == 0:
+            # Let other workers in; L1 hits never suspend on their own
+            await asyncio.sleep(0)
+    counts.append(n)
+
+
+async def run(mode, args, sink):
+    if mode == "print":
+        def emit(dataset, z, x, y, source):
+            print(f"[{time.time()}] tile {dataset}/{z}/{x}/{y} {source}", file=sink, flush=True)
+    else:
+        logger = logging.getLogger("bench.tiles")
+        log = logger.info if mode == "log" else logger.debug
+
+        def emit(dataset, z, x, y, source):
+            log("Tile served", extra={"tile": f"{dataset}/{z}/{x}/{y}", "source": source})
+
+    counts = []
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(worker(i, deadline, counts, emit) for i in range(args.concurrency)))
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main(args):
+    with cache_lock:
+        for tile in TILES:
+            memory_cache[get_cache_key(*tile)] = b"\xff" * 2048
+
+    sink = slow_pipe(args.reader_delay, args.reader_chunk)
+    results = {"print": asyncio.run(run("print", args, sink))}
+
+    sys.stderr = sink
+    # Every line gets through the rate limiter, as every print did
+    log_service.LOG_RATE_BURST = 10 ** 9
+    log_service.setup_logging()
+    results["log"] = asyncio.run(run("log", args, sink))
+    results["debug"] = asyncio.run(run("debug", args, sink))
+    stats = log_service.get_log_stats()
+    log_service.log_listener.queue.queue.clear()
+    log_service.shutdown_logging()
+    sys.stderr = sys.__stderr__
+
+    for mode, rate in results.items():
+        print(f"{mode:6s} tile hits/s: {rate:10.0f}")
+    print(f"log vs print:      {results['log'] / results['print']:.1f}x")
+    print(f"debug vs print:    {results['debug'] / results['print']:.1f}x")
+    print(f"log records queued {stats['queued']}, dropped {stats['dropped']}, suppressed {stats['suppressed']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--reader-delay", type=float, default=0.01, help="seconds the reader sleeps per chunk")
+    parser.add_argument("--reader-chunk", type=int, default=4096)
+    main(parser.parse_args())
@@ -0,0 +1,149 @@
+"""Synthetic corpus generator and search latency benchmark.
+
+Loads N rows each into posts, comments and labels with COPY, then times
+a set of /search-style queries through db.search_content. Text is drawn
+from a Zipf-distributed vocabulary of VOCABULARY_SIZE words, with the Mars
+terms the queries use placed at ranks from common to rare, so queries
+match anything from a few percent of the rows down to a handful rather
+than the whole table. The row-change NOTIFY triggers are disabled during
+the load:
+
+    python benchmarks/gen_search_corpus.py --rows 1000000
+    python benchmarks/gen_search_corpus.py --skip-load   # re-run the timings only
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import DB_CONFIG, close_db_pool, create_table, init_db_pool, search_content  # noqa: E402
+
+PLACES = [
+    "Jezero", "Gale", "Olympus Mons", "Valles Marineris", "Hellas", "Elysium", "Tharsis",
+    "Utopia Planitia", "Arabia Terra", "Syrtis Major", "Noctis Labyrinthus", "Tycho", "Copernicus",
+]
+WORDS = (
+    "crater delta dune ridge channel basalt sediment layered outflow ejecta rim slope boulder "
+    "dust storm polar cap ice frost lava tube volcano fault graben mesa butte gully yardang "
+    "rover landing site orbiter image mosaic resolution albedo spectral olivine clay sulfate"
+).split()
+QUERIES = ["Jezero delta", "Olympus Mons lava", "polar ice", "gully frost", "\"Valles Marineris\" fault", "clay -sulfate"]
+
+VOCABULARY_SIZE = 50000
+ZIPF_EXPONENT = 1.07
+SYLLABLES = ["ka", "ro", "mi", "te", "lu", "sa", "vo", "ne", "di", "pa", "zu", "gri", "tor", "len", "bas", "quo"]
+TRIGGERS = [("posts", "posts_notify"), ("comments", "comments_notify"), ("labels", "labels_notify")]
+
+
+def build_vocabulary(rng: random.Random):
+    """(words by rank, cumulative Zipf weights); the domain words sit at log-spaced ranks"""
+    filler = set()
+    while len(filler) < VOCABULARY_SIZE - len(WORDS):
+        filler.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    words = sorted(filler)
+    rng.shuffle(words)
+    domain = WORDS[:]
+    rng.shuffle(domain)
+    for i, word in enumerate(domain):
+        rank = int(10 * (VOCABULARY_SIZE / 10) ** (i / len(domain)))
+        words.insert(rank, word)
+    weights, total = [], 0.0
+    for rank in range(1, len(words) + 1):
+        total += rank ** -ZIPF_EXPONENT
+        weights.append(total)
+    return words, weights
+
+
+VOCABULARY, CUM_WEIGHTS = build_vocabulary(random.Random(7))
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    tokens = rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=words)
+    if rng.random() < 0.05:
+        tokens.insert(rng.randrange(len(tokens)), rng.choice(PLACES))
+    return " ".join(tokens)
+
+
+def coordinates(rng: random.Random) -> str:
+    return json.dumps([round(rng.uniform(-90, 90), 4), round(rng.uniform(-180, 180), 4)])
+
+
+async def load(rows: int, batch: int = 50000):
+    rng = random.Random(42)
+    # Plain connection: COPY sends jsonb as text here, without the pool's codec
+    conn = await asyncpg.connect(**DB_CONFIG)
+    # Millions of pg_notify calls would flood the app_events listeners (and slow the load)
+    for table, trigger in TRIGGERS:
+        await conn.execute(f"ALTER TABLE {table} DISABLE TRIGGER {trigger}")
+    try:
+        # Explicit post ids so generated comments can reference them; sequence is advanced afterwards
+        first_post = await conn.fetchval("SELECT coalesce(max(id), 0) + 1 FROM posts")
+        for start in range(0, rows, batch):
+            n = min(batch, rows - start)
+            await conn.copy_records_to_table(
+                "posts", columns=["id", "user_id", "title", "topic", "content", "coordinates"],
+                records=[(first_post + start + i, rng.randrange(1, 10000), sentence(rng, 5), rng.choice(WORDS),
+                          sentence(rng, 60), coordinates(rng))
+                         for i in range(n)],
+            )
+            await conn.copy_records_to_table(
+                "comments", columns=["post_id", "user_id", "comment"],
+                records=[(first_post + rng.randrange(start + n), rng.randrange(1, 10000), sentence(rng, 25))
+                         for _ in range(n)],
+            )
+            await conn.copy_records_to_table(
+                "labels", columns=["user_id", "celestial_object", "title", "description", "coordinates"],
+                records=[(rng.randrange(1, 10000), rng.choice(["mars", "moon"]), sentence(rng, 3), sentence(rng, 15), coordinates(rng))
+                         for _ in range(n)],
+            )
+            print(f"loaded {start + n}/{rows}", flush=True)
+        await conn.execute("SELECT setval(pg_get_serial_sequence('posts', 'id'), (SELECT max(id) FROM posts))")
+        await conn.execute("ANALYZE posts; ANALYZE comments; ANALYZE labels;")
+    finally:
+        for table, trigger in TRIGGERS:
+            await conn.execute(f"ALTER TABLE {table} ENABLE TRIGGER {trigger}")
+        await conn.close()
+
+
+async def bench(repeats: int):
+    cases = [
+        ("all kinds", dict(kinds=["posts", "comments", "labels"], celestial_object=None, bbox=None)),
+        ("labels on mars", dict(kinds=["labels"], celestial_object="mars", bbox=None)),
+        ("posts in bbox", dict(kinds=["posts"], celestial_object=None, bbox=(-20.0, -10.0, 40.0, 30.0))),
+    ]
+    for name, options in cases:
+        timings = []
+        for _ in range(repeats):
+            for text in QUERIES:
+                start = time.perf_counter()
+                await search_content(text, limit=20, **options)
+                timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print(f"{name:16s} p50 {statistics.median(timings):7.1f} ms   p95 {timings[int(len(timings) * 0.95)]:7.1f} ms")
+
+
+async def main(args):
+    await init_db_pool()
+    try:
+        await create_table()
+        if not args.skip_load:
+            await load(args.rows)
+        await bench(args.repeats)
+    finally:
+        await close_db_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Rows per table")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--skip-load", action="store_true")
+    asyncio.run(main(parser.parse_args()))
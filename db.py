@@ -1,364 +1,768 @@
-import psycopg2
-import bcrypt
+import asyncpg
+import asyncio
 import json
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import numpy as np
+
+from service.query_cache import bump_versions, labels_tag, thread_tag
+from service.tracing import span
+from service.write_batcher import InsertBatcher
+from service.password_service import check_password_async, hash_password_async, needs_rehash, password_stats
+from labels.clusters import cluster_registry
+
+logger = logging.getLogger(__name__)
 
 DB_CONFIG = {
-    "dbname": os.environ.get("DB_NAME"),
+    "database": os.environ.get("DB_NAME"),
     "user": os.environ.get("DB_USER"),
     "password": os.environ.get("DB_PASSWORD"),
     "host": os.environ.get("DB_HOST"),
-    "port": os.environ.get("DB_PORT", 5432)
+    "port": int(os.environ.get("DB_PORT", 5432))
 }
 
-def create_table():
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-
-        # Labels table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS labels (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                celestial_object TEXT NOT NULL,
-                title TEXT,
-                description TEXT,
-                coordinates JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-
-        # Forum Posts table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS posts (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                topic TEXT,
-                content TEXT NOT NULL,
-                coordinates JSONB ,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-
-        # Forum Comments table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS comments (
-                id SERIAL PRIMARY KEY,
-                post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
-                user_id INTEGER NOT NULL,
-                comment TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-
-        #user table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 20))
+DB_ACQUIRE_TIMEOUT = float(os.environ.get("DB_ACQUIRE_TIMEOUT", 5))
+# asyncpg prepares every query once per connection and reuses it from this LRU
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 256))
+
+pool: Optional[asyncpg.Pool] = None
+# Created on first use: on Python 3.9 a Lock binds to the loop current at construction
+pool_lock: Optional[asyncio.Lock] = None
+
+# Pool statistics
+db_stats = {
+    "acquires": 0,
+    "acquire_wait_ms_total": 0.0,
+    "acquire_wait_ms_max": 0.0,
+    "acquire_timeouts": 0,
+    "queries": 0,
+    "query_ms_total": 0.0,
+    "query_ms_max": 0.0,
+    "query_errors": 0,
+}
 
-        conn.commit()
-        print("✅ Tables created.")
-    except Exception as e:
-        print("❌ Table creation failed:", e)
-    finally:
-        cur.close()
-        conn.close()
 
-def insert_coordinates(user_id: int, celestial_object: str, title: str, description: str, coordinates: list[float]):
+async def init_connection(conn: asyncpg.Connection):
+    # JSONB columns round-trip as Python lists/dicts
+    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def init_db_pool() -> asyncpg.Pool:
+    global pool, pool_lock
+    if pool is not None:
+        return pool
+    if pool_lock is None:
+        pool_lock = asyncio.Lock()
+    # Requests racing in before startup finished must share one pool
+    async with pool_lock:
+        if pool is None:
+            pool = await asyncpg.create_pool(
+                **DB_CONFIG,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                init=init_connection,
+            )
+    return pool
+
+
+async def close_db_pool():
+    global pool
+    await label_batcher.drain()
+    await comment_batcher.drain()
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+@asynccontextmanager
+async def acquire():
+    """Borrow a pooled connection, recording how long the caller waited for it"""
+    db_pool = pool or await init_db_pool()
+    start = time.perf_counter()
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO labels (user_id, celestial_object, title, description, coordinates) VALUES (%s, %s, %s, %s, %s)",
-            (user_id, celestial_object, title, description, json.dumps(coordinates))
-        )
-        conn.commit()
-        print("✅ Coordinates inserted successfully.")
-    except Exception as e:
-        print("❌ Failed to insert coordinates:", e)
-        raise e
+        with span("db-wait"):
+            conn = await db_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        db_stats["acquire_timeouts"] += 1
+        raise
+    waited = (time.perf_counter() - start) * 1000
+    db_stats["acquires"] += 1
+    db_stats["acquire_wait_ms_total"] += waited
+    db_stats["acquire_wait_ms_max"] = max(db_stats["acquire_wait_ms_max"], waited)
+    try:
+        yield conn
     finally:
-        cur.close()
-        conn.close()
+        await db_pool.release(conn)
 
 
-def get_coordinates(user_id: int,id: int,title: str,celestial_object: str):
+@asynccontextmanager
+async def timed_query():
+    start = time.perf_counter()
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-
-        query = "SELECT id, user_id, celestial_object, title, description, coordinates, created_at,updated_at FROM labels WHERE user_id = %s"
-        values = [user_id]
-
-        if id is not None:
-            query += " AND id = %s"
-            values.append(id)
-        if title is not None:
-            query += " AND title = %s"
-            values.append(title)
-        if celestial_object is not None:
-            query += " AND celestial_object = %s"
-            values.append(celestial_object)
-
-        cur.execute(query, tuple(values))
-        rows = cur.fetchall()
-
-        results = []
-        
-        for row in rows:
-            results.append({
-                "id" : row[0],
-                "user_id": row[1],
-                "celestial_object": row[2],
-                "title": row[3],
-                "description": row[4],
-                "coordinates": row[5],
-                "created_at" : row[6],
-                "updated_at": row[7]
-            })
-
-        return results
-    except Exception as e:
-        raise e
+        with span("db"):
+            yield
+    except Exception:
+        db_stats["query_errors"] += 1
+        raise
     finally:
-        cur.close()
-        conn.close()
-
-
-def delete_coordinates(id: int,user_id: int,celestial_object: str):
+        elapsed = (time.perf_counter() - start) * 1000
+        db_stats["queries"] += 1
+        db_stats["query_ms_total"] += elapsed
+        db_stats["query_ms_max"] = max(db_stats["query_ms_max"], elapsed)
+
+
+async def fetch(query: str, *args):
+    async with acquire() as conn, timed_query():
+        return await conn.fetch(query, *args)
+
+
+async def fetchrow(query: str, *args):
+    async with acquire() as conn, timed_query():
+        return await conn.fetchrow(query, *args)
+
+
+async def fetchval(query: str, *args):
+    async with acquire() as conn, timed_query():
+        return await conn.fetchval(query, *args)
+
+
+async def execute(query: str, *args) -> str:
+    async with acquire() as conn, timed_query():
+        return await conn.execute(query, *args)
+
+
+def rows_affected(status: str) -> int:
+    """asyncpg returns the command tag, e.g. 'DELETE 1'"""
+    return int(status.split()[-1])
+
+
+def get_db_stats() -> dict:
+    stats = db_stats.copy()
+    if stats["acquires"]:
+        stats["acquire_wait_ms_avg"] = stats["acquire_wait_ms_total"] / stats["acquires"]
+    if stats["queries"]:
+        stats["query_ms_avg"] = stats["query_ms_total"] / stats["queries"]
+    if pool is not None:
+        stats["pool_size"] = pool.get_size()
+        stats["pool_idle"] = pool.get_idle_size()
+        stats["pool_in_use"] = pool.get_size() - pool.get_idle_size()
+    stats["pool_min_size"] = DB_POOL_MIN_SIZE
+    stats["pool_max_size"] = DB_POOL_MAX_SIZE
+    stats["write_batches"] = {
+        "labels": label_batcher.get_stats(),
+        "comments": comment_batcher.get_stats(),
+    }
+    return stats
+
+
+# Label/post coordinates are [lat, lon]; geom mirrors them as point(lon, lat)
+# so viewport queries can use a GiST index instead of scanning JSONB.
+# btree_gist lets celestial_object share the same index as the point.
+SPATIAL_SCHEMA = """
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+    ALTER TABLE labels ADD COLUMN IF NOT EXISTS geom point
+        GENERATED ALWAYS AS (point((coordinates->>1)::float8, (coordinates->>0)::float8)) STORED;
+    CREATE INDEX IF NOT EXISTS labels_object_geom_idx ON labels USING gist (celestial_object, geom);
+
+    ALTER TABLE posts ADD COLUMN IF NOT EXISTS geom point
+        GENERATED ALWAYS AS (point((coordinates->>1)::float8, (coordinates->>0)::float8)) STORED;
+    CREATE INDEX IF NOT EXISTS posts_geom_idx ON posts USING gist (geom);
+"""
+
+# Keyset pagination of a user's labels, with and without the object filter
+LABEL_LISTING_SCHEMA = """
+    CREATE INDEX IF NOT EXISTS labels_user_created_idx ON labels (user_id, created_at, id);
+    CREATE INDEX IF NOT EXISTS labels_user_object_created_idx ON labels (user_id, celestial_object, created_at, id);
+"""
+
+# Forum feed (optionally by topic) and per-thread comment pages
+FORUM_SCHEMA = """
+    CREATE INDEX IF NOT EXISTS posts_created_idx ON posts (created_at, id);
+    CREATE INDEX IF NOT EXISTS posts_topic_created_idx ON posts (topic, created_at, id);
+    CREATE INDEX IF NOT EXISTS comments_post_created_idx ON comments (post_id, created_at, id);
+"""
+
+# Full-text search: weighted tsvectors kept current by Postgres as generated columns
+SEARCH_SCHEMA = """
+    ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(topic, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(content, '')), 'C')
+        ) STORED;
+    CREATE INDEX IF NOT EXISTS posts_search_idx ON posts USING gin (search_vector);
+
+    ALTER TABLE comments ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', coalesce(comment, ''))) STORED;
+    CREATE INDEX IF NOT EXISTS comments_search_idx ON comments USING gin (search_vector);
+
+    ALTER TABLE labels ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'B')
+        ) STORED;
+    CREATE INDEX IF NOT EXISTS labels_search_idx ON labels USING gin (search_vector);
+"""
+
+# Row-change notifications for the live event stream (events/hub.py).
+# Payloads carry ids and at most [lat, lon] of the row's coordinates (posts
+# accept arbitrary arrays), so they stay far below NOTIFY's 8000-byte limit;
+# a larger payload would make pg_notify fail the user's INSERT.
+EVENTS_SCHEMA = """
+    CREATE OR REPLACE FUNCTION notify_app_event() RETURNS trigger AS $$
+    DECLARE
+        changed record;
+        payload jsonb;
+    BEGIN
+        -- Deletes (labels only) describe the removed row
+        IF TG_OP = 'DELETE' THEN
+            changed := OLD;
+        ELSE
+            changed := NEW;
+        END IF;
+        payload := jsonb_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'id', changed.id, 'user_id', changed.user_id);
+        IF TG_TABLE_NAME = 'comments' THEN
+            payload := payload || jsonb_build_object('post_id', changed.post_id);
+        ELSIF jsonb_typeof(changed.coordinates) = 'array' THEN
+            IF jsonb_array_length(changed.coordinates) >= 2 THEN
+                payload := payload || jsonb_build_object(
+                    'coordinates', jsonb_build_array(changed.coordinates -> 0, changed.coordinates -> 1)
+                );
+            END IF;
+        END IF;
+        IF TG_TABLE_NAME = 'posts' THEN
+            payload := payload || jsonb_build_object('post_id', changed.id);
+        ELSIF TG_TABLE_NAME = 'labels' THEN
+            payload := payload || jsonb_build_object('celestial_object', changed.celestial_object);
+        END IF;
+        PERFORM pg_notify('app_events', payload::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS posts_notify ON posts;
+    CREATE TRIGGER posts_notify AFTER INSERT OR UPDATE ON posts
+        FOR EACH ROW EXECUTE FUNCTION notify_app_event();
+    DROP TRIGGER IF EXISTS comments_notify ON comments;
+    CREATE TRIGGER comments_notify AFTER INSERT OR UPDATE ON comments
+        FOR EACH ROW EXECUTE FUNCTION notify_app_event();
+    DROP TRIGGER IF EXISTS labels_notify ON labels;
+    CREATE TRIGGER labels_notify AFTER INSERT OR UPDATE OR DELETE ON labels
+        FOR EACH ROW EXECUTE FUNCTION notify_app_event();
+"""
+
+async def create_table():
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-
-        query = "DELETE FROM labels WHERE id = %s "
-        values = [id]
-
-        if user_id is not None:
-            query += "AND user_id = %s "
-            values.append(user_id)
-        if celestial_object is not None:
-            query += "AND celestial_object = %s"
-            values.append(celestial_object)
-
-        cur.execute(query,tuple(values))
-        conn.commit()
-    
-        return cur.rowcount > 0
+        async with acquire() as conn:
+            # Labels table
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS labels (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    celestial_object TEXT NOT NULL,
+                    title TEXT,
+                    description TEXT,
+                    coordinates JSONB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+
+            # Forum Posts table
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS posts (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    topic TEXT,
+                    content TEXT NOT NULL,
+                    coordinates JSONB ,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+
+            # Forum Comments table
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS comments (
+                    id SERIAL PRIMARY KEY,
+                    post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+                    user_id INTEGER NOT NULL,
+                    comment TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+
+            #user table
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id SERIAL PRIMARY KEY,
+                    username TEXT UNIQUE NOT NULL,
+                    email TEXT UNIQUE NOT NULL,
+                    password TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+
+            await conn.execute(SPATIAL_SCHEMA)
+            await conn.execute(LABEL_LISTING_SCHEMA)
+            await conn.execute(FORUM_SCHEMA)
+            await conn.execute(SEARCH_SCHEMA)
+            await conn.execute(EVENTS_SCHEMA)
+
+        logger.info("Tables created")
+    except Exception:
+        logger.exception("Table creation failed")
+
+async def reserve_ids(conn: asyncpg.Connection, table: str, count: int) -> list:
+    """Draw ids up front so each batched row maps back to its caller regardless of RETURNING order"""
+    rows = await conn.fetch(
+        "SELECT nextval(pg_get_serial_sequence($1, 'id')) AS id FROM generate_series(1, $2)", table, count
+    )
+    return [row["id"] for row in rows]
+
+
+async def flush_label_inserts(conn: asyncpg.Connection, records: list) -> list:
+    """One multi-row INSERT for a batch of (user_id, celestial_object, title, description, coordinates_json)"""
+    async with timed_query():
+        ids = await reserve_ids(conn, "labels", len(records))
+        user_ids, objects, titles, descriptions, coordinates = (list(column) for column in zip(*records))
+        await conn.execute("""
+            INSERT INTO labels (id, user_id, celestial_object, title, description, coordinates)
+            SELECT id, user_id, celestial_object, title, description, coordinates::jsonb
+            FROM unnest($1::int[], $2::int[], $3::text[], $4::text[], $5::text[], $6::text[])
+                AS r(id, user_id, celestial_object, title, description, coordinates)
+        """, ids, user_ids, objects, titles, descriptions, coordinates)
+    return ids
+
+
+async def labels_committed(records: list):
+    await bump_versions(labels_tag(user_id) for user_id in {record[0] for record in records})
+
+
+async def flush_comment_inserts(conn: asyncpg.Connection, records: list) -> list:
+    """One multi-row INSERT for a batch of (post_id, user_id, comment)"""
+    async with timed_query():
+        ids = await reserve_ids(conn, "comments", len(records))
+        post_ids, user_ids, comments = (list(column) for column in zip(*records))
+        await conn.execute("""
+            INSERT INTO comments (id, post_id, user_id, comment)
+            SELECT * FROM unnest($1::int[], $2::int[], $3::int[], $4::text[])
+        """, ids, post_ids, user_ids, comments)
+    return ids
+
+
+async def comments_committed(records: list):
+    await bump_versions(thread_tag(post_id) for post_id in {record[0] for record in records})
+
+
+label_batcher = InsertBatcher("labels", flush_label_inserts, acquire, labels_committed)
+comment_batcher = InsertBatcher("comments", flush_comment_inserts, acquire, comments_committed)
+
+
+async def insert_coordinates(user_id: int, celestial_object: str, title: str, description: str, coordinates: list[float]):
+    try:
+        label_id = await label_batcher.submit(
+            (user_id, celestial_object, title, description, json.dumps(coordinates))
+        )
+        try:
+            cluster_registry.on_insert(celestial_object, label_id, coordinates[0], coordinates[1])
+        except Exception:
+            # The row is committed; rebuild the index rather than fail the request
+            logger.exception("Cluster index update failed")
+            cluster_registry.invalidate(celestial_object)
+        logger.debug("Coordinates inserted", extra={"label_id": label_id})
+        return label_id
     except Exception as e:
+        logger.error("Failed to insert coordinates: %s", e)
         raise e
-    finally:
-        cur.close()
-        conn.close()
-
-def update_coordinates(label_id: int, title: str, description: str):
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-
-        updates = []
-        values = []
-
-        if title:
-            updates.append("title = %s")
-            values.append(title)
-        if description:
-            updates.append("description = %s")
-            values.append(description)
-
-        # Always update the updated_at timestamp
-        updates.append("updated_at = CURRENT_TIMESTAMP")
-
-        if not updates:
-            raise ValueError("No fields provided to update.")
-
-        # Add WHERE clause values
-        values.extend([label_id])
-
-        query = f"""
-            UPDATE labels
-            SET {', '.join(updates)}
-            WHERE id = %s
-        """
 
-        cur.execute(query, values)
-        conn.commit()
 
-        return cur.rowcount > 0
-
-    except Exception as e:
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+async def get_coordinates(user_id: int,id: int,title: str,celestial_object: str,
+                          after: Optional[tuple] = None, limit: Optional[int] = None):
+    """Stream a user's labels in (created_at, id) order through a server-side cursor.
+
+    `after` is the (created_at, id) of the last row of the previous page.
+    """
+    query = "SELECT id, user_id, celestial_object, title, description, coordinates, created_at,updated_at FROM labels WHERE user_id = $1"
+    values = [user_id]
+
+    if id is not None:
+        values.append(id)
+        query += f" AND id = ${len(values)}"
+    if title is not None:
+        values.append(title)
+        query += f" AND title = ${len(values)}"
+    if celestial_object is not None:
+        values.append(celestial_object)
+        query += f" AND celestial_object = ${len(values)}"
+    if after is not None:
+        values.extend(after)
+        query += f" AND (created_at, id) > (${len(values) - 1}, ${len(values)})"
+
+    query += " ORDER BY created_at, id"
+    if limit is not None:
+        values.append(limit)
+        query += f" LIMIT ${len(values)}"
+
+    async with acquire() as conn, conn.transaction(), timed_query():
+        async for row in conn.cursor(query, *values, prefetch=200):
+            yield dict(row)
+
+
+async def copy_labels(records: list) -> int:
+    """Bulk-load (user_id, celestial_object, title, description, lat, lon) tuples with COPY"""
+    async with acquire() as conn, conn.transaction(), timed_query():
+        await conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS labels_import (
+                user_id INTEGER, celestial_object TEXT, title TEXT, description TEXT,
+                lat DOUBLE PRECISION, lon DOUBLE PRECISION
+            ) ON COMMIT DELETE ROWS
+        """)
+        await conn.copy_records_to_table(
+            "labels_import",
+            records=records,
+            columns=["user_id", "celestial_object", "title", "description", "lat", "lon"],
+        )
+        status = await conn.execute("""
+            INSERT INTO labels (user_id, celestial_object, title, description, coordinates)
+            SELECT user_id, celestial_object, title, description, jsonb_build_array(lat, lon)
+            FROM labels_import
+        """)
+    await bump_versions(labels_tag(user_id) for user_id in {record[0] for record in records})
+    for celestial_object in {record[1] for record in records}:
+        cluster_registry.invalidate(celestial_object)
+    return rows_affected(status)
+
+
+async def export_labels(user_id: Optional[int], celestial_object: Optional[str]):
+    """Stream labels for a user and/or celestial object through a server-side cursor"""
+    query = "SELECT id, user_id, celestial_object, title, description, coordinates, created_at, updated_at FROM labels WHERE TRUE"
+    values = []
+    if user_id is not None:
+        values.append(user_id)
+        query += f" AND user_id = ${len(values)}"
+    if celestial_object is not None:
+        values.append(celestial_object)
+        query += f" AND celestial_object = ${len(values)}"
+    query += " ORDER BY id"
+
+    async with acquire() as conn, conn.transaction(), timed_query():
+        async for row in conn.cursor(query, *values, prefetch=500):
+            yield dict(row)
+
+
+async def delete_coordinates(id: int,user_id: int,celestial_object: str):
+    query = "DELETE FROM labels WHERE id = $1 "
+    values = [id]
+
+    if user_id is not None:
+        values.append(user_id)
+        query += f"AND user_id = ${len(values)} "
+    if celestial_object is not None:
+        values.append(celestial_object)
+        query += f"AND celestial_object = ${len(values)}"
+
+    deleted = await fetch(query + " RETURNING id, user_id, celestial_object", *values)
+    await bump_versions(labels_tag(row["user_id"]) for row in deleted)
+    for row in deleted:
+        cluster_registry.on_delete(row["celestial_object"], row["id"])
+    return len(deleted) > 0
+
+async def update_coordinates(label_id: int, title: str, description: str):
+    updates = []
+    values = []
+
+    if title:
+        values.append(title)
+        updates.append(f"title = ${len(values)}")
+    if description:
+        values.append(description)
+        updates.append(f"description = ${len(values)}")
+
+    # Always update the updated_at timestamp
+    updates.append("updated_at = CURRENT_TIMESTAMP")
+
+    if not updates:
+        raise ValueError("No fields provided to update.")
+
+    # Add WHERE clause values
+    values.append(label_id)
+
+    query = f"""
+        UPDATE labels
+        SET {', '.join(updates)}
+        WHERE id = ${len(values)}
+        RETURNING user_id
+    """
+
+    updated = await fetch(query, *values)
+    await bump_versions(labels_tag(row["user_id"]) for row in updated)
+    return len(updated) > 0
+
+def bbox_condition(west: float, south: float, east: float, north: float, values: list, column: str = "geom") -> str:
+    """geom-in-box predicate; a box with west > east is split at the antimeridian"""
+    def box(w: float, e: float) -> str:
+        values.extend([w, south, e, north])
+        n = len(values)
+        return f"{column} <@ box(point(${n - 3}, ${n - 2}), point(${n - 1}, ${n}))"
+
+    if west <= east:
+        return box(west, east)
+    return f"({box(west, 180.0)} OR {box(-180.0, east)})"
+
+
+async def get_label_points(celestial_object: str):
+    """(ids, lats, lons) arrays for every label on an object, for the cluster index"""
+    rows = await fetch("""
+        SELECT id, geom[1] AS lat, geom[0] AS lon
+        FROM labels
+        -- Legacy rows with missing coordinates have no geom and can't be clustered
+        WHERE celestial_object = $1 AND geom IS NOT NULL
+    """, celestial_object)
+    ids = np.fromiter((row["id"] for row in rows), dtype=np.int64, count=len(rows))
+    lats = np.fromiter((row["lat"] for row in rows), dtype=np.float64, count=len(rows))
+    lons = np.fromiter((row["lon"] for row in rows), dtype=np.float64, count=len(rows))
+    return ids, lats, lons
+
+
+async def get_labels_in_bbox(celestial_object: str, west: float, south: float, east: float, north: float, limit: int):
+    values = [celestial_object]
+    query = f"""
+        SELECT id, user_id, celestial_object, title, description, coordinates, created_at, updated_at
+        FROM labels
+        WHERE celestial_object = $1 AND {bbox_condition(west, south, east, north, values)}
+    """
+    values.append(limit)
+    rows = await fetch(query + f" LIMIT ${len(values)}", *values)
+    return [dict(row) for row in rows]
 
 #forum
 
-def insert_post(user_id: int, title: str, topic: str, content: str, coordinates: list[float]):
+async def get_posts_in_bbox(west: float, south: float, east: float, north: float, topic: Optional[str], limit: int):
+    values = []
+    query = f"""
+        SELECT id, user_id, title, topic, content, coordinates, created_at
+        FROM posts
+        WHERE {bbox_condition(west, south, east, north, values)}
+    """
+    if topic is not None:
+        values.append(topic)
+        query += f" AND topic = ${len(values)}"
+    values.append(limit)
+    rows = await fetch(query + f" LIMIT ${len(values)}", *values)
+    return [dict(row) for row in rows]
+
+
+async def insert_post(user_id: int, title: str, topic: str, content: str, coordinates: list[float]):
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        import json
-
-        cur.execute(
-            "INSERT INTO posts (user_id, title, topic, content, coordinates) VALUES (%s, %s, %s, %s, %s)",
-            (user_id, title, topic, content, json.dumps(coordinates))
+        await execute(
+            "INSERT INTO posts (user_id, title, topic, content, coordinates) VALUES ($1, $2, $3, $4, $5)",
+            user_id, title, topic, content, coordinates
         )
-
-        conn.commit()
-        print("✅ Post inserted.")
+        logger.debug("Post inserted")
     except Exception as e:
-        print("❌ Failed to insert post:", e)
+        logger.error("Failed to insert post: %s", e)
         raise e
-    finally:
-        cur.close()
-        conn.close()
 
-def insert_comment(post_id: int, user_id: int, comment: str):
+async def insert_comment(post_id: int, user_id: int, comment: str):
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO comments (post_id, user_id, comment) VALUES (%s, %s, %s)",
-            (post_id, user_id, comment)
-        )
-        conn.commit()
-        print("✅ Comment inserted.")
+        comment_id = await comment_batcher.submit((post_id, user_id, comment))
+        logger.debug("Comment inserted", extra={"comment_id": comment_id})
+        return comment_id
     except Exception as e:
-        print("❌ Failed to insert comment:", e)
+        logger.error("Failed to insert comment: %s", e)
         raise e
-    finally:
-        cur.close()
-        conn.close()
 
-def get_posts_with_comments(post_id: int):
+async def get_forum_feed(topic: Optional[str], before: Optional[tuple], limit: int):
+    """Newest posts first with comment counts; `before` is the (created_at, id) of the last post seen"""
+    values = []
+    conditions = []
+    if topic is not None:
+        values.append(topic)
+        conditions.append(f"p.topic = ${len(values)}")
+    if before is not None:
+        values.extend(before)
+        conditions.append(f"(p.created_at, p.id) < (${len(values) - 1}, ${len(values)})")
+    values.append(limit)
+
+    rows = await fetch(f"""
+        SELECT p.id, p.user_id, p.title, p.topic, p.content, p.coordinates, p.created_at,
+               (SELECT count(*) FROM comments c WHERE c.post_id = p.id) AS comment_count
+        FROM posts p
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY p.created_at DESC, p.id DESC
+        LIMIT ${len(values)}
+    """, *values)
+    return [dict(row) for row in rows]
+
+async def get_posts_with_comments(post_id: int, after: Optional[tuple] = None, limit: int = 50):
+    """Post, comment count and one page of comments in a single round trip.
+
+    Returns limit + 1 comments at most so the caller can tell whether more remain.
+    """
+    after_created, after_id = after if after is not None else (None, None)
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-
-        # Fetch the main post
-        cur.execute("SELECT * FROM posts WHERE id = %s", (post_id,))
-        post = cur.fetchone()
-
-        if not post:
+        row = await fetchrow("""
+            SELECT p.id, p.user_id, p.title, p.topic, p.content, p.coordinates, p.created_at,
+                   (SELECT count(*) FROM comments c WHERE c.post_id = p.id) AS comment_count,
+                   COALESCE(page.items, '[]'::jsonb) AS comments
+            FROM posts p
+            LEFT JOIN LATERAL (
+                SELECT jsonb_agg(jsonb_build_object(
+                           'id', c.id, 'post_id', c.post_id, 'user_id', c.user_id,
+                           'comment', c.comment, 'created_at', c.created_at
+                       ) ORDER BY c.created_at, c.id) AS items
+                FROM (
+                    SELECT id, post_id, user_id, comment, created_at
+                    FROM comments
+                    WHERE post_id = p.id
+                      AND ($2::timestamp IS NULL OR (created_at, id) > ($2::timestamp, $3::integer))
+                    ORDER BY created_at, id
+                    LIMIT $4
+                ) c
+            ) page ON TRUE
+            WHERE p.id = $1
+        """, post_id, after_created, after_id, limit + 1)
+
+        if not row:
             return None
 
-        # Fetch comments for the post
-        cur.execute("SELECT * FROM comments WHERE post_id = %s ORDER BY created_at", (post_id,))
-        comments = cur.fetchall()
-
+        post = dict(row)
+        comments = post.pop("comments")
+        comment_count = post.pop("comment_count")
         return {
-            "post": {
-                "id": post[0],
-                "user_id": post[1],
-                "title":post[2],
-                "content": post[3],
-                "topic": post[4],
-                "coordinates": post[5],
-                "created_at": post[6]
-            },
-            "comments": [
-                {
-                    "id": c[0],
-                    "post_id": c[1],
-                    "user_id": c[2],
-                    "comment": c[3],
-                    "created_at": c[4]
-                } for c in comments
-            ]
+            "post": post,
+            "comments": comments,
+            "comment_count": comment_count
         }
     except Exception as e:
-        print("❌ Failed to fetch thread:", e)
+        logger.error("Failed to fetch thread: %s", e)
         raise e
-    finally:
-        cur.close()
-        conn.close()
-
-#user portal
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+#search
+
+SEARCH_KINDS = ("posts", "comments", "labels")
+HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=20, MinWords=5, StartSel=<mark>, StopSel=</mark>"
+
+async def search_content(text: str, kinds: list, celestial_object: Optional[str],
+                         bbox: Optional[tuple], limit: int):
+    """Ranked matches across posts, comments and labels with highlighted snippets.
+
+    Each source is ranked and cut to `limit` separately, so ts_headline only
+    runs on the final few rows rather than on every match.
+    """
+    values = [text, limit]
+    branches = []
+
+    def where_bbox(column: str) -> str:
+        return f" AND {bbox_condition(*bbox, values, column=column)}" if bbox else ""
+
+    # Posts and comments have no celestial object, so that filter narrows to labels
+    if "posts" in kinds and celestial_object is None:
+        branches.append(f"""
+            (SELECT 'post' AS kind, p.id, p.id AS post_id, p.title, p.content AS body, NULL::text AS celestial_object,
+                    ts_rank_cd(p.search_vector, q.query) AS rank, p.created_at
+             FROM posts p, q
+             WHERE p.search_vector @@ q.query{where_bbox("p.geom")}
+             ORDER BY rank DESC LIMIT $2)""")
+    if "comments" in kinds and celestial_object is None:
+        branches.append(f"""
+            (SELECT 'comment', c.id, c.post_id, p.title, c.comment, NULL::text,
+                    ts_rank_cd(c.search_vector, q.query) AS rank, c.created_at
+             FROM comments c JOIN posts p ON p.id = c.post_id, q
+             WHERE c.search_vector @@ q.query{where_bbox("p.geom")}
+             ORDER BY rank DESC LIMIT $2)""")
+    if "labels" in kinds:
+        object_filter = ""
+        if celestial_object is not None:
+            values.append(celestial_object)
+            object_filter = f" AND l.celestial_object = ${len(values)}"
+        branches.append(f"""
+            (SELECT 'label', l.id, NULL::integer, l.title, l.description, l.celestial_object,
+                    ts_rank_cd(l.search_vector, q.query) AS rank, l.created_at
+             FROM labels l, q
+             WHERE l.search_vector @@ q.query{object_filter}{where_bbox("l.geom")}
+             ORDER BY rank DESC LIMIT $2)""")
+
+    if not branches:
+        return []
+
+    rows = await fetch(f"""
+        WITH q AS (SELECT websearch_to_tsquery('english', $1) AS query),
+        hits AS ({" UNION ALL ".join(branches)})
+        SELECT kind, id, post_id, title, celestial_object, rank, created_at,
+               ts_headline('english', coalesce(body, ''), q.query, '{HEADLINE_OPTIONS}') AS snippet
+        FROM (SELECT * FROM hits ORDER BY rank DESC LIMIT $2) top, q
+        ORDER BY rank DESC
+    """, *values)
+    return [dict(row) for row in rows]
 
-def check_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+#user portal
 
-def register_user(username: str, email: str, password: str):
+async def register_user(username: str, email: str, password: str):
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        hashed_pw = hash_password(password)
-        cur.execute("""
+        hashed_pw = await hash_password_async(password)
+        return await fetchval("""
             INSERT INTO users (username, email, password)
-            VALUES (%s, %s, %s)
+            VALUES ($1, $2, $3)
             RETURNING id;
-        """, (username, email, hashed_pw))
-        conn.commit()
-        return cur.fetchone()[0]
+        """, username, email, hashed_pw)
     except Exception as e:
-        print("❌ Registration error:", e)
+        logger.error("Registration error: %s", e)
         raise
-    finally:
-        cur.close()
-        conn.close()
 
-def authenticate_user(username: str, password: str) -> int | None:
+async def authenticate_user(username: str, password: str) -> Optional[int]:
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-
         # Fetch id and password hash
-        cur.execute("SELECT id, password FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
+        user = await fetchrow("SELECT id, password FROM users WHERE username = $1", username)
 
         if not user:
             return None  # No such user
 
-        user_id, hashed_password = user
-
-        if check_password(password, hashed_password):
+        user_id, hashed_password = user["id"], user["password"]
+
+        if await check_password_async(password, hashed_password):
+            # Cost factor changed since this hash was made: upgrade it transparently
+            # (best effort: the login has already succeeded and must not fail on this)
+            if needs_rehash(hashed_password):
+                try:
+                    rehashed = await hash_password_async(password)
+                    await execute(
+                        "UPDATE users SET password = $1 WHERE id = $2 AND password = $3",
+                        rehashed, user_id, hashed_password
+                    )
+                    password_stats["rehashes"] += 1
+                except Exception as e:
+                    logger.warning("Password rehash failed: %s", e, extra={"user_id": user_id})
             return user_id
         else:
             return None  # Password mismatch
 
     except Exception as e:
-        print("❌ Login error:", e)
+        logger.error("Login error: %s", e)
         raise
-    finally:
-        cur.close()
-        conn.close()
 
-def get_user_details(user_id: int):
+async def get_user_details(user_id: int):
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        cur.execute("""
+        user = await fetchrow("""
             SELECT id, username, email, created_at
             FROM users
-            WHERE id = %s
-        """, (user_id,))
-        user = cur.fetchone()
+            WHERE id = $1
+        """, user_id)
 
         if user:
-            return {
-                "id": user[0],
-                "username": user[1],
-                "email": user[2],
-                "created_at": user[3]
-            }
+            return dict(user)
         else:
             return None
 
     except Exception as e:
-        print("❌ Error fetching user details:", e)
+        logger.error("Error fetching user details: %s", e)
         raise
-    finally:
-        cur.close()
-        conn.close()
@@ -0,0 +1,58 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from events.hub import Subscriber, event_hub
+from planets.service.tile_geometry import parse_bbox
+
+router = APIRouter()
+
+HEARTBEAT_SECONDS = 15
+EVENT_TABLES = {"posts", "comments", "labels"}
+
+
+async def sse_stream(request: Request, subscriber: Subscriber):
+    event_hub.subscribe(subscriber)
+    try:
+        yield b"retry: 3000\n\n"
+        while True:
+            try:
+                payload = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield b": heartbeat\n\n"
+                continue
+            yield f"data: {payload}\n\n".encode()
+    finally:
+        event_hub.unsubscribe(subscriber)
+
+
+# live updates function
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    post_id: Optional[int] = Query(None, description="Only events for this forum thread"),
+    user_id: Optional[int] = Query(None, description="Only events by this user"),
+    bbox: Optional[str] = Query(None, description="west,south,east,north; only geotagged posts/labels inside"),
+    tables: Optional[str] = Query(None, description="Comma-separated: posts, comments, labels")
+):
+    selected = {t.strip() for t in tables.split(",") if t.strip()} if tables else None
+    if selected and selected - EVENT_TABLES:
+        raise HTTPException(status_code=400, detail=f"Unknown tables: {', '.join(sorted(selected - EVENT_TABLES))}")
+    try:
+        box = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    subscriber = Subscriber(post_id=post_id, user_id=user_id, bbox=box, tables=selected)
+    return StreamingResponse(
+        sse_stream(request, subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/stats")
+async def event_stats():
+    return event_hub.get_stats()
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import asyncpg
+
+from db import DB_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# One LISTEN connection per worker fans row-change events out to SSE clients.
+#
+# Triggers on posts, comments and labels pg_notify a small JSON payload on
+# EVENT_CHANNEL. Subscribers are indexed by post_id and user_id so a comment
+# event only touches the clients watching that thread or user; viewport and
+# unfiltered subscribers are checked individually. Each client has a bounded
+# queue; when a slow client's queue is full its oldest event is dropped.
+# In-process consumers (the label cluster index) register with add_handler and
+# see every event; their on_gap callback runs whenever the LISTEN connection is
+# (re)established, since events sent while it was down are lost.
+
+EVENT_CHANNEL = "app_events"
+EVENT_BUFFER = int(os.getenv("EVENT_BUFFER", 100))
+RECONNECT_DELAY = 2.0
+
+hub_stats = {
+    "events": 0,
+    "delivered": 0,
+    "dropped": 0,
+    "reconnects": 0,
+}
+
+
+class Subscriber:
+
+    def __init__(self, post_id: Optional[int] = None, user_id: Optional[int] = None,
+                 bbox: Optional[Tuple[float, float, float, float]] = None,
+                 tables: Optional[Set[str]] = None):
+        self.post_id = post_id
+        self.user_id = user_id
+        self.bbox = bbox
+        self.tables = tables
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_BUFFER)
+        self.dropped = 0
+
+    def matches(self, event: dict) -> bool:
+        if self.tables and event.get("table") not in self.tables:
+            return False
+        if self.post_id is not None and event.get("post_id") != self.post_id:
+            return False
+        if self.user_id is not None and event.get("user_id") != self.user_id:
+            return False
+        if self.bbox is not None:
+            coordinates = event.get("coordinates")
+            if not isinstance(coordinates, list) or len(coordinates) < 2:
+                return False
+            lat, lon = coordinates[0], coordinates[1]
+            if not all(isinstance(value, (int, float)) for value in (lat, lon)):
+                return False
+            west, south, east, north = self.bbox
+            if not south <= lat <= north:
+                return False
+            in_lon = west <= lon <= east if west <= east else (lon >= west or lon <= east)
+            if not in_lon:
+                return False
+        return True
+
+    def offer(self, payload: str):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            hub_stats["dropped"] += 1
+        self.queue.put_nowait(payload)
+        hub_stats["delivered"] += 1
+
+
+class EventHub:
+
+    def __init__(self):
+        self.by_post: Dict[int, Set[Subscriber]] = {}
+        self.by_user: Dict[int, Set[Subscriber]] = {}
+        self.others: Set[Subscriber] = set()
+        self.connection: Optional[asyncpg.Connection] = None
+        self.task: Optional[asyncio.Task] = None
+        self.handlers: List[Tuple[Callable[[dict], None], Callable[[], None]]] = []
+
+    def add_handler(self, on_event: Callable[[dict], None], on_gap: Callable[[], None]):
+        self.handlers.append((on_event, on_gap))
+
+    def subscribe(self, subscriber: Subscriber):
+        if subscriber.post_id is not None:
+            self.by_post.setdefault(subscriber.post_id, set()).add(subscriber)
+        elif subscriber.user_id is not None:
+            self.by_user.setdefault(subscriber.user_id, set()).add(subscriber)
+        else:
+            self.others.add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        for index, key in ((self.by_post, subscriber.post_id), (self.by_user, subscriber.user_id)):
+            if key is not None and subscriber in index.get(key, ()):
+                index[key].discard(subscriber)
+                if not index[key]:
+                    del index[key]
+                return
+        self.others.discard(subscriber)
+
+    def subscriber_count(self) -> int:
+        return (sum(len(s) for s in self.by_post.values())
+                + sum(len(s) for s in self.by_user.values())
+                + len(self.others))
+
+    def dispatch(self, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        hub_stats["events"] += 1
+        for on_event, _ in self.handlers:
+            try:
+                on_event(event)
+            except Exception:
+                logger.exception("Event handler failed")
+        candidates = list(self.others)
+        if event.get("post_id") is not None:
+            candidates.extend(self.by_post.get(event["post_id"], ()))
+        if event.get("user_id") is not None:
+            candidates.extend(self.by_user.get(event["user_id"], ()))
+        for subscriber in candidates:
+            if subscriber.matches(event):
+                subscriber.offer(payload)
+
+    def on_notify(self, connection, pid, channel, payload):
+        self.dispatch(payload)
+
+    async def run(self):
+        """Keep one LISTEN connection open, reconnecting if Postgres drops it"""
+        while True:
+            try:
+                self.connection = await asyncpg.connect(**DB_CONFIG)
+                await self.connection.add_listener(EVENT_CHANNEL, self.on_notify)
+                for _, on_gap in self.handlers:
+                    on_gap()
+                while not self.connection.is_closed():
+                    await asyncio.sleep(RECONNECT_DELAY)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Event listener error: %s", e)
+            hub_stats["reconnects"] += 1
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.connection is not None and not self.connection.is_closed():
+            await self.connection.close()
+
+    def get_stats(self) -> dict:
+        return {**hub_stats, "subscribers": self.subscriber_count(), "buffer": EVENT_BUFFER}
+
+
+event_hub = EventHub()
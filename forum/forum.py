@@ -1,10 +1,26 @@
-from fastapi import APIRouter, HTTPException, Query, Path
+from fastapi import APIRouter, HTTPException, Query, Path, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
 from pydantic import BaseModel
+import json
 from typing import Optional, List
-from db import insert_post, insert_comment, get_posts_with_comments
+from db import insert_post, insert_comment, get_posts_with_comments, get_posts_in_bbox, get_forum_feed
+from service.pagination import decode_cursor, encode_cursor
+from service import query_cache
+from planets.service.tile_geometry import parse_bbox
 
 router = APIRouter()
 
+MAX_VIEWPORT_RESULTS = 1000
+MAX_PAGE_SIZE = 100
+
+
+def parse_cursor(cursor: Optional[str]):
+    try:
+        return decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # Input format
 class PostInput(BaseModel):
     user_id: int
@@ -20,29 +36,93 @@ class CommentInput(BaseModel):
 
 # create post function
 @router.post("/create-post")
-def create_post(data: PostInput):
+async def create_post(data: PostInput):
     try:
-        insert_post(data.user_id, data.title, data.topic, data.content, data.coordinates)
+        await insert_post(data.user_id, data.title, data.topic, data.content, data.coordinates)
         return {"message": "Post created successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 #add comment function
 @router.post("/add-comment")
-def add_comment(data: CommentInput):
+async def add_comment(data: CommentInput):
+    try:
+        comment_id = await insert_comment(data.post_id, data.user_id, data.comment)
+        return {"message": "Comment added successfully.", "id": comment_id}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+#get forum feed function
+@router.get("/feed")
+async def get_feed(
+    topic: Optional[str] = Query(None, description="Topic"),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+):
+    before = parse_cursor(cursor)
     try:
-        insert_comment(data.post_id, data.user_id, data.comment)
-        return {"message": "Comment added successfully."}
+        posts = await get_forum_feed(topic, before, limit + 1)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = encode_cursor(posts[-1]["created_at"], posts[-1]["id"])
+    return {"posts": posts, "next_cursor": next_cursor}
 
 #get forum data function
 @router.get("/get-forum-thread")
-def get_thread(post_id: int = Query(None, description="Post ID"),):
+async def get_thread(
+    request: Request,
+    post_id: int = Query(None, description="Post ID"),
+    comment_limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE, description="Comments per page"),
+    comment_cursor: Optional[str] = Query(None, description="next_comment_cursor from the previous page")
+):
+    after = parse_cursor(comment_cursor)
     try:
-        thread = get_posts_with_comments(post_id)
+        tag = query_cache.thread_tag(post_id)
+        params = {"comment_limit": comment_limit, "comment_cursor": comment_cursor}
+        version, etag, cached, not_modified = await query_cache.lookup(
+            tag, params, request.headers.get("if-none-match")
+        )
+        headers = {"Cache-Control": "no-cache"}
+        if etag is not None:
+            headers["ETag"] = etag
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json", headers={**headers, "X-Cache": "HIT"})
+
+        thread = await get_posts_with_comments(post_id, after, comment_limit)
         if not thread:
             raise HTTPException(status_code=404, detail="Thread not found.")
-        return thread
+        comments = thread["comments"]
+        thread["next_comment_cursor"] = None
+        if len(comments) > comment_limit:
+            thread["comments"] = comments = comments[:comment_limit]
+            thread["next_comment_cursor"] = encode_cursor(comments[-1]["created_at"], comments[-1]["id"])
+
+        body = json.dumps(jsonable_encoder(thread), separators=(",", ":")).encode()
+        await query_cache.store(tag, version, params, body)
+        return Response(content=body, media_type="application/json", headers={**headers, "X-Cache": "MISS"})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+#get geotagged posts in view function
+@router.get("/viewport")
+async def get_posts_in_viewport(
+    bbox: str = Query(..., description="west,south,east,north; west > east crosses the antimeridian"),
+    topic: Optional[str] = Query(None, description="Topic"),
+    limit: int = Query(500, ge=1, le=MAX_VIEWPORT_RESULTS, description="Maximum posts returned")
+):
+    try:
+        west, south, east, north = parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        posts = await get_posts_in_bbox(west, south, east, north, topic, limit)
+        return {"posts": posts}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import csv
+import io
+import json
+from typing import Iterator, List, Optional, Tuple
+
+from db import close_db_pool, copy_labels, export_labels, init_db_pool
+from planets.service.tile_geometry import wrap_lon
+
+# Bulk label import/export.
+#
+# Import formats:
+#   csv     header with celestial_object, title, description, lat, lon (optional user_id)
+#   ndjson  one object per line with the same keys, or "coordinates": [lat, lon]
+#   geojson FeatureCollection of Point features; geometry is [lon, lat] per the spec,
+#           other fields come from properties
+# Rows are validated individually; bad rows are reported and skipped, the rest
+# are loaded with COPY in batches. Longitudes in (180, 360] are stored wrapped
+# to -180..180.
+
+IMPORT_FORMATS = ("csv", "ndjson", "geojson")
+EXPORT_FORMATS = ("ndjson", "geojson")
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+# labels.user_id is an INTEGER column; larger values would fail the whole COPY
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+class RowError(ValueError):
+    pass
+
+
+def to_record(row: dict, default_user_id: Optional[int]) -> tuple:
+    """Validate one input row and turn it into a COPY record"""
+    if not isinstance(row, dict):
+        raise RowError("row must be an object")
+    if "coordinates" in row and row["coordinates"] is not None:
+        coordinates = row["coordinates"]
+        if not isinstance(coordinates, (list, tuple)) or len(coordinates) != 2:
+            raise RowError("coordinates must be [lat, lon]")
+        lat, lon = coordinates
+    else:
+        lat, lon = row.get("lat"), row.get("lon")
+
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise RowError("lat and lon must be numbers")
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 360.0):
+        raise RowError("lat/lon out of range")
+    lon = float(wrap_lon(lon))
+
+    user_id = row.get("user_id")
+    if user_id is None or user_id == "":
+        # Absent from the row (or an empty CSV cell); an explicit 0 is kept
+        user_id = default_user_id
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        raise RowError("user_id is required")
+    if not INT32_MIN <= user_id <= INT32_MAX:
+        raise RowError("user_id out of range")
+
+    celestial_object = row.get("celestial_object") or row.get("celestialObject") or ""
+    if not isinstance(celestial_object, str):
+        raise RowError("celestial_object must be a string")
+    celestial_object = celestial_object.strip()
+    if not celestial_object:
+        raise RowError("celestial_object is required")
+
+    title, description = row.get("title"), row.get("description")
+    if not isinstance(title, (str, type(None))) or not isinstance(description, (str, type(None))):
+        raise RowError("title and description must be strings")
+
+    return user_id, celestial_object, title, description, lat, lon
+
+
+def iter_rows(payload: bytes, fmt: str) -> Iterator[Tuple[int, dict]]:
+    """(row number, raw row) pairs; unparsable lines come through as RowError values"""
+    text = payload.decode("utf-8-sig")
+    if fmt == "csv":
+        for number, row in enumerate(csv.DictReader(io.StringIO(text)), start=1):
+            yield number, row
+    elif fmt == "ndjson":
+        for number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield number, RowError(f"invalid JSON: {e.msg}")
+    elif fmt == "geojson":
+        document = json.loads(text)
+        for number, feature in enumerate(document.get("features", []), start=1):
+            geometry = feature.get("geometry") if isinstance(feature, dict) else None
+            if not isinstance(geometry, dict) or geometry.get("type") != "Point":
+                yield number, RowError("only Point features are supported")
+                continue
+            position = geometry.get("coordinates")
+            if not isinstance(position, list) or len(position) < 2:
+                yield number, RowError("Point coordinates must be [lon, lat]")
+                continue
+            properties = feature.get("properties") or {}
+            if not isinstance(properties, dict):
+                yield number, RowError("properties must be an object")
+                continue
+            yield number, {**properties, "lat": position[1], "lon": position[0]}
+    else:
+        raise ValueError(f"Unsupported format {fmt}")
+
+
+async def import_labels(payload: bytes, fmt: str, default_user_id: Optional[int] = None) -> dict:
+    inserted = 0
+    errors: List[dict] = []
+    error_count = 0
+    batch = []
+
+    for number, row in iter_rows(payload, fmt):
+        try:
+            if isinstance(row, RowError):
+                raise row
+            batch.append(to_record(row, default_user_id))
+        except RowError as e:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"row": number, "error": str(e)})
+            continue
+
+        if len(batch) >= BATCH_SIZE:
+            inserted += await copy_labels(batch)
+            batch = []
+
+    if batch:
+        inserted += await copy_labels(batch)
+
+    return {"inserted": inserted, "failed": error_count, "errors": errors}
+
+
+def json_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def stream_export(user_id: Optional[int], celestial_object: Optional[str], fmt: str):
+    """Yield NDJSON lines or a GeoJSON FeatureCollection, one row at a time"""
+    rows = export_labels(user_id, celestial_object)
+    if fmt == "ndjson":
+        async for row in rows:
+            yield json.dumps(row, default=json_default, separators=(",", ":")).encode() + b"\n"
+        return
+
+    yield b'{"type":"FeatureCollection","features":['
+    first = True
+    async for row in rows:
+        coordinates = row.pop("coordinates")
+        if isinstance(coordinates, list) and len(coordinates) >= 2:
+            geometry = {"type": "Point", "coordinates": [coordinates[1], coordinates[0]]}
+        else:
+            # Legacy rows without usable coordinates go out unlocated, as GeoJSON allows
+            geometry = None
+        feature = {"type": "Feature", "geometry": geometry, "properties": row}
+        yield (b"" if first else b",") + json.dumps(feature, default=json_default, separators=(",", ":")).encode()
+        first = False
+    yield b"]}"
+
+
+async def run_cli(args):
+    await init_db_pool()
+    try:
+        if args.command == "import":
+            with open(args.path, "rb") as f:
+                summary = await import_labels(f.read(), args.format, args.user_id)
+            print(json.dumps(summary, indent=2))
+        else:
+            with open(args.path, "wb") as f:
+                async for chunk in stream_export(args.user_id, args.celestial_object, args.format):
+                    f.write(chunk)
+    finally:
+        await close_db_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk label import/export")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import")
+    importer.add_argument("path")
+    importer.add_argument("--format", choices=IMPORT_FORMATS, default="csv")
+    importer.add_argument("--user-id", type=int)
+
+    exporter = commands.add_parser("export")
+    exporter.add_argument("path")
+    exporter.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    exporter.add_argument("--user-id", type=int)
+    exporter.add_argument("--celestial-object")
+
+    asyncio.run(run_cli(parser.parse_args()))
@@ -0,0 +1,300 @@
+import asyncio
+import math
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from planets.service.tile_geometry import grid_size, tile_span, wrap_lon
+
+# In-memory cluster hierarchy over labels, one index per celestial object.
+#
+# Every zoom level is a grid of 2^CLUSTER_CELL_BITS x 2^CLUSTER_CELL_BITS cells
+# per map tile, so each cell nests exactly inside one cell of the zoom above.
+# A cell keeps count, coordinate sums (centroid = sum / count) and the XOR of
+# its label ids, which is the label id itself whenever count == 1. Inserting or
+# deleting a label touches one cell per zoom; nothing is rebuilt. Above
+# CLUSTER_MAX_ZOOM queries return the individual labels.
+#
+# Indexes are built lazily from Postgres on first use. This worker's own writes
+# are applied straight away; every label change, from any worker, also arrives
+# through the app_events stream (events/hub.py) and is applied again, which is
+# harmless. When that stream reconnects, events may have been missed, so every
+# index is marked stale and rebuilt by its next query.
+
+CLUSTER_MAX_ZOOM = int(os.getenv("CLUSTER_MAX_ZOOM", 12))
+CLUSTER_CELL_BITS = int(os.getenv("CLUSTER_CELL_BITS", 3))
+
+cluster_stats = {
+    "builds": 0,
+    "inserts": 0,
+    "deletes": 0,
+    "events": 0,
+    "queries": 0,
+}
+
+
+def grow(array: np.ndarray, size: int) -> np.ndarray:
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array), 64), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def lon_mask(lon: np.ndarray, west: float, east: float) -> np.ndarray:
+    """west > east means the box crosses the antimeridian"""
+    if west <= east:
+        return (lon >= west) & (lon <= east)
+    return (lon >= west) | (lon <= east)
+
+
+class ZoomLevel:
+
+    def __init__(self, zoom: int, cell_bits: int):
+        cols, rows = grid_size(zoom)
+        self.cols = cols << cell_bits
+        self.rows = rows << cell_bits
+        self.span = tile_span(zoom) / (1 << cell_bits)
+        # Cells present at load time are found by binary search in `keys`;
+        # cells created afterwards go to `extra`. Emptied cells keep their slot
+        # with count 0, so slots never move.
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.extra: Dict[int, int] = {}
+        self.size = 0
+        self.count = np.zeros(0, dtype=np.int32)
+        self.sum_lat = np.zeros(0, dtype=np.float64)
+        self.sum_lon = np.zeros(0, dtype=np.float64)
+        self.id_xor = np.zeros(0, dtype=np.int64)
+
+    def cell_keys(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        col = np.clip(np.floor((lon + 180.0) / self.span).astype(np.int64), 0, self.cols - 1)
+        row = np.clip(np.floor((90.0 - lat) / self.span).astype(np.int64), 0, self.rows - 1)
+        return row * self.cols + col
+
+    def cell_key(self, lat: float, lon: float) -> int:
+        col = min(max(math.floor((lon + 180.0) / self.span), 0), self.cols - 1)
+        row = min(max(math.floor((90.0 - lat) / self.span), 0), self.rows - 1)
+        return row * self.cols + col
+
+    def load(self, ids: np.ndarray, lat: np.ndarray, lon: np.ndarray):
+        self.keys, inverse = np.unique(self.cell_keys(lat, lon), return_inverse=True)
+        n = len(self.keys)
+        self.size = n
+        self.extra = {}
+        self.count = np.bincount(inverse, minlength=n).astype(np.int32)
+        self.sum_lat = np.bincount(inverse, weights=lat, minlength=n)
+        self.sum_lon = np.bincount(inverse, weights=lon, minlength=n)
+        self.id_xor = np.zeros(n, dtype=np.int64)
+        np.bitwise_xor.at(self.id_xor, inverse, ids)
+
+    def find(self, key: int) -> Optional[int]:
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return self.extra.get(key)
+
+    def apply(self, label_id: int, lat: float, lon: float, sign: int):
+        key = self.cell_key(lat, lon)
+        slot = self.find(key)
+        if slot is None:
+            if sign < 0:
+                return
+            slot = self.size
+            self.size += 1
+            for name in ("count", "sum_lat", "sum_lon", "id_xor"):
+                setattr(self, name, grow(getattr(self, name), self.size))
+            self.extra[key] = slot
+        self.count[slot] += sign
+        self.sum_lat[slot] += sign * lat
+        self.sum_lon[slot] += sign * lon
+        self.id_xor[slot] ^= label_id
+        if self.count[slot] <= 0:
+            # Clear float drift so a refilled cell starts clean
+            self.count[slot] = 0
+            self.sum_lat[slot] = self.sum_lon[slot] = 0.0
+            self.id_xor[slot] = 0
+
+
+class ClusterIndex:
+
+    def __init__(self, max_zoom: int = CLUSTER_MAX_ZOOM, cell_bits: int = CLUSTER_CELL_BITS):
+        self.max_zoom = max_zoom
+        self.levels = [ZoomLevel(z, cell_bits) for z in range(max_zoom + 1)]
+        # Point storage; deleted slots are reused
+        self.slot_of: Dict[int, int] = {}
+        self.free: List[int] = []
+        self.size = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.lat = np.zeros(0, dtype=np.float64)
+        self.lon = np.zeros(0, dtype=np.float64)
+        self.alive = np.zeros(0, dtype=bool)
+
+    @classmethod
+    def from_points(cls, ids, lat, lon, **kwargs) -> "ClusterIndex":
+        index = cls(**kwargs)
+        index.ids = np.asarray(ids, dtype=np.int64)
+        index.lat = np.asarray(lat, dtype=np.float64)
+        index.lon = wrap_lon(lon)
+        index.size = len(index.ids)
+        index.alive = np.ones(index.size, dtype=bool)
+        index.slot_of = dict(zip(index.ids.tolist(), range(index.size)))
+        for level in index.levels:
+            level.load(index.ids, index.lat, index.lon)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+    def insert(self, label_id: int, lat: float, lon: float):
+        if label_id in self.slot_of:
+            return
+        lat, lon = float(lat), float(wrap_lon(lon))
+        slot = self.free.pop() if self.free else self.size
+        if slot == self.size:
+            self.size += 1
+            for name in ("ids", "lat", "lon", "alive"):
+                setattr(self, name, grow(getattr(self, name), self.size))
+        self.ids[slot], self.lat[slot], self.lon[slot], self.alive[slot] = label_id, lat, lon, True
+        self.slot_of[label_id] = slot
+        for level in self.levels:
+            level.apply(label_id, lat, lon, 1)
+
+    def delete(self, label_id: int):
+        slot = self.slot_of.pop(label_id, None)
+        if slot is None:
+            return
+        self.alive[slot] = False
+        self.free.append(slot)
+        lat, lon = float(self.lat[slot]), float(self.lon[slot])
+        for level in self.levels:
+            level.apply(label_id, lat, lon, -1)
+
+    def query(self, west: float, south: float, east: float, north: float, zoom: int,
+              limit: Optional[int] = None) -> Tuple[List[dict], List[dict]]:
+        """(clusters, labels) inside the box; labels are single points, clusters have count > 1"""
+        cluster_stats["queries"] += 1
+        if zoom > self.max_zoom:
+            n = self.size
+            lat, lon = self.lat[:n], self.lon[:n]
+            mask = self.alive[:n] & (lat >= south) & (lat <= north) & lon_mask(lon, west, east)
+            slots = np.flatnonzero(mask)[:limit]
+            return [], [
+                {"id": int(self.ids[s]), "lat": float(lat[s]), "lon": float(lon[s])} for s in slots
+            ]
+
+        level = self.levels[max(zoom, 0)]
+        n = level.size
+        count = level.count[:n]
+        occupied = count > 0
+        safe = np.where(occupied, count, 1)
+        lat = level.sum_lat[:n] / safe
+        lon = level.sum_lon[:n] / safe
+        slots = np.flatnonzero(occupied & (lat >= south) & (lat <= north) & lon_mask(lon, west, east))
+        slots = slots[np.argsort(-count[slots], kind="stable")][:limit]
+
+        clusters, labels = [], []
+        for s in slots:
+            point = {"lat": float(lat[s]), "lon": float(lon[s])}
+            if count[s] == 1:
+                labels.append({"id": int(level.id_xor[s]), **point})
+            else:
+                clusters.append({"count": int(count[s]), **point})
+        return clusters, labels
+
+
+class ClusterRegistry:
+
+    def __init__(self):
+        self.indexes: Dict[str, ClusterIndex] = {}
+        self.building: Dict[str, asyncio.Future] = {}
+        # Writes that land while an index is being loaded are replayed afterwards
+        self.pending: Dict[str, List[tuple]] = {}
+        self.stale: Set[str] = set()
+
+    async def get(self, celestial_object: str,
+                  load: Callable[[str], Awaitable[Tuple[np.ndarray, np.ndarray, np.ndarray]]]) -> ClusterIndex:
+        index = self.indexes.get(celestial_object)
+        if index is not None and celestial_object not in self.stale:
+            return index
+
+        future = self.building.get(celestial_object)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.building[celestial_object] = future
+        self.pending[celestial_object] = []
+        self.stale.discard(celestial_object)
+        try:
+            ids, lat, lon = await load(celestial_object)
+            index = ClusterIndex.from_points(ids, lat, lon)
+            for op, *args in self.pending[celestial_object]:
+                getattr(index, op)(*args)
+            self.indexes[celestial_object] = index
+            cluster_stats["builds"] += 1
+            future.set_result(index)
+            return index
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self.building[celestial_object]
+            del self.pending[celestial_object]
+
+    def apply(self, celestial_object: str, op: str, *args):
+        if celestial_object in self.pending:
+            self.pending[celestial_object].append((op, *args))
+        index = self.indexes.get(celestial_object)
+        if index is not None:
+            getattr(index, op)(*args)
+
+    def on_insert(self, celestial_object: str, label_id: int, lat: float, lon: float):
+        cluster_stats["inserts"] += 1
+        self.apply(celestial_object, "insert", label_id, lat, lon)
+
+    def on_delete(self, celestial_object: str, label_id: int):
+        cluster_stats["deletes"] += 1
+        self.apply(celestial_object, "delete", label_id)
+
+    def on_event(self, event: dict):
+        """Apply a labels row change from the app_events stream"""
+        if event.get("table") != "labels":
+            return
+        celestial_object, label_id, op = event.get("celestial_object"), event.get("id"), event.get("op")
+        if celestial_object is None or label_id is None:
+            return
+        cluster_stats["events"] += 1
+        if op in ("UPDATE", "DELETE"):
+            self.apply(celestial_object, "delete", label_id)
+        coordinates = event.get("coordinates")
+        if op in ("INSERT", "UPDATE") and isinstance(coordinates, list) and len(coordinates) >= 2:
+            try:
+                lat, lon = float(coordinates[0]), float(coordinates[1])
+            except (TypeError, ValueError):
+                return
+            self.apply(celestial_object, "insert", label_id, lat, lon)
+
+    def invalidate(self, celestial_object: str):
+        if celestial_object in self.indexes or celestial_object in self.building:
+            self.stale.add(celestial_object)
+
+    def invalidate_all(self):
+        for celestial_object in list(self.indexes) + list(self.building):
+            self.stale.add(celestial_object)
+
+    def get_stats(self) -> dict:
+        return {
+            **cluster_stats,
+            "max_zoom": CLUSTER_MAX_ZOOM,
+            "objects": {name: len(index) for name, index in self.indexes.items()},
+            "stale": sorted(self.stale),
+        }
+
+
+cluster_registry = ClusterRegistry()
@@ -1,54 +1,218 @@
-from fastapi import APIRouter, HTTPException, Query, Path
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Query, Path, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, field_validator
 from typing import Optional, List
-from db import insert_coordinates,get_coordinates,delete_coordinates,update_coordinates
+import json
+import logging
+from db import insert_coordinates,get_coordinates,delete_coordinates,update_coordinates,get_labels_in_bbox,get_label_points
+from planets.service.tile_geometry import grid_size, parse_bbox, tile_bounds, wrap_lon
+from service.pagination import decode_cursor, encode_cursor
+from service import query_cache
+from labels.bulk import EXPORT_FORMATS, IMPORT_FORMATS, import_labels, json_default, stream_export
+from labels.clusters import cluster_registry
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+MAX_VIEWPORT_RESULTS = 1000
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def dump_row(row: dict) -> bytes:
+    return json.dumps(row, default=json_default, separators=(",", ":")).encode()
+
+
+async def stream_label_page(first: dict, rows, limit: int):
+    """Emit {"labels": [...], "next_cursor": ...} row by row without building the page.
+
+    `rows` yields up to limit + 1 rows; the extra one only signals another page.
+    """
+    try:
+        yield b'{"labels":[' + dump_row(first)
+        last, count, has_more = first, 1, False
+        async for row in rows:
+            if count == limit:
+                has_more = True
+                break
+            yield b"," + dump_row(row)
+            last, count = row, count + 1
+    finally:
+        await rows.aclose()
+
+    next_cursor = encode_cursor(last["created_at"], last["id"]) if has_more else None
+    yield b'],"next_cursor":' + json.dumps(next_cursor).encode() + b"}"
+
+
+async def tee_into_cache(chunks, tag: str, version: int, params: dict):
+    """Pass a streamed page through and cache the full body once it has been sent"""
+    body = []
+    async for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    await query_cache.store(tag, version, params, b"".join(body))
+
+
 # Input format
 class LabelInput(BaseModel):
     user_id: int
     celestialObject: str
     title: str
     description: str
-    coordinates: List[float]  # e.g. [102.09, -92.292]
+    coordinates: List[float]  # [lat, lon], e.g. [-4.59, 137.44]
+
+    @field_validator("coordinates")
+    @classmethod
+    def check_coordinates(cls, coordinates: List[float]) -> List[float]:
+        if len(coordinates) != 2:
+            raise ValueError("coordinates must be [lat, lon]")
+        lat, lon = coordinates
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 360.0):
+            raise ValueError("lat/lon out of range")
+        # Stored longitudes are in [-180, 180), which the geom, viewport and cluster queries assume
+        return [lat, float(wrap_lon(lon))]
 
 # insert label function
 @router.post("/add-labels/")
-def add_coordinates(data: LabelInput):
+async def add_coordinates(data: LabelInput):
     try:
-        insert_coordinates(data.user_id,data.celestialObject,data.title,data.description, data.coordinates)
-        return {"message": "Labels inserted successfully."}
+        label_id = await insert_coordinates(data.user_id,data.celestialObject,data.title,data.description, data.coordinates)
+        return {"message": "Labels inserted successfully.", "id": label_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+# bulk import function
+@router.post("/import")
+async def bulk_import_labels(
+    request: Request,
+    format: str = Query("csv", description=f"One of {', '.join(IMPORT_FORMATS)}"),
+    user_id: Optional[int] = Query(None, description="User ID for rows that don't carry one")
+):
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(IMPORT_FORMATS)}")
+    try:
+        return await import_labels(await request.body(), format, user_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# streaming export function
+@router.get("/export")
+async def bulk_export_labels(
+    user_id: Optional[int] = Query(None, description="User ID"),
+    celestial_object: Optional[str] = Query(None, description="Celestial object name"),
+    format: str = Query("ndjson", description=f"One of {', '.join(EXPORT_FORMATS)}")
+):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if user_id is None and celestial_object is None:
+        raise HTTPException(status_code=400, detail="Provide user_id or celestial_object.")
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/geo+json"
+    return StreamingResponse(stream_export(user_id, celestial_object, format), media_type=media_type)
+
 # get label function
 @router.get("/get-labels/user_id/{user_id}")
-def get_labels(
+async def get_labels(
+    request: Request,
     user_id: int = Path(..., description="User ID"),
     celestial_object: Optional[str] = Query(None, description="Celestial object name"),
     title: Optional[str] = Query(None, description="Title of the label"),
-    id: Optional[int] = Query(None, description="Label ID")
+    id: Optional[int] = Query(None, description="Label ID"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
 ):
     try:
-        print("🔍 GET /labels/get-labels triggered", flush=True)
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        logger.debug("GET /labels/get-labels", extra={"user_id": user_id})
+
+        tag = query_cache.labels_tag(user_id)
+        params = {"celestial_object": celestial_object, "title": title, "id": id, "limit": limit, "cursor": cursor}
+        version, etag, cached, not_modified = await query_cache.lookup(
+            tag, params, request.headers.get("if-none-match")
+        )
+        headers = {"Cache-Control": "no-cache"}
+        if etag is not None:
+            headers["ETag"] = etag
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json", headers={**headers, "X-Cache": "HIT"})
 
-        results = get_coordinates(user_id,id,title, celestial_object)
-        if not results:
+        rows = get_coordinates(user_id,id,title, celestial_object, after=after, limit=limit + 1)
+        try:
+            first = await rows.__anext__()
+        except StopAsyncIteration:
             raise HTTPException(status_code=404, detail="No matching labels found.")
-        return {"labels": results}
+        return StreamingResponse(
+            tee_into_cache(stream_label_page(first, rows, limit), tag, version, params),
+            media_type="application/json",
+            headers={**headers, "X-Cache": "MISS"}
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+# viewport label function
+@router.get("/viewport")
+async def get_labels_in_viewport(
+    celestial_object: str = Query(..., description="Celestial object name"),
+    bbox: str = Query(..., description="west,south,east,north; west > east crosses the antimeridian"),
+    limit: int = Query(500, ge=1, le=MAX_VIEWPORT_RESULTS, description="Maximum labels returned")
+):
+    try:
+        west, south, east, north = parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        results = await get_labels_in_bbox(celestial_object, west, south, east, north, limit)
+        return {"labels": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# clustered label function
+@router.get("/clusters")
+async def get_label_clusters(
+    celestial_object: str = Query(..., description="Celestial object name"),
+    zoom: int = Query(..., ge=0, le=24, description="Map zoom"),
+    bbox: Optional[str] = Query(None, description="west,south,east,north; west > east crosses the antimeridian"),
+    x: Optional[int] = Query(None, ge=0, description="Tile column at zoom (instead of bbox)"),
+    y: Optional[int] = Query(None, ge=0, description="Tile row at zoom (instead of bbox)"),
+    limit: int = Query(MAX_VIEWPORT_RESULTS, ge=1, le=10000, description="Maximum clusters plus labels returned")
+):
+    if bbox is not None:
+        try:
+            west, south, east, north = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    elif x is not None and y is not None:
+        cols, rows = grid_size(zoom)
+        if x >= cols or y >= rows:
+            raise HTTPException(status_code=400, detail="Tile is outside the grid at this zoom")
+        west, south, east, north = (float(v) for v in tile_bounds(zoom, x, y))
+    else:
+        raise HTTPException(status_code=400, detail="Provide bbox or x and y.")
+    try:
+        index = await cluster_registry.get(celestial_object, get_label_points)
+        clusters, points = index.query(west, south, east, north, zoom, limit)
+        return {"zoom": zoom, "clusters": clusters, "labels": points}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 #delete label function
 @router.post("/delete-labels/id/{id}")
-def delete_labels(
+async def delete_labels(
     id: Optional[int] = Path(...,description="label id",),
     user_id: Optional[int] = Query(None, description="User ID"),
     celestial_object: Optional[str] = Query(None, description="Celestial object name")
 ):
     try:
-        result= delete_coordinates(id,user_id, celestial_object)
+        result= await delete_coordinates(id,user_id, celestial_object)
         if result:
             return {"message": "Label deleted successfully."}
         else:
@@ -58,13 +222,13 @@ def delete_labels(
     
 #update label function
 @router.post("/update-labels/id/{id}")
-def update_labels(
+async def update_labels(
     id: int = Path(..., description="Label ID"),
     title: Optional[str] = Query(None, description="Title of the label"),
     description: Optional[str] = Query(None, description="Label description")
 ):
     try:
-        result = update_coordinates(id, title, description)
+        result = await update_coordinates(id, title, description)
         if result:
             return {"message": "Label updated successfully."}
         else:
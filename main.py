@@ -1,42 +1,93 @@
+import logging
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from redis import RedisError
 from planets.routes.planets import router as planets_router
 from planets.routes.health import router as health_router
+from planets.routes.static_map import router as static_map_router
 from ai.routes.gemeni import router as gemeni_router
+from ai.routes.jobs import router as ai_jobs_router, job_runner
+from ai.routes.stream import router as ai_stream_router
 from planets.config.redis_config import r, test_redis_connection
+from planets.cache.tile_lease import stop_fill_listener
+from planets.cache.tile_archive import open_tile_archives, close_tile_archives
+from planets.service.static_map import shutdown_render_executor
 from labels import labels
+from labels.clusters import cluster_registry
 from forum.forum import router as forum_router
 from user.user import router as user_router
+from search.search import router as search_router
+from events.events import router as events_router
+from events.hub import event_hub
+from db import init_db_pool, close_db_pool
+from service.password_service import shutdown_password_executor
+from ai.preprocess import shutdown_preprocess_executor
+from service.tracing import TimingMiddleware
+from service.log_service import setup_logging, shutdown_logging
 from fastapi.middleware.cors import CORSMiddleware
 
+setup_logging()
+logger = logging.getLogger(__name__)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
         test_redis_connection()
-        print("Connected to Redis")
+        logger.info("Connected to Redis")
     except Exception as e:
-        print(f"Failed to connect to Redis: {e}")
+        logger.error("Failed to connect to Redis: %s", e)
         raise e
 
+    open_tile_archives()
+
+    try:
+        await init_db_pool()
+        logger.info("Postgres pool ready")
+    except Exception as e:
+        # Tiles don't need Postgres; the pool is retried on first use
+        logger.warning("Failed to create Postgres pool: %s", e)
+
+    # Reconnects in the background until Postgres is reachable; keeps every
+    # worker's label cluster index in step with the others' writes
+    event_hub.add_handler(cluster_registry.on_event, cluster_registry.invalidate_all)
+    event_hub.start()
+    # Resumes region jobs left active by a previous run
+    job_runner.start_supervisor()
+
     yield 
 
+    await stop_fill_listener()
+    await event_hub.stop()
+    await job_runner.stop()
+    close_tile_archives()
+    shutdown_render_executor()
+    shutdown_password_executor()
+    shutdown_preprocess_executor()
+    await close_db_pool()
+
     try:
         r.close()
-        print("Redis connection closed.")
+        logger.info("Redis connection closed")
     except RedisError as e:
-        print(f"Error closing Redis connection: {e}")
+        logger.error("Error closing Redis connection: %s", e)
+
+    shutdown_logging()
 
 
 app = FastAPI(title="Planet Tiles API", lifespan=lifespan)
 app.include_router(planets_router, prefix="/api")
+app.include_router(static_map_router, prefix="/api")
 app.include_router(gemeni_router, prefix="/api")
+app.include_router(ai_jobs_router, prefix="/api")
+app.include_router(ai_stream_router, prefix="/api")
 app.include_router(labels.router, prefix="/labels", tags=["Labels"])
 app.include_router(health_router)
 app.include_router(forum_router, prefix="/forum")
 app.include_router(user_router, prefix="/user")
+app.include_router(search_router, prefix="/search", tags=["Search"])
+app.include_router(events_router, prefix="/events", tags=["Events"])
 
 
 app.add_middleware(
@@ -47,6 +98,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"],  
-    expose_headers=["X-Cache", "Content-Type"],
+    expose_headers=["X-Cache", "Content-Type", "Server-Timing"],
     max_age=3600,
 )
+# Outermost, so Server-Timing covers the whole request
+app.add_middleware(TimingMiddleware)
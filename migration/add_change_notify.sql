@@ -0,0 +1,32 @@
+-- NOTIFY app_events on inserts and updates to posts, comments and labels
+
+CREATE OR REPLACE FUNCTION public.notify_app_event() RETURNS trigger AS $$
+DECLARE
+    payload jsonb := jsonb_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'id', NEW.id, 'user_id', NEW.user_id);
+BEGIN
+    IF TG_TABLE_NAME = 'comments' THEN
+        payload := payload || jsonb_build_object('post_id', NEW.post_id);
+    ELSE
+        payload := payload || jsonb_build_object('coordinates', NEW.coordinates);
+    END IF;
+    IF TG_TABLE_NAME = 'posts' THEN
+        payload := payload || jsonb_build_object('post_id', NEW.id);
+    ELSIF TG_TABLE_NAME = 'labels' THEN
+        payload := payload || jsonb_build_object('celestial_object', NEW.celestial_object);
+    END IF;
+    PERFORM pg_notify('app_events', payload::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_notify ON public.posts;
+CREATE TRIGGER posts_notify AFTER INSERT OR UPDATE ON public.posts
+    FOR EACH ROW EXECUTE FUNCTION public.notify_app_event();
+
+DROP TRIGGER IF EXISTS comments_notify ON public.comments;
+CREATE TRIGGER comments_notify AFTER INSERT OR UPDATE ON public.comments
+    FOR EACH ROW EXECUTE FUNCTION public.notify_app_event();
+
+DROP TRIGGER IF EXISTS labels_notify ON public.labels;
+CREATE TRIGGER labels_notify AFTER INSERT OR UPDATE ON public.labels
+    FOR EACH ROW EXECUTE FUNCTION public.notify_app_event();
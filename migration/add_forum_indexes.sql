@@ -0,0 +1,10 @@
+-- Forum feed keyset pagination and per-thread comment pages
+
+CREATE INDEX IF NOT EXISTS posts_created_idx
+    ON public.posts USING btree (created_at, id);
+
+CREATE INDEX IF NOT EXISTS posts_topic_created_idx
+    ON public.posts USING btree (topic, created_at, id);
+
+CREATE INDEX IF NOT EXISTS comments_post_created_idx
+    ON public.comments USING btree (post_id, created_at, id);
@@ -0,0 +1,7 @@
+-- Keyset pagination of a user's labels on (user_id, created_at, id)
+
+CREATE INDEX IF NOT EXISTS labels_user_created_idx
+    ON public.labels USING btree (user_id, created_at, id);
+
+CREATE INDEX IF NOT EXISTS labels_user_object_created_idx
+    ON public.labels USING btree (user_id, celestial_object, created_at, id);
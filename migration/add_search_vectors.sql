@@ -0,0 +1,29 @@
+-- Full-text search columns and GIN indexes
+
+ALTER TABLE IF EXISTS public.posts
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(topic, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS posts_search_idx
+    ON public.posts USING gin (search_vector);
+
+ALTER TABLE IF EXISTS public.comments
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(comment, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS comments_search_idx
+    ON public.comments USING gin (search_vector);
+
+ALTER TABLE IF EXISTS public.labels
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS labels_search_idx
+    ON public.labels USING gin (search_vector);
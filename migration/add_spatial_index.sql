@@ -0,0 +1,19 @@
+-- Spatial index for label and post coordinates
+
+-- coordinates are [lat, lon]; geom stores them as point(lon, lat)
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+ALTER TABLE IF EXISTS public.labels
+    ADD COLUMN IF NOT EXISTS geom point
+    GENERATED ALWAYS AS (point((coordinates->>1)::float8, (coordinates->>0)::float8)) STORED;
+
+CREATE INDEX IF NOT EXISTS labels_object_geom_idx
+    ON public.labels USING gist (celestial_object, geom);
+
+ALTER TABLE IF EXISTS public.posts
+    ADD COLUMN IF NOT EXISTS geom point
+    GENERATED ALWAYS AS (point((coordinates->>1)::float8, (coordinates->>0)::float8)) STORED;
+
+CREATE INDEX IF NOT EXISTS posts_geom_idx
+    ON public.posts USING gist (geom);
@@ -0,0 +1,266 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from planets.cache.tile_cache import get_redis_client
+from planets.service.mars_service import get_nasa_tile_url
+from planets.service.tile_geometry import in_grid
+
+logger = logging.getLogger(__name__)
+
+# Single-file tile pyramid ("ptar").
+#
+# Layout: header | metadata JSON | tile payloads | index
+# The index is a sorted array of (tile_id, offset, length) records, where
+# tile_id is the zoom base offset plus the z-order (Morton) code of (x, y) on
+# the 2:1 equirectangular grid. Identical payloads (blank ocean, polar fill)
+# are written once and shared by several index entries.
+
+MAGIC = b"PTAR"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIQQQ")  # magic, version, flags, metadata_len, entry_count, index_offset, data_offset
+ENTRY = struct.Struct("<QQI")  # tile_id, offset, length
+TILE_ID = struct.Struct("<Q")
+
+
+def zoom_base(z: int) -> int:
+    """Number of tiles in all zoom levels below z (2 * 4^k tiles at zoom k)"""
+    return 2 * ((4 ** z) - 1) // 3
+
+
+def morton_encode(x: int, y: int) -> int:
+    code = 0
+    bit = 0
+    while x or y:
+        code |= (x & 1) << (2 * bit)
+        code |= (y & 1) << (2 * bit + 1)
+        x >>= 1
+        y >>= 1
+        bit += 1
+    return code
+
+
+def morton_decode(code: int) -> Tuple[int, int]:
+    x = y = 0
+    bit = 0
+    while code:
+        x |= (code & 1) << bit
+        y |= ((code >> 1) & 1) << bit
+        code >>= 2
+        bit += 1
+    return x, y
+
+
+def tile_to_id(z: int, x: int, y: int) -> int:
+    # Off-grid coordinates would alias tiles of the next zoom (or never encode, if negative)
+    if not in_grid(z, x, y):
+        raise ValueError(f"Tile {z}/{x}/{y} is outside the grid")
+    return zoom_base(z) + morton_encode(x, y)
+
+
+def id_to_tile(tile_id: int) -> Tuple[int, int, int]:
+    z = 0
+    while zoom_base(z + 1) <= tile_id:
+        z += 1
+    x, y = morton_decode(tile_id - zoom_base(z))
+    return z, x, y
+
+
+class TileArchiveWriter:
+    """Streams payloads to disk and writes the sorted index on close"""
+
+    def __init__(self, path: str, metadata: Optional[dict] = None):
+        self.path = path
+        self.metadata = json.dumps(metadata or {}).encode("utf-8")
+        self.file = open(path, "wb")
+        self.file.write(b"\0" * HEADER.size)
+        self.file.write(self.metadata)
+        self.data_offset = self.file.tell()
+        self.entries: Dict[int, Tuple[int, int]] = {}
+        self.payloads: Dict[bytes, Tuple[int, int]] = {}
+        self.deduplicated = 0
+
+    def add_tile(self, z: int, x: int, y: int, data: bytes):
+        digest = hashlib.sha256(data).digest()
+        location = self.payloads.get(digest)
+        if location is None:
+            location = (self.file.tell(), len(data))
+            self.file.write(data)
+            self.payloads[digest] = location
+        else:
+            self.deduplicated += 1
+        self.entries[tile_to_id(z, x, y)] = location
+
+    def close(self) -> dict:
+        index_offset = self.file.tell()
+        for tile_id in sorted(self.entries):
+            offset, length = self.entries[tile_id]
+            self.file.write(ENTRY.pack(tile_id, offset, length))
+
+        self.file.seek(0)
+        self.file.write(HEADER.pack(
+            MAGIC, VERSION, 0, len(self.metadata),
+            len(self.entries), index_offset, self.data_offset,
+        ))
+        self.file.close()
+        return {
+            "tiles": len(self.entries),
+            "unique_payloads": len(self.payloads),
+            "deduplicated": self.deduplicated,
+            "bytes": os.path.getsize(self.path),
+        }
+
+
+class TileArchive:
+    """Read-only, mmap-backed archive; lookups are a binary search over the index"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        magic, version, _, metadata_len, count, index_offset, _ = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a tile archive")
+
+        self.metadata = json.loads(bytes(self.view[HEADER.size:HEADER.size + metadata_len]) or b"{}")
+        self.count = count
+        self.index_offset = index_offset
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[memoryview]:
+        """Zero-copy view of the tile payload, or None if not in the archive"""
+        target = tile_to_id(z, x, y)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (tile_id,) = TILE_ID.unpack_from(self.mmap, self.index_offset + mid * ENTRY.size)
+            if tile_id < target:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo == self.count:
+            return None
+        tile_id, offset, length = ENTRY.unpack_from(self.mmap, self.index_offset + lo * ENTRY.size)
+        if tile_id != target:
+            return None
+        return self.view[offset:offset + length]
+
+    def iter_tiles(self) -> Iterable[Tuple[int, int, int]]:
+        for i in range(self.count):
+            (tile_id,) = TILE_ID.unpack_from(self.mmap, self.index_offset + i * ENTRY.size)
+            yield id_to_tile(tile_id)
+
+    def close(self):
+        self.view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # A response still holds a tile view; the mapping goes with it
+            pass
+        self.file.close()
+
+
+# dataset -> archive, configured as TILE_ARCHIVES="global=/data/mars.ptar,moon=/data/moon.ptar"
+tile_archives: Dict[str, TileArchive] = {}
+
+
+def open_tile_archives(spec: Optional[str] = None):
+    spec = spec if spec is not None else os.getenv("TILE_ARCHIVES", "")
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        dataset, _, path = item.partition("=")
+        tile_archives[dataset.strip()] = TileArchive(path.strip())
+
+
+def close_tile_archives():
+    for archive in tile_archives.values():
+        archive.close()
+    tile_archives.clear()
+
+
+def get_archive_tile(dataset: str, z: int, x: int, y: int) -> Optional[memoryview]:
+    archive = tile_archives.get(dataset)
+    if archive is None or not in_grid(z, x, y):
+        return None
+    return archive.get_tile(z, x, y)
+
+
+async def export_from_redis(writer: TileArchiveWriter, dataset: str, batch_size: int = 500) -> int:
+    """Copy every cached tile of a dataset from Redis (L2) into the archive"""
+    client = await get_redis_client()
+    count = 0
+    keys = []
+
+    async def flush():
+        nonlocal count
+        values = await client.mget(keys)
+        for key, data in zip(keys, values):
+            if data:
+                _, _, z, x, y = key.decode().split(":")
+                writer.add_tile(int(z), int(x), int(y), data)
+                count += 1
+        keys.clear()
+
+    try:
+        async for key in client.scan_iter(match=f"tile:{dataset}:*", count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                await flush()
+        if keys:
+            await flush()
+    except RedisError as e:
+        logger.error("Redis export error: %s", e)
+    return count
+
+
+async def export_from_upstream(writer: TileArchiveWriter, dataset: str, min_zoom: int, max_zoom: int, concurrency: int = 8) -> int:
+    """Seed the archive straight from trek.nasa.gov for a zoom range"""
+    from service.image_service import fetch_data_from_url
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(z: int, x: int, y: int):
+        async with semaphore:
+            return z, x, y, await fetch_data_from_url(get_nasa_tile_url(z, x, y, dataset))
+
+    count = 0
+    for z in range(min_zoom, max_zoom + 1):
+        tasks = [fetch(z, x, y) for y in range(2 ** z) for x in range(2 * 2 ** z)]
+        for result in asyncio.as_completed(tasks):
+            z_, x, y, data = await result
+            if data:
+                writer.add_tile(z_, x, y, data)
+                count += 1
+    return count
+
+
+async def build_archive(path: str, dataset: str, source: str, min_zoom: int = 0, max_zoom: int = 3) -> dict:
+    writer = TileArchiveWriter(path, {"dataset": dataset, "source": source, "min_zoom": min_zoom, "max_zoom": max_zoom})
+    if source == "redis":
+        await export_from_redis(writer, dataset)
+    else:
+        await export_from_upstream(writer, dataset, min_zoom, max_zoom)
+    return writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a single-file tile archive")
+    parser.add_argument("out", help="Output archive path")
+    parser.add_argument("--dataset", default="global")
+    parser.add_argument("--source", choices=["redis", "upstream"], default="redis")
+    parser.add_argument("--min-zoom", type=int, default=0)
+    parser.add_argument("--max-zoom", type=int, default=3)
+    args = parser.parse_args()
+
+    summary = asyncio.run(build_archive(args.out, args.dataset, args.source, args.min_zoom, args.max_zoom))
+    print(json.dumps(summary))
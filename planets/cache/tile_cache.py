@@ -1,11 +1,13 @@
 import asyncio
-from typing import Optional
+from typing import Dict, Optional, Tuple
 import redis.asyncio as aioredis
 from redis.exceptions import RedisError
 from cachetools import TTLCache
 import threading
 
 from planets.service.mars_service import get_nasa_tile_url
+from planets.service.tile_geometry import neighbor_tiles, to_tile_list
+from service.tracing import span, traced
 
 # Use async Redis client with connection pooling
 redis_client: Optional[aioredis.Redis] = None
@@ -43,8 +45,9 @@ def get_cache_key(dataset: str, z: int, x: int, y: int) -> str:
     return f"tile:{dataset}:{z}:{x}:{y}"
 
 
-async def get_cached_tile_data(dataset: str, z: int, x: int, y: int) -> Optional[bytes]:
-    """Two-tier cache: memory (L1) -> Redis (L2)"""
+@traced("tile-cache")
+async def lookup_cached_tile(dataset: str, z: int, x: int, y: int) -> Tuple[Optional[bytes], Optional[str]]:
+    """Two-tier cache: memory (L1) -> Redis (L2). Returns (data, "L1" | "L2" | None)"""
     key = get_cache_key(dataset, z, x, y)
     
     cache_stats["total_requests"] += 1
@@ -53,29 +56,37 @@ async def get_cached_tile_data(dataset: str, z: int, x: int, y: int) -> Optional
     with cache_lock:
         if key in memory_cache:
             cache_stats["memory_hits"] += 1
-            return memory_cache[key]
+            return memory_cache[key], "L1"
     
     cache_stats["memory_misses"] += 1
     
     # Check Redis cache
     try:
         client = await get_redis_client()
-        data = await client.get(key)
+        with span("redis"):
+            data = await client.get(key)
         
         if data:
             cache_stats["redis_hits"] += 1
             # Promote to memory cache
             with cache_lock:
                 memory_cache[key] = data
-            return data
+            return data, "L2"
         
         cache_stats["redis_misses"] += 1
-        return None
+        return None, None
     except RedisError:
         cache_stats["redis_misses"] += 1
-        return None
+        return None, None
 
 
+async def get_cached_tile_data(dataset: str, z: int, x: int, y: int) -> Optional[bytes]:
+    """Two-tier cache: memory (L1) -> Redis (L2)"""
+    data, _ = await lookup_cached_tile(dataset, z, x, y)
+    return data
+
+
+@traced("tile-write")
 async def cache_tile_data(dataset: str, z: int, x: int, y: int, data: bytes, ttl: int = 86400) -> bool:
     """Cache to both memory and Redis"""
     key = get_cache_key(dataset, z, x, y)
@@ -93,29 +104,59 @@ async def cache_tile_data(dataset: str, z: int, x: int, y: int, data: bytes, ttl
         return False
 
 
-async def batch_get_tiles(dataset: str, tiles: list) -> dict:
-    """Efficiently fetch multiple tiles at once using Redis pipeline"""
+@traced("tile-cache")
+async def lookup_cached_tiles(tiles: list) -> Dict[tuple, Tuple[bytes, str]]:
+    """{(dataset, z, x, y): (data, "L1" | "L2")} for the tiles found: memory first, then one Redis pipeline"""
+    found = {}
+    missing = []
+    
+    cache_stats["total_requests"] += len(tiles)
+    with cache_lock:
+        for tile in tiles:
+            data = memory_cache.get(get_cache_key(*tile))
+            if data:
+                found[tile] = (data, "L1")
+            else:
+                missing.append(tile)
+    cache_stats["memory_hits"] += len(found)
+    cache_stats["memory_misses"] += len(missing)
+    
+    if not missing:
+        return found
+    
     try:
         client = await get_redis_client()
         pipe = client.pipeline()
         
-        keys = [get_cache_key(dataset, z, x, y) for z, x, y in tiles]
+        keys = [get_cache_key(*tile) for tile in missing]
         
         for key in keys:
             pipe.get(key)
         
-        results = await pipe.execute()
-        
-        tile_data = {}
-        for (z, x, y), data in zip(tiles, results):
-            if data:
-                tile_data[(z, x, y)] = data
-        
-        return tile_data
+        with span("redis"):
+            results = await pipe.execute()
     except RedisError:
-        return {}
+        cache_stats["redis_misses"] += len(missing)
+        return found
+    
+    with cache_lock:
+        for tile, key, data in zip(missing, keys, results):
+            if data:
+                memory_cache[key] = data
+                found[tile] = (data, "L2")
+    hits = sum(1 for data in results if data)
+    cache_stats["redis_hits"] += hits
+    cache_stats["redis_misses"] += len(missing) - hits
+    return found
 
 
+async def batch_get_tiles(dataset: str, tiles: list) -> dict:
+    """Efficiently fetch multiple tiles at once: memory first, then one Redis pipeline for the rest"""
+    found = await lookup_cached_tiles([(dataset, *tile) for tile in tiles])
+    return {tile[1:]: data for tile, (data, _) in found.items()}
+
+
+@traced("tile-write")
 async def batch_cache_tiles(dataset: str, tile_data: dict, ttl: int = 86400) -> int:
     """Efficiently cache multiple tiles at once using Redis pipeline"""
     try:
@@ -207,26 +248,7 @@ async def clear_cache(dataset: Optional[str] = None, z: Optional[int] = None):
 
 def get_neighboring_tiles(z: int, x: int, y: int, radius: int = 1) -> list:
     """Get neighboring tiles with wrap-around for global map"""
-    tiles = []
-    
-    num_cols = 2 * (2 ** z)
-    num_rows = 1 * (2 ** z)
-    
-    x = x % num_cols
-    y = max(0, min(y, num_rows - 1))
-    
-    for dx in range(-radius, radius + 1):
-        for dy in range(-radius, radius + 1):
-            if dx == 0 and dy == 0:
-                continue
-            
-            new_x = (x + dx) % num_cols
-            new_y = y + dy
-            
-            if 0 <= new_y < num_rows:
-                tiles.append((z, new_x, new_y))
-    
-    return tiles
+    return to_tile_list(z, neighbor_tiles(z, x, y, radius))
 
 
 async def prefetch_single_tile(dataset: str, z: int, x: int, y: int, fetch_func) -> bool:
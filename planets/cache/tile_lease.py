@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Dict, Optional, Set, Tuple
+
+from redis.exceptions import RedisError
+
+from planets.cache.tile_cache import (
+    cache_stats,
+    cache_tile_data,
+    get_cache_key,
+    get_cached_tile_data,
+    get_redis_client,
+)
+from planets.service.mars_service import get_nasa_tile_url
+
+logger = logging.getLogger(__name__)
+
+# Cluster-wide single-flight for upstream tile fetches.
+#
+# The node that wins `SET lease:<tile> NX PX` fetches the tile, writes it to
+# L1/L2 and publishes on `tile-filled:<tile>`. Every other node waits for that
+# notification (bounded by LEASE_WAIT_SECONDS) and reads the tile from Redis.
+# To try it locally, start two workers against the same Redis
+# (`uvicorn main:app --port 8001` and `--port 8002`), request the same cold
+# tile from both and compare `upstream_fetches` in /api/cache/stats.
+
+LEASE_TTL_MS = int(os.getenv("TILE_LEASE_TTL_MS", 10000))
+LEASE_WAIT_SECONDS = float(os.getenv("TILE_LEASE_WAIT_SECONDS", 3))
+PREFETCH_CLAIM_TTL_MS = int(os.getenv("PREFETCH_CLAIM_TTL_MS", 2000))
+FILL_LISTENER_RETRY_SECONDS = 1.0
+
+FILL_CHANNEL_PREFIX = "tile-filled:"
+
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Compare-and-delete so a node never releases a lease it no longer owns
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Local single-flight: one upstream fetch per tile per process,
+# tile key -> (future, whether the owner waits on another node's lease)
+in_flight: Dict[str, Tuple[asyncio.Future, bool]] = {}
+
+# Futures waiting for a fill notification, keyed by tile cache key
+fill_waiters: Dict[str, Set[asyncio.Future]] = {}
+fill_listener_task: Optional[asyncio.Task] = None
+# Set while the pattern subscription is live; waiters only trust the cache re-check after that.
+# Created with the listener, inside the running loop (Python 3.9 binds it at construction)
+fill_listener_ready: Optional[asyncio.Event] = None
+
+cache_stats.update({
+    "upstream_fetches": 0,
+    "lease_acquired": 0,
+    "lease_waits": 0,
+    "lease_wait_hits": 0,
+    "lease_timeouts": 0,
+    "prefetch_claims_skipped": 0,
+})
+
+
+def get_lease_key(dataset: str, z: int, x: int, y: int) -> str:
+    return f"lease:{get_cache_key(dataset, z, x, y)}"
+
+
+def get_fill_channel(dataset: str, z: int, x: int, y: int) -> str:
+    return f"{FILL_CHANNEL_PREFIX}{get_cache_key(dataset, z, x, y)}"
+
+
+async def acquire_tile_lease(dataset: str, z: int, x: int, y: int, ttl_ms: int = LEASE_TTL_MS) -> Optional[str]:
+    """Try to become the cluster's fetcher for a tile; returns a lease token or None"""
+    token = f"{NODE_ID}:{uuid.uuid4().hex}"
+    try:
+        client = await get_redis_client()
+        acquired = await client.set(get_lease_key(dataset, z, x, y), token, nx=True, px=ttl_ms)
+    except RedisError:
+        # Redis down: fall back to fetching locally rather than failing the tile
+        return token
+    return token if acquired else None
+
+
+async def release_tile_lease(dataset: str, z: int, x: int, y: int, token: str) -> None:
+    try:
+        client = await get_redis_client()
+        await client.eval(RELEASE_SCRIPT, 1, get_lease_key(dataset, z, x, y), token)
+    except RedisError:
+        pass
+
+
+async def notify_tile_filled(dataset: str, z: int, x: int, y: int) -> None:
+    try:
+        client = await get_redis_client()
+        await client.publish(get_fill_channel(dataset, z, x, y), b"1")
+    except RedisError:
+        pass
+
+
+async def claim_prefetch(dataset: str, z: int, x: int, y: int, ttl_ms: int = PREFETCH_CLAIM_TTL_MS) -> bool:
+    """Cluster-wide replacement for the per-node recent prefetch dict"""
+    try:
+        client = await get_redis_client()
+        claimed = await client.set(f"prefetch:{get_cache_key(dataset, z, x, y)}", NODE_ID, nx=True, px=ttl_ms)
+    except RedisError:
+        return True
+    if not claimed:
+        cache_stats["prefetch_claims_skipped"] += 1
+    return bool(claimed)
+
+
+async def listen_for_fills():
+    client = await get_redis_client()
+    pubsub = client.pubsub()
+    await pubsub.psubscribe(f"{FILL_CHANNEL_PREFIX}*")
+    fill_listener_ready.set()
+    try:
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if not message:
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            key = channel[len(FILL_CHANNEL_PREFIX):]
+            for waiter in fill_waiters.pop(key, ()):
+                if not waiter.done():
+                    waiter.set_result(True)
+    finally:
+        fill_listener_ready.clear()
+        await pubsub.punsubscribe()
+        await pubsub.close()
+
+
+async def run_fill_listener():
+    """Single pattern subscription per process; wakes local waiters on fills from any node"""
+    while True:
+        try:
+            await listen_for_fills()
+        except (RedisError, OSError) as e:
+            # Waiters fall back to their timeout meanwhile
+            logger.warning("Tile fill listener lost its subscription, retrying: %s", e)
+        await asyncio.sleep(FILL_LISTENER_RETRY_SECONDS)
+
+
+def on_fill_listener_done(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Tile fill listener stopped", exc_info=task.exception())
+
+
+def ensure_fill_listener():
+    global fill_listener_task, fill_listener_ready
+    if fill_listener_ready is None:
+        fill_listener_ready = asyncio.Event()
+    if fill_listener_task is None or fill_listener_task.done():
+        fill_listener_task = asyncio.create_task(run_fill_listener())
+        fill_listener_task.add_done_callback(on_fill_listener_done)
+
+
+async def stop_fill_listener():
+    global fill_listener_task
+    if fill_listener_task is not None:
+        fill_listener_task.cancel()
+        try:
+            await fill_listener_task
+        except (asyncio.CancelledError, RedisError):
+            pass
+        fill_listener_task = None
+
+
+async def wait_for_tile_fill(dataset: str, z: int, x: int, y: int, timeout: float = LEASE_WAIT_SECONDS) -> Optional[bytes]:
+    """Wait for another node to fill a tile, then read it from the cache"""
+    ensure_fill_listener()
+    key = get_cache_key(dataset, z, x, y)
+    waiter = asyncio.get_running_loop().create_future()
+    fill_waiters.setdefault(key, set()).add(waiter)
+    cache_stats["lease_waits"] += 1
+
+    async def wait_for_fill():
+        # Register, make sure the subscription is live, then re-check the cache:
+        # a fill that landed after losing the lease is either in the cache by now
+        # or its notification will still reach the registered waiter
+        await fill_listener_ready.wait()
+        data = await get_cached_tile_data(dataset, z, x, y)
+        if not data:
+            await waiter
+            data = await get_cached_tile_data(dataset, z, x, y)
+        return data
+
+    try:
+        data = await asyncio.wait_for(wait_for_fill(), timeout)
+    except asyncio.TimeoutError:
+        cache_stats["lease_timeouts"] += 1
+        # Without a live subscription the notification may have gone missing
+        data = await get_cached_tile_data(dataset, z, x, y)
+    finally:
+        waiters = fill_waiters.get(key)
+        if waiters is not None:
+            waiters.discard(waiter)
+            if not waiters:
+                fill_waiters.pop(key, None)
+
+    if data:
+        cache_stats["lease_wait_hits"] += 1
+    return data
+
+
+async def fetch_and_fill(dataset: str, z: int, x: int, y: int, fetch_func) -> Optional[bytes]:
+    cache_stats["upstream_fetches"] += 1
+    nasa_url = get_nasa_tile_url(z, x, y, dataset)
+    logger.info("Fetching tile upstream", extra={"url": nasa_url})
+    data = await fetch_func(nasa_url)
+    if data:
+        await cache_tile_data(dataset, z, x, y, data)
+        await notify_tile_filled(dataset, z, x, y)
+    return data
+
+
+async def fetch_tile_single_flight(dataset: str, z: int, x: int, y: int, fetch_func, wait: bool = True) -> Optional[bytes]:
+    """Fetch a cold tile so that only one node in the cluster goes upstream.
+
+    With wait=False (prefetch) a tile that another node is already filling is
+    skipped instead of waited on.
+    """
+    key = get_cache_key(dataset, z, x, y)
+    pending = in_flight.get(key)
+    if pending is not None:
+        if not wait:
+            return None
+        future, owner_waits = pending
+        data = await asyncio.shield(future)
+        if data is not None or owner_waits:
+            return data
+        # The owner was a prefetch that skipped a tile another node is filling;
+        # take our own turn at the lease (or wait for the fill) instead of a 404
+        return await fetch_tile_single_flight(dataset, z, x, y, fetch_func, wait)
+
+    future = asyncio.get_running_loop().create_future()
+    in_flight[key] = (future, wait)
+    try:
+        data = await _fetch_with_lease(dataset, z, x, y, fetch_func, wait)
+        future.set_result(data)
+        return data
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        in_flight.pop(key, None)
+        if not future.done():
+            future.cancel()
+        elif not future.cancelled():
+            # Nobody may be awaiting this future; mark any exception as retrieved
+            future.exception()
+
+
+async def _fetch_with_lease(dataset: str, z: int, x: int, y: int, fetch_func, wait: bool) -> Optional[bytes]:
+    token = await acquire_tile_lease(dataset, z, x, y)
+    if token is not None:
+        cache_stats["lease_acquired"] += 1
+        try:
+            return await fetch_and_fill(dataset, z, x, y, fetch_func)
+        finally:
+            await release_tile_lease(dataset, z, x, y, token)
+
+    if not wait:
+        return None
+
+    data = await wait_for_tile_fill(dataset, z, x, y)
+    if data:
+        return data
+
+    # Lease holder is slow or gone; fetch ourselves rather than fail the request
+    return await fetch_and_fill(dataset, z, x, y, fetch_func)
@@ -1,3 +1,4 @@
+import logging
 import os
 from dotenv import load_dotenv
 import redis
@@ -5,6 +6,8 @@ from redis.exceptions import RedisError
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 redis_host = os.getenv("REDIS_HOST", "localhost")
 redis_port = int(os.getenv("REDIS_PORT", 6379))
 
@@ -13,10 +16,10 @@ r = redis.Redis.from_url(redis_host)
 def test_redis_connection():
     try:
         if r.ping():
-            print("uccessfully connected to Redis!")
+            logger.info("Connected to Redis")
             return True
     except RedisError as e:
-        print(f"Failed to connect to Redis: {e}")
+        logger.error("Failed to connect to Redis: %s", e)
         return False
 
 # Test connection on import
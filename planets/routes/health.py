@@ -1,5 +1,15 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
+from typing import Optional
 from datetime import datetime
+import logging
+
+from db import get_db_stats
+from service.password_service import get_password_stats
+from labels.clusters import cluster_registry
+from service.tracing import TRACE_BUFFER_SIZE, get_recent_traces, get_trace_stats
+from service.log_service import get_log_stats
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -7,5 +17,40 @@ router = APIRouter()
 async def health_check():
     """Server health check"""
     now = datetime.now().isoformat()
-    print(f"[{now}] Health check requested")
-    return {"status": "healthy", "timestamp": now}
\ No newline at end of file
+    logger.debug("Health check requested")
+    return {"status": "healthy", "timestamp": now}
+
+
+@router.get("/health/db")
+async def db_health():
+    """Connection pool size, acquire wait and query latency"""
+    return get_db_stats()
+
+
+
+@router.get("/health/passwords")
+async def password_pool_health():
+    """Password hashing pool load and rejections"""
+    return get_password_stats()
+
+
+@router.get("/health/clusters")
+async def cluster_index_health():
+    """Label cluster indexes held by this worker"""
+    return cluster_registry.get_stats()
+
+
+@router.get("/health/traces")
+async def recent_traces(
+    limit: int = Query(50, ge=1, le=TRACE_BUFFER_SIZE),
+    path: Optional[str] = Query(None, description="Only requests whose path starts with this"),
+    min_ms: float = Query(0.0, ge=0, description="Only requests that took at least this long")
+):
+    """Span breakdown of sampled requests (TRACE_SAMPLE_RATE), newest first"""
+    return {**get_trace_stats(), "traces": get_recent_traces(limit, path, min_ms)}
+
+
+@router.get("/health/logs")
+async def log_health():
+    """Log queue depth, dropped and rate-limited records"""
+    return get_log_stats()
@@ -1,17 +1,19 @@
 import asyncio
-from io import BytesIO
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
-from datetime import datetime
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response
+import logging
 import os
 
 from planets.cache.tile_cache import (
-    cache_tile_data, 
-    get_cached_tile_data, 
+    get_cache_stats,
     get_neighboring_tiles,
 )
-from planets.service.mars_service import get_nasa_tile_url
+from planets.cache.tile_lease import claim_prefetch
+from planets.service.tile_service import ARCHIVE, acquire_tile
 from service.image_service import fetch_data_from_url
+from service.tracing import start_background
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -21,8 +23,7 @@ recent_prefetch_requests = {}
 
 @router.get("/metadata/planets")
 async def get_mars_metadata():
-    now = datetime.now().isoformat()
-    print(f"[{now}] Mars metadata requested")
+    logger.debug("Mars metadata requested")
     return {
         "planet": "mars",
         "initial_view": {"center": [0, 0], "zoom": 2},
@@ -40,6 +41,11 @@ async def smart_prefetch_with_limit(dataset: str, z: int, x: int, y: int, fetch_
     
     recent_prefetch_requests[key] = True
     
+    # Another node already prefetching around this tile
+    if not await claim_prefetch(dataset, z, x, y):
+        recent_prefetch_requests.pop(key, None)
+        return
+    
     if len(recent_prefetch_requests) > 1000:
         recent_prefetch_requests.clear()
     
@@ -61,57 +67,36 @@ async def smart_prefetch_with_limit(dataset: str, z: int, x: int, y: int, fetch_
 
 async def prefetch_single_tile_limited(dataset: str, z: int, x: int, y: int, fetch_func):
     try:
-        if await get_cached_tile_data(dataset, z, x, y):
-            return True
-        
-        nasa_url = get_nasa_tile_url(z, x, y, dataset)
-        data = await fetch_func(nasa_url)
-        
-        if data:
-            await cache_tile_data(dataset, z, x, y, data)
-            return True
-        return False
+        result = await acquire_tile(dataset, z, x, y, fetch_func, wait=False)
+        return bool(result.data)
     except Exception:
         return False
 
 
+@router.get("/cache/stats")
+async def cache_stats():
+    return await get_cache_stats()
+
+
 @router.get("/tiles/{dataset}/{z}/{x}/{y}.jpg")
 async def get_tile_global(z: int, x: int, y: int, dataset: str = "global"):
-    cached_data = await get_cached_tile_data(dataset, z, x, y)
-    if cached_data:
-        asyncio.create_task(
-            smart_prefetch_with_limit(dataset, z, x, y, fetch_data_from_url)
-        )
-        
-        return StreamingResponse(
-            BytesIO(cached_data),
-            media_type="image/jpeg",
-            headers={
-                "X-Cache": "HIT", 
-                "Cache-Control": "public, max-age=86400",
-                "Access-Control-Expose-Headers": "X-Cache"
-            }
-        )
+    tile = await acquire_tile(dataset, z, x, y, fetch_data_from_url)
+    if not tile.data:
+        raise HTTPException(status_code=404, detail="Could not fetch tile")
     
-    nasa_url = get_nasa_tile_url(z, x, y, dataset)
-    print(nasa_url)
-    data = await fetch_data_from_url(nasa_url)
-    
-    if data:
-        asyncio.create_task(cache_tile_data(dataset, z, x, y, data))
-        
-        asyncio.create_task(
+    # Archived tiles are read-only and complete; no cache tiers or prefetch
+    if tile.source != ARCHIVE:
+        start_background(
             smart_prefetch_with_limit(dataset, z, x, y, fetch_data_from_url)
         )
-        
-        return StreamingResponse(
-            BytesIO(data),
-            media_type="image/jpeg",
-            headers={
-                "X-Cache": "MISS", 
-                "Cache-Control": "public, max-age=86400",
-                "Access-Control-Expose-Headers": "X-Cache"
-            }
-        )
     
-    return {"error": "Could not fetch tile"}, 404
\ No newline at end of file
+    return Response(
+        content=tile.data,
+        media_type="image/jpeg",
+        headers={
+            "X-Cache": tile.cache_status,
+            "X-Cache-Source": tile.source,
+            "Cache-Control": "public, max-age=86400",
+            "Access-Control-Expose-Headers": "X-Cache, X-Cache-Source"
+        }
+    )
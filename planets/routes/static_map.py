@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response
+from redis.exceptions import RedisError
+
+from planets.cache.tile_cache import get_redis_client
+from planets.service.mars_service import NASA_TITLE_URL
+from planets.service.tile_geometry import parse_bbox
+from planets.service.static_map import (
+    MAX_DIMENSION,
+    get_render_executor,
+    plan_window,
+    render_static_map,
+    window_tiles,
+)
+from planets.service.tile_service import acquire_tiles
+from service.tracing import span
+
+router = APIRouter()
+
+STATIC_MAP_TTL = 86400
+# Maps with tiles missing (upstream errors) aren't stored and only briefly cacheable downstream
+STATIC_MAP_PARTIAL_MAX_AGE = 60
+MAX_TILES = 256
+
+MEDIA_TYPES = {"jpg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png")}
+
+
+def get_static_map_key(dataset: str, z: int, window: tuple, width: int, height: int, fmt: str) -> str:
+    # Window rounded to whole pixels so near-identical requests share one entry
+    normalized = f"{dataset}:{z}:{':'.join(str(round(v)) for v in window)}:{width}x{height}:{fmt}"
+    return f"staticmap:{hashlib.sha256(normalized.encode()).hexdigest()}"
+
+
+@router.get("/staticmap/{dataset}")
+async def get_static_map(
+    dataset: str,
+    z: int = Query(..., ge=0, le=14),
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="Center latitude"),
+    lon: Optional[float] = Query(None, ge=-180, le=180, description="Center longitude"),
+    bbox: Optional[str] = Query(None, description="west,south,east,north; west > east crosses the antimeridian"),
+    width: int = Query(512, ge=1, le=MAX_DIMENSION),
+    height: int = Query(256, ge=1, le=MAX_DIMENSION),
+    format: str = Query("jpg", pattern="^(jpg|png)$"),
+):
+    if dataset not in NASA_TITLE_URL:
+        raise HTTPException(status_code=404, detail=f"Dataset {dataset} is not supported")
+
+    box = None
+    if bbox is not None:
+        try:
+            box = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    elif lat is None or lon is None:
+        raise HTTPException(status_code=400, detail="Provide either lat and lon or bbox")
+
+    window = plan_window(z, (lat, lon) if box is None else None, box, width, height)
+    image_format, media_type = MEDIA_TYPES[format]
+    headers = {"Cache-Control": "public, max-age=86400", "Access-Control-Expose-Headers": "X-Cache"}
+
+    key = get_static_map_key(dataset, z, window, width, height, format)
+    try:
+        client = await get_redis_client()
+        rendered = await client.get(key)
+        if rendered:
+            return Response(content=rendered, media_type=media_type, headers={**headers, "X-Cache": "HIT"})
+    except RedisError:
+        client = None
+
+    placements = window_tiles(z, window)
+    if not placements:
+        raise HTTPException(status_code=400, detail="Requested area is outside the map")
+    if len(placements) > MAX_TILES:
+        raise HTTPException(status_code=400, detail="Requested area covers too many tiles; raise the zoom or shrink the box")
+
+    acquired = await acquire_tiles(sorted({(dataset, z, x, y) for _, _, x, y in placements}))
+
+    tiles = {
+        (column, row): acquired[(dataset, z, x, y)].data
+        for column, row, x, y in placements if acquired[(dataset, z, x, y)].data
+    }
+    loop = asyncio.get_running_loop()
+    with span("render"):
+        rendered = await loop.run_in_executor(
+            get_render_executor(), render_static_map, tiles, window, width, height, image_format
+        )
+
+    if len(tiles) < len(placements):
+        headers = {**headers, "Cache-Control": f"public, max-age={STATIC_MAP_PARTIAL_MAX_AGE}"}
+        return Response(content=rendered, media_type=media_type, headers={**headers, "X-Cache": "PARTIAL"})
+
+    if client is not None:
+        try:
+            await client.setex(key, STATIC_MAP_TTL, rendered)
+        except RedisError:
+            pass
+
+    return Response(content=rendered, media_type=media_type, headers={**headers, "X-Cache": "MISS"})
@@ -0,0 +1,90 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from planets.service.tile_geometry import grid_size, tile_span, wrap_lon
+
+TILE_SIZE = 256
+MAX_DIMENSION = 2048
+
+# Stitching is CPU-bound Pillow work; keep it off the event loop and out of the GIL
+STATIC_MAP_WORKERS = int(os.getenv("STATIC_MAP_WORKERS", 2))
+render_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_render_executor() -> ProcessPoolExecutor:
+    global render_executor
+    if render_executor is None:
+        render_executor = ProcessPoolExecutor(max_workers=STATIC_MAP_WORKERS)
+    return render_executor
+
+
+def shutdown_render_executor():
+    global render_executor
+    if render_executor is not None:
+        render_executor.shutdown(wait=False, cancel_futures=True)
+        render_executor = None
+
+
+def to_world_pixels(lat: float, lon: float, z: int) -> Tuple[float, float]:
+    """Global pixel position at zoom z (origin at lon -180, lat +90)"""
+    scale = TILE_SIZE / tile_span(z)
+    return (lon + 180.0) * scale, (90.0 - lat) * scale
+
+
+def plan_window(z: int, center: Optional[Tuple[float, float]], bbox: Optional[Tuple[float, float, float, float]],
+                width: int, height: int) -> Tuple[float, float, float, float]:
+    """Pixel window (left, top, right, bottom) at zoom z; left may exceed the world width when wrapping"""
+    if bbox is not None:
+        west, south, east, north = bbox
+        if east < west:
+            east += 360.0
+        left, top = to_world_pixels(north, west, z)
+        right, bottom = to_world_pixels(south, east, z)
+        return left, top, right, bottom
+
+    lat, lon = center
+    cx, cy = to_world_pixels(lat, float(wrap_lon(lon)), z)
+    return cx - width / 2, cy - height / 2, cx + width / 2, cy + height / 2
+
+
+def window_tiles(z: int, window: Tuple[float, float, float, float]) -> List[Tuple[int, int, int, int]]:
+    """(column, row, x, y) for every tile under the window; column is unwrapped, x is the real tile"""
+    cols, rows = grid_size(z)
+    left, top, right, bottom = window
+    tiles = []
+    for row in range(max(0, math.floor(top / TILE_SIZE)), min(rows, math.ceil(bottom / TILE_SIZE))):
+        for column in range(math.floor(left / TILE_SIZE), math.ceil(right / TILE_SIZE)):
+            tiles.append((column, row, column % cols, row))
+    return tiles
+
+
+def render_static_map(tiles: Dict[Tuple[int, int], bytes], window: Tuple[float, float, float, float],
+                      width: int, height: int, image_format: str = "JPEG") -> bytes:
+    """Stitch tiles keyed by unwrapped (column, row) and crop/scale to the window. Runs in a worker process."""
+    left, top, right, bottom = window
+    origin_x = math.floor(left / TILE_SIZE) * TILE_SIZE
+    origin_y = math.floor(top / TILE_SIZE) * TILE_SIZE
+    canvas = Image.new(
+        "RGB",
+        (math.ceil(right / TILE_SIZE) * TILE_SIZE - origin_x, math.ceil(bottom / TILE_SIZE) * TILE_SIZE - origin_y),
+    )
+
+    for (column, row), data in tiles.items():
+        with Image.open(BytesIO(data)) as tile:
+            canvas.paste(tile.convert("RGB"), (column * TILE_SIZE - origin_x, row * TILE_SIZE - origin_y))
+
+    crop = canvas.crop((
+        round(left - origin_x), round(top - origin_y),
+        round(right - origin_x), round(bottom - origin_y),
+    ))
+    if crop.size != (width, height):
+        crop = crop.resize((width, height), Image.BILINEAR)
+
+    output = BytesIO()
+    crop.save(output, format=image_format, quality=85)
+    return output.getvalue()
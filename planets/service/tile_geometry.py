@@ -0,0 +1,208 @@
+from typing import Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+# Tile math for the trek.nasa.gov equirectangular (EQ) pyramids.
+#
+# At zoom z the grid is 2 * 2^z columns by 2^z rows; every tile spans
+# 180 / 2^z degrees in both directions. Column 0 starts at longitude -180,
+# row 0 at latitude +90 (north up). Latitudes are planetocentric.
+# All functions accept scalars or NumPy arrays and return arrays of shape
+# (N, 2) holding (x, y) for covers.
+
+ArrayLike = Union[float, np.ndarray]
+
+# Mean radius in km, used for circle covers
+PLANET_RADIUS_KM = {
+    "global": 3389.5,   # Mars
+    "moon": 1737.4,
+    "mercury": 2439.7,
+}
+
+
+def parse_bbox(text: str) -> Tuple[float, float, float, float]:
+    """'west,south,east,north' -> floats; west > east is allowed (antimeridian)"""
+    try:
+        west, south, east, north = (float(v) for v in text.split(","))
+    except ValueError:
+        raise ValueError("bbox must be west,south,east,north")
+    if not (-90.0 <= south < north <= 90.0) or not (-180.0 <= west <= 180.0 and -180.0 <= east <= 180.0):
+        raise ValueError("bbox is out of range")
+    return west, south, east, north
+
+
+def grid_size(z: int) -> Tuple[int, int]:
+    """(columns, rows) at zoom z"""
+    return 2 << z, 1 << z
+
+
+def in_grid(z: int, x: int, y: int) -> bool:
+    cols, rows = grid_size(z) if z >= 0 else (0, 0)
+    return 0 <= x < cols and 0 <= y < rows
+
+
+def tile_span(z: int) -> float:
+    return 180.0 / (1 << z)
+
+
+def wrap_lon(lon: ArrayLike) -> ArrayLike:
+    """Wrap longitudes into [-180, 180)"""
+    return (np.asarray(lon, dtype=np.float64) + 180.0) % 360.0 - 180.0
+
+
+def lonlat_to_tile(lat: ArrayLike, lon: ArrayLike, z: int) -> Tuple[np.ndarray, np.ndarray]:
+    cols, rows = grid_size(z)
+    span = tile_span(z)
+    x = np.floor((wrap_lon(lon) + 180.0) / span).astype(np.int64) % cols
+    y = np.clip(np.floor((90.0 - np.asarray(lat, dtype=np.float64)) / span).astype(np.int64), 0, rows - 1)
+    return x, y
+
+
+def tile_bounds(z: int, x: ArrayLike, y: ArrayLike) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(west, south, east, north) in degrees"""
+    span = tile_span(z)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    west = x * span - 180.0
+    north = 90.0 - y * span
+    return west, north - span, west + span, north
+
+
+def tile_center(z: int, x: ArrayLike, y: ArrayLike) -> Tuple[np.ndarray, np.ndarray]:
+    """(lat, lon) of the tile centre"""
+    span = tile_span(z)
+    lon = (np.asarray(x, dtype=np.float64) + 0.5) * span - 180.0
+    lat = 90.0 - (np.asarray(y, dtype=np.float64) + 0.5) * span
+    return lat, lon
+
+
+def _column_range(west: float, east: float, z: int) -> np.ndarray:
+    """Columns covering [west, east]; west > east means the range crosses the antimeridian"""
+    cols, _ = grid_size(z)
+    span = tile_span(z)
+    if east - west >= 360.0:
+        return np.arange(cols, dtype=np.int64)
+    x0 = min(max(int(np.floor((west + 180.0) / span)), 0), cols - 1)
+    # ceil - 1 so a bound lying on a tile edge doesn't pull in the next column
+    x1 = min(max(int(np.ceil((east + 180.0) / span)) - 1, 0), cols - 1)
+    if west <= east:
+        return np.arange(x0, max(x0, x1) + 1, dtype=np.int64)
+    return np.concatenate([np.arange(x0, cols, dtype=np.int64), np.arange(0, x1 + 1, dtype=np.int64)])
+
+
+def _row_range(south: float, north: float, z: int) -> np.ndarray:
+    _, rows = grid_size(z)
+    span = tile_span(z)
+    y0 = min(max(int(np.floor((90.0 - north) / span)), 0), rows - 1)
+    y1 = min(max(int(np.ceil((90.0 - south) / span)) - 1, y0), rows - 1)
+    return np.arange(y0, y1 + 1, dtype=np.int64)
+
+
+def bbox_cover(west: float, south: float, east: float, north: float, z: int) -> np.ndarray:
+    """Tiles intersecting a lat/lon box. Pass west > east for boxes across the antimeridian."""
+    xs = _column_range(west, east, z)
+    ys = _row_range(south, north, z)
+    grid_x, grid_y = np.meshgrid(xs, ys, indexing="xy")
+    return np.column_stack([grid_x.ravel(), grid_y.ravel()])
+
+
+def haversine_km(lat1: ArrayLike, lon1: ArrayLike, lat2: ArrayLike, lon2: ArrayLike, radius_km: float) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * radius_km * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def circle_cover(lat: float, lon: float, radius_km: float, z: int, dataset: str = "global") -> np.ndarray:
+    """Tiles whose area comes within radius_km of (lat, lon)"""
+    planet_radius = PLANET_RADIUS_KM.get(dataset, PLANET_RADIUS_KM["global"])
+    dlat = np.degrees(radius_km / planet_radius)
+    north, south = lat + dlat, lat - dlat
+
+    if north >= 90.0 or south <= -90.0:
+        candidates = bbox_cover(-180.0, max(south, -90.0), 180.0, min(north, 90.0), z)
+    else:
+        # Widest longitude extent of the circle, reached at the latitude of its tangent points
+        ratio = np.sin(np.radians(dlat)) / np.cos(np.radians(lat))
+        dlon = 180.0 if ratio >= 1.0 else float(np.degrees(np.arcsin(ratio)))
+        if dlon >= 180.0:
+            candidates = bbox_cover(-180.0, south, 180.0, north, z)
+        else:
+            candidates = bbox_cover(float(wrap_lon(lon - dlon)), south, float(wrap_lon(lon + dlon)), north, z)
+
+    west, south_b, east, north_b = tile_bounds(z, candidates[:, 0], candidates[:, 1])
+    # Nearest point of each tile to the centre: clamp latitude, clamp wrapped longitude offset
+    near_lat = np.clip(lat, south_b, north_b)
+    offset = wrap_lon(lon - west)
+    near_lon = west + np.clip(offset, 0.0, east - west)
+    inside = haversine_km(lat, lon, near_lat, near_lon, planet_radius) <= radius_km
+    return candidates[inside]
+
+
+def _unwrap_ring(lons: np.ndarray) -> np.ndarray:
+    """Make a ring's longitudes continuous so edges take the short way across the antimeridian"""
+    steps = np.diff(lons)
+    steps = (steps + 180.0) % 360.0 - 180.0
+    return np.concatenate([lons[:1], lons[0] + np.cumsum(steps)])
+
+
+def polygon_cover(points: Sequence[Sequence[float]], z: int) -> np.ndarray:
+    """Tiles intersecting a polygon given as [(lat, lon), ...] (the UI's Leaflet order)"""
+    ring = np.asarray(points, dtype=np.float64)
+    lats = ring[:, 0]
+    lons = _unwrap_ring(ring[:, 1])
+    cols, _ = grid_size(z)
+    span = tile_span(z)
+
+    # Candidate tiles: bounding box of the unwrapped ring (may exceed +/-180 by design)
+    x_min = int(np.floor((lons.min() + 180.0) / span))
+    x_max = int(np.floor((lons.max() + 180.0) / span))
+    ys = _row_range(lats.min(), lats.max(), z)
+    xs = np.arange(x_min, min(x_max, x_min + cols - 1) + 1, dtype=np.int64)
+    grid_x, grid_y = np.meshgrid(xs, ys, indexing="xy")
+    grid_x, grid_y = grid_x.ravel(), grid_y.ravel()
+
+    # Tiles whose centre lies inside the ring (even-odd rule, vectorised over tiles and edges)
+    c_lat, c_lon = tile_center(z, grid_x, grid_y)
+    lat_a, lat_b = lats[:, None], np.roll(lats, -1)[:, None]
+    lon_a, lon_b = lons[:, None], np.roll(lons, -1)[:, None]
+    crosses = (lat_a > c_lat) != (lat_b > c_lat)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        at_lon = lon_a + (c_lat - lat_a) * (lon_b - lon_a) / (lat_b - lat_a)
+    inside = np.count_nonzero(crosses & (c_lon < at_lon), axis=0) % 2 == 1
+    covered = np.column_stack([grid_x[inside], grid_y[inside]])
+
+    # Tiles touched by the ring itself: sample each edge finer than a tile
+    samples = []
+    for la, lo, lb, lob in zip(lats, lons, np.roll(lats, -1), np.roll(lons, -1)):
+        n = int(np.ceil(max(abs(lb - la), abs(lob - lo)) / (span / 8))) + 1
+        t = np.linspace(0.0, 1.0, n)
+        samples.append(np.column_stack([la + (lb - la) * t, lo + (lob - lo) * t]))
+    edge = np.concatenate(samples)
+    ex, ey = lonlat_to_tile(edge[:, 0], edge[:, 1], z)
+
+    covered[:, 0] %= cols
+    return unique_tiles(np.concatenate([covered, np.column_stack([ex, ey])]))
+
+
+def neighbor_tiles(z: int, x: int, y: int, radius: int = 1) -> np.ndarray:
+    """Ring of tiles around (x, y), wrapping in longitude and clipped at the poles"""
+    cols, rows = grid_size(z)
+    x = x % cols
+    y = max(0, min(y, rows - 1))
+    offsets = np.arange(-radius, radius + 1)
+    dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+    dx, dy = dx.ravel(), dy.ravel()
+    keep = ~((dx == 0) & (dy == 0))
+    nx = (x + dx[keep]) % cols
+    ny = y + dy[keep]
+    valid = (ny >= 0) & (ny < rows)
+    return np.column_stack([nx[valid], ny[valid]])
+
+
+def unique_tiles(xy: np.ndarray) -> np.ndarray:
+    return np.unique(xy.astype(np.int64), axis=0) if len(xy) else xy.reshape(0, 2).astype(np.int64)
+
+
+def to_tile_list(z: int, xy: Iterable) -> List[Tuple[int, int, int]]:
+    """(x, y) array -> [(z, x, y), ...] as the cache helpers expect"""
+    return [(z, int(x), int(y)) for x, y in xy]
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from planets.cache.tile_archive import get_archive_tile
+from planets.cache.tile_cache import lookup_cached_tile, lookup_cached_tiles
+from planets.cache.tile_lease import fetch_tile_single_flight
+from planets.service.tile_geometry import in_grid
+from service.image_service import fetch_data_from_url
+
+# One way to get tile bytes, for the tile, static map and AI routes.
+#
+# Order: read-only archive, memory (L1), Redis (L2), then trek.nasa.gov through
+# the single-flight lease, which writes the tile back to L1/L2. Each tile is
+# looked up exactly once per call, and the result says where the bytes came
+# from and how long the lookup and the upstream fetch took.
+
+ARCHIVE, L1, L2, UPSTREAM = "ARCHIVE", "L1", "L2", "UPSTREAM"
+
+
+class TileResult:
+
+    __slots__ = ("dataset", "z", "x", "y", "data", "source", "lookup_ms", "fetch_ms")
+
+    def __init__(self, dataset: str, z: int, x: int, y: int, data: Optional[bytes], source: Optional[str],
+                 lookup_ms: float = 0.0, fetch_ms: float = 0.0):
+        self.dataset = dataset
+        self.z = z
+        self.x = x
+        self.y = y
+        self.data = data
+        self.source = source
+        self.lookup_ms = lookup_ms
+        self.fetch_ms = fetch_ms
+
+    @property
+    def cache_status(self) -> str:
+        """X-Cache value: ARCHIVE, HIT (L1/L2) or MISS"""
+        if self.source == ARCHIVE:
+            return ARCHIVE
+        return "HIT" if self.source in (L1, L2) else "MISS"
+
+    def provenance(self) -> dict:
+        return {
+            "source": self.source,
+            "lookup_ms": round(self.lookup_ms, 3),
+            "fetch_ms": round(self.fetch_ms, 3),
+        }
+
+
+def elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
+async def fetch_upstream(result: TileResult, fetch_func, wait: bool) -> TileResult:
+    start = time.perf_counter()
+    result.data = await fetch_tile_single_flight(result.dataset, result.z, result.x, result.y, fetch_func, wait=wait)
+    result.fetch_ms = elapsed_ms(start)
+    result.source = UPSTREAM if result.data else None
+    return result
+
+
+async def acquire_tile(dataset: str, z: int, x: int, y: int, fetch_func=fetch_data_from_url,
+                       wait: bool = True, use_archive: bool = True) -> TileResult:
+    """Tile bytes plus provenance; data is None if upstream has no such tile.
+
+    With wait=False (prefetch) a tile another node is already fetching is skipped.
+    """
+    start = time.perf_counter()
+    if not in_grid(z, x, y):
+        return TileResult(dataset, z, x, y, None, None)
+    if use_archive:
+        archived = get_archive_tile(dataset, z, x, y)
+        if archived is not None:
+            return TileResult(dataset, z, x, y, bytes(archived), ARCHIVE, elapsed_ms(start))
+
+    data, tier = await lookup_cached_tile(dataset, z, x, y)
+    result = TileResult(dataset, z, x, y, data, tier, elapsed_ms(start))
+    if data:
+        return result
+    return await fetch_upstream(result, fetch_func, wait)
+
+
+async def acquire_tiles(tiles: List[Tuple[str, int, int, int]], fetch_func=fetch_data_from_url,
+                        use_archive: bool = True) -> Dict[Tuple[str, int, int, int], TileResult]:
+    """Acquire several (dataset, z, x, y) tiles: one Redis round trip for all
+    cache lookups, then concurrent upstream fetches for the misses"""
+    start = time.perf_counter()
+    results: Dict[Tuple[str, int, int, int], TileResult] = {}
+    pending = []
+    for tile in dict.fromkeys(tiles):
+        if not in_grid(*tile[1:]):
+            results[tile] = TileResult(*tile, None, None)
+            continue
+        archived = get_archive_tile(*tile) if use_archive else None
+        if archived is not None:
+            results[tile] = TileResult(*tile, bytes(archived), ARCHIVE)
+        else:
+            pending.append(tile)
+
+    found = await lookup_cached_tiles(pending) if pending else {}
+    lookup_ms = elapsed_ms(start)
+    misses = []
+    for tile in pending:
+        data, tier = found.get(tile, (None, None))
+        results[tile] = TileResult(*tile, data, tier)
+        if data is None:
+            misses.append(results[tile])
+    for result in results.values():
+        result.lookup_ms = lookup_ms
+
+    if misses:
+        fetched = await asyncio.gather(*(fetch_upstream(result, fetch_func, True) for result in misses),
+                                       return_exceptions=True)
+        for result, outcome in zip(misses, fetched):
+            if isinstance(outcome, Exception):
+                result.data, result.source = None, None
+    return results
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from db import search_content, SEARCH_KINDS
+from planets.service.tile_geometry import parse_bbox
+
+router = APIRouter()
+
+MAX_RESULTS = 100
+
+# search function
+@router.get("/")
+async def search(
+    q: str = Query(..., min_length=1, max_length=200, description="Search text (web search syntax)"),
+    kinds: str = Query(",".join(SEARCH_KINDS), description="Comma-separated: posts, comments, labels"),
+    celestial_object: Optional[str] = Query(None, description="Celestial object name (labels only)"),
+    bbox: Optional[str] = Query(None, description="west,south,east,north; west > east crosses the antimeridian"),
+    limit: int = Query(20, ge=1, le=MAX_RESULTS, description="Maximum results")
+):
+    selected = [kind.strip() for kind in kinds.split(",") if kind.strip()]
+    unknown = set(selected) - set(SEARCH_KINDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown kinds: {', '.join(sorted(unknown))}")
+    try:
+        box = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        results = await search_content(q, selected, celestial_object, box, limit)
+        return {"results": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,6 +1,11 @@
+import logging
 from typing import Optional
 import httpx
 
+from service.tracing import traced
+
+logger = logging.getLogger(__name__)
+
 http_client: Optional[httpx.AsyncClient] = None
 
 async def get_http_client():
@@ -12,6 +17,7 @@ async def get_http_client():
         )
     return http_client
 
+@traced("upstream")
 async def fetch_data_from_url(url: str) -> Optional[bytes]:
     try:
         client = await get_http_client()
@@ -21,5 +27,5 @@ async def fetch_data_from_url(url: str) -> Optional[bytes]:
             return response.content
         return None
     except Exception as e:
-        print(f"✗ Fetch error: {e}")
+        logger.warning("Fetch error: %s", e, extra={"url": url})
         return None
@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+# Structured logging off the event loop.
+#
+# Modules log through logging.getLogger(__name__). Records are rate limited and
+# put on a bounded queue by the calling thread; a QueueListener thread formats
+# them as one JSON object per line and writes them to stderr, so a slow
+# terminal or log collector never blocks a request. When the queue is full,
+# records are dropped and counted rather than waited for.
+#
+#   LOG_LEVEL=INFO                               root level
+#   LOG_LEVELS=planets.cache=DEBUG,db=WARNING    per-module levels (logger prefixes)
+#   LOG_RATE_BURST / LOG_RATE_WINDOW             same message from the same logger at
+#                                                most BURST times per WINDOW seconds; the
+#                                                next one that passes carries "suppressed"
+#   LOG_QUEUE_SIZE                               records buffered for the writer thread
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_RATE_BURST = int(os.getenv("LOG_RATE_BURST", 20))
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", 10))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+log_listener: Optional[QueueListener] = None
+
+log_stats = {
+    "queued": 0,
+    "dropped": 0,
+    "suppressed": 0,
+}
+
+# LogRecord attributes that are not `extra` fields
+RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "suppressed"}
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """At most `burst` records per (logger, message template) per `window` seconds"""
+
+    def __init__(self, burst: int = LOG_RATE_BURST, window: float = LOG_RATE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.counters: Dict[Tuple[str, str], list] = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None or now - counter[0] >= self.window:
+                if len(self.counters) > 10000:
+                    self.counters.clear()
+                suppressed = counter[2] if counter is not None else 0
+                self.counters[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if counter[1] < self.burst:
+                counter[1] += 1
+                return True
+            counter[2] += 1
+        log_stats["suppressed"] += 1
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message and traceback now, while args and exc_info are still live;
+        # the JSON itself is built on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            log_stats["queued"] += 1
+        except queue.Full:
+            log_stats["dropped"] += 1
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging():
+    """Route all logging through the queue; safe to call more than once"""
+    global log_listener
+    if log_listener is not None:
+        return
+
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter())
+    log_listener = QueueListener(records, output, respect_handler_level=False)
+    log_listener.start()
+
+    handler = DroppingQueueHandler(records)
+    handler.addFilter(RateLimitFilter(LOG_RATE_BURST, LOG_RATE_WINDOW))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+
+def get_log_stats() -> dict:
+    return {
+        **log_stats,
+        "pending": log_listener.queue.qsize() if log_listener is not None else 0,
+        "level": LOG_LEVEL,
+        "levels": parse_levels(LOG_LEVELS),
+    }
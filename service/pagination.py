@@ -0,0 +1,21 @@
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+# Opaque keyset cursors over (created_at, id)
+
+
+def encode_cursor(created_at, row_id: int) -> str:
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    raw = json.dumps([created_at, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
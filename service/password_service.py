@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+# bcrypt in a dedicated process pool.
+#
+# Each hash/check costs ~250 ms of CPU at cost 12. Running it on Starlette's
+# threadpool (or the event loop) starves every other route during a login
+# burst, so it gets its own processes and a bounded admission count: once
+# PASSWORD_QUEUE_LIMIT operations are queued or running, new ones are
+# rejected with PasswordPoolOverloaded instead of piling up.
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", PASSWORD_WORKERS * 8))
+
+password_executor: Optional[ProcessPoolExecutor] = None
+admitted = 0
+
+password_stats = {
+    "hashes": 0,
+    "checks": 0,
+    "rehashes": 0,
+    "rejected": 0,
+    "busy_ms_total": 0.0,
+}
+
+
+class PasswordPoolOverloaded(Exception):
+    pass
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def check_password(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def hash_rounds(hashed: str) -> int:
+    """Cost factor from a '$2b$12$...' hash"""
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def needs_rehash(hashed: str, rounds: Optional[int] = None) -> bool:
+    return hash_rounds(hashed) != (rounds or BCRYPT_ROUNDS)
+
+
+def get_password_executor() -> ProcessPoolExecutor:
+    global password_executor
+    if password_executor is None:
+        password_executor = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS)
+    return password_executor
+
+
+def shutdown_password_executor():
+    global password_executor
+    if password_executor is not None:
+        password_executor.shutdown(wait=False, cancel_futures=True)
+        password_executor = None
+
+
+async def run_in_pool(func, *args):
+    global admitted
+    if admitted >= PASSWORD_QUEUE_LIMIT:
+        password_stats["rejected"] += 1
+        raise PasswordPoolOverloaded("Too many concurrent password operations")
+
+    admitted += 1
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_password_executor(), func, *args)
+    finally:
+        admitted -= 1
+        password_stats["busy_ms_total"] += (time.perf_counter() - start) * 1000
+
+
+async def hash_password_async(password: str) -> str:
+    password_stats["hashes"] += 1
+    return await run_in_pool(hash_password, password, BCRYPT_ROUNDS)
+
+
+async def check_password_async(password: str, hashed: str) -> bool:
+    password_stats["checks"] += 1
+    return await run_in_pool(check_password, password, hashed)
+
+
+def get_password_stats() -> dict:
+    return {
+        **password_stats,
+        "in_flight": admitted,
+        "queue_limit": PASSWORD_QUEUE_LIMIT,
+        "workers": PASSWORD_WORKERS,
+        "rounds": BCRYPT_ROUNDS,
+    }
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import random
+import zlib
+from typing import Iterable, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from planets.cache.tile_cache import get_redis_client
+
+# Read-through cache for Postgres query results.
+#
+# Every cached result belongs to a tag ("labels:user:7", "thread:42") whose
+# version lives in Redis under qv:<tag>. Writers bump the version; readers
+# build keys and ETags from the current version, so stale entries are never
+# read again and simply age out. The ETag is known before touching Postgres,
+# which lets a matching If-None-Match return 304 straight away.
+#
+# A missing version (new tag, or Redis was flushed) is seeded with a random
+# 48-bit value rather than starting from 0, so ETags handed out before the
+# flush can't match again and earn a stale 304. While Redis is unreachable
+# responses carry no ETag at all.
+
+QUERY_CACHE_TTL = 3600
+COMPRESS_OVER = 1024
+
+query_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "not_modified": 0,
+    "invalidations": 0,
+}
+
+
+def labels_tag(user_id: int) -> str:
+    return f"labels:user:{user_id}"
+
+
+def thread_tag(post_id: int) -> str:
+    return f"thread:{post_id}"
+
+
+def params_digest(params: dict) -> str:
+    raw = json.dumps(params, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def make_etag(tag: str, version: int, params: dict) -> str:
+    return f'W/"{tag}:{version}:{params_digest(params)}"'
+
+
+def get_entry_key(tag: str, version: int, params: dict) -> str:
+    return f"qc:{tag}:{version}:{params_digest(params)}"
+
+
+def encode_body(body: bytes) -> bytes:
+    """One-byte format marker, then raw or zlib-compressed JSON"""
+    if len(body) > COMPRESS_OVER:
+        return b"z" + zlib.compress(body, 1)
+    return b"j" + body
+
+
+def decode_body(stored: bytes) -> bytes:
+    return zlib.decompress(stored[1:]) if stored[:1] == b"z" else stored[1:]
+
+
+def version_seed() -> int:
+    return random.getrandbits(48)
+
+
+async def get_version(tag: str) -> int:
+    """Current version of a tag, seeding it if missing; -1 if Redis is unavailable"""
+    try:
+        client = await get_redis_client()
+        version = await client.get(f"qv:{tag}")
+        if version is None:
+            pipe = client.pipeline()
+            pipe.set(f"qv:{tag}", version_seed(), nx=True)
+            pipe.get(f"qv:{tag}")
+            _, version = await pipe.execute()
+        return int(version)
+    except RedisError:
+        return -1
+
+
+async def bump_versions(tags: Iterable[str]):
+    tags = list(tags)
+    if not tags:
+        return
+    try:
+        client = await get_redis_client()
+        pipe = client.pipeline()
+        for tag in tags:
+            pipe.set(f"qv:{tag}", version_seed(), nx=True)
+            pipe.incr(f"qv:{tag}")
+        await pipe.execute()
+        query_cache_stats["invalidations"] += len(tags)
+    except RedisError:
+        pass
+
+
+async def lookup(tag: str, params: dict, if_none_match: Optional[str]) -> Tuple[int, Optional[str], Optional[bytes], bool]:
+    """(version, etag or None, cached body or None, not_modified)"""
+    version = await get_version(tag)
+    if version < 0:
+        # Redis unavailable: serve uncached and without an ETag
+        return version, None, None, False
+    etag = make_etag(tag, version, params)
+    if if_none_match == etag:
+        query_cache_stats["not_modified"] += 1
+        return version, etag, None, True
+    try:
+        client = await get_redis_client()
+        stored = await client.get(get_entry_key(tag, version, params))
+    except RedisError:
+        stored = None
+    if stored:
+        query_cache_stats["hits"] += 1
+        return version, etag, decode_body(stored), False
+    query_cache_stats["misses"] += 1
+    return version, etag, None, False
+
+
+async def store(tag: str, version: int, params: dict, body: bytes):
+    if version < 0:
+        return
+    try:
+        client = await get_redis_client()
+        await client.setex(get_entry_key(tag, version, params), QUERY_CACHE_TTL, encode_body(body))
+    except RedisError:
+        pass
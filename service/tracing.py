@@ -0,0 +1,200 @@
+import asyncio
+import functools
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+
+# Per-request timing spans.
+#
+# TimingMiddleware starts a Trace for each HTTP request and keeps it in a
+# context variable; span("name") blocks and @traced("name") coroutines add
+# (name, start, end) to it, including from tasks the request gathers. Span
+# totals per name go out as a Server-Timing header, e.g.
+#
+#   Server-Timing: tile-cache;dur=0.41, redis;dur=0.37, app;dur=0.88
+#
+# (concurrent spans add up, so a name's total can exceed app's wall time)
+# and TRACE_SAMPLE_RATE of requests are kept whole, with every span, in a ring
+# of the last TRACE_BUFFER_SIZE traces (GET /health/traces). Spans recorded
+# after the headers went out (streamed bodies) only appear in sampled traces.
+# With SERVER_TIMING=0 an unsampled request has no trace, and a span costs a
+# context variable lookup.
+#
+# Work that outlives its request (prefetch, region jobs) is started with
+# start_background(), which runs it outside the request's trace.
+#
+# Span names: tile-cache, redis, tile-write, upstream, db-wait, db, ai-queue,
+# model, ai-prep, render.
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") != "0"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 200))
+
+current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+recent_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+# Strong references to background tasks until they finish
+background_tasks = set()
+
+trace_stats = {
+    "requests": 0,
+    "sampled": 0,
+}
+
+
+class Trace:
+
+    __slots__ = ("method", "path", "status", "started_at", "start", "end", "spans")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.status: Optional[int] = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans = []
+
+    def totals(self) -> dict:
+        totals = {}
+        for name, start, end in self.spans:
+            totals[name] = totals.get(name, 0.0) + (end - start)
+        return totals
+
+    def server_timing(self) -> str:
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.totals().items()]
+        entries.append(f"app;dur={(time.perf_counter() - self.start) * 1000:.2f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(((self.end or time.perf_counter()) - self.start) * 1000, 3),
+            "totals_ms": {name: round(seconds * 1000, 3) for name, seconds in self.totals().items()},
+            "spans": [
+                {"name": name, "offset_ms": round((start - self.start) * 1000, 3), "ms": round((end - start) * 1000, 3)}
+                for name, start, end in self.spans
+            ],
+        }
+
+
+class span:
+    """with span("db"): ... / async with span("db"): ... records into the request's trace, if any"""
+
+    __slots__ = ("name", "trace", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace = current_trace.get()
+
+    def __enter__(self):
+        if self.trace is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.trace.spans.append((self.name, self.start, time.perf_counter()))
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        return self.__exit__(*exc)
+
+
+def traced(name: str):
+    """Record each call of the decorated coroutine function as a span"""
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            trace = current_trace.get()
+            if trace is None:
+                return await func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                trace.spans.append((name, start, time.perf_counter()))
+        return wrapper
+    return decorate
+
+
+async def run_untraced(coro):
+    # The task runs in a copy of the caller's context; detach it from the request
+    current_trace.set(None)
+    return await coro
+
+
+def start_background(coro) -> asyncio.Task:
+    """create_task for work that outlives the request, so its spans don't land in the request's trace"""
+    task = asyncio.ensure_future(run_untraced(coro))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+class TimingMiddleware:
+    """ASGI middleware: a Trace per HTTP request, Server-Timing header, sampled ring buffer"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+        if not (SERVER_TIMING or sampled):
+            return await self.app(scope, receive, send)
+
+        trace = Trace(scope["method"], scope["path"])
+        trace_stats["requests"] += 1
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                if SERVER_TIMING:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", trace.server_timing().encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        token = current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_trace.reset(token)
+            trace.end = time.perf_counter()
+            if sampled:
+                trace_stats["sampled"] += 1
+                recent_traces.append(trace)
+
+
+def get_recent_traces(limit: int = TRACE_BUFFER_SIZE, path: Optional[str] = None, min_ms: float = 0.0) -> list:
+    """Sampled traces, newest first"""
+    traces = []
+    for trace in reversed(recent_traces):
+        if path is not None and not trace.path.startswith(path):
+            continue
+        if (trace.end - trace.start) * 1000 < min_ms:
+            continue
+        traces.append(trace.to_dict())
+        if len(traces) >= limit:
+            break
+    return traces
+
+
+def get_trace_stats() -> dict:
+    return {
+        **trace_stats,
+        "server_timing": SERVER_TIMING,
+        "sample_rate": TRACE_SAMPLE_RATE,
+        "buffered": len(recent_traces),
+        "buffer_size": TRACE_BUFFER_SIZE,
+    }
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+from typing import Any, AsyncContextManager, Awaitable, Callable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Coalesces concurrent single-row inserts into one multi-row statement.
+#
+# Callers await submit(record) and get back their own row id (or their own
+# exception). Records are buffered for up to WRITE_BATCH_LINGER_MS or until
+# WRITE_BATCH_MAX are waiting, then handed to insert(conn, records) inside a
+# transaction; it must return one id per record in the same order. If a batch
+# fails, its records are retried one at a time on the same connection, each
+# under its own savepoint, so a single bad row only fails its own caller and
+# the retry never takes more than one pooled connection. on_commit(records)
+# runs after the rows that made it are committed (cache invalidation).
+
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", 200))
+WRITE_BATCH_LINGER_MS = float(os.getenv("WRITE_BATCH_LINGER_MS", 5))
+
+
+class InsertBatcher:
+
+    def __init__(self, name: str, insert: Callable[[Any, List[Any]], Awaitable[List[Any]]],
+                 connect: Callable[[], AsyncContextManager],
+                 on_commit: Optional[Callable[[List[Any]], Awaitable[None]]] = None,
+                 max_batch: Optional[int] = None, linger_ms: Optional[float] = None):
+        self.name = name
+        self.insert = insert
+        self.connect = connect
+        self.on_commit = on_commit
+        self.max_batch = max_batch or WRITE_BATCH_MAX
+        self.linger = (linger_ms if linger_ms is not None else WRITE_BATCH_LINGER_MS) / 1000
+        self.pending: List[Tuple[Any, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks: Set[asyncio.Task] = set()
+        self.stats = {"rows": 0, "batches": 0, "failed_batches": 0, "max_batch_seen": 0}
+
+    async def submit(self, record) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((record, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush_pending()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.linger, self.flush_pending)
+        return await future
+
+    def flush_pending(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self.run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self.stats["batches"] += 1
+        self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+        try:
+            async with self.connect() as conn:
+                try:
+                    async with conn.transaction():
+                        ids = await self.insert(conn, [record for record, _ in batch])
+                    outcomes = [(row_id, None) for row_id in ids]
+                except Exception as e:
+                    self.stats["failed_batches"] += 1
+                    if len(batch) == 1:
+                        outcomes = [(None, e)]
+                    else:
+                        outcomes = await self.retry_rows(conn, batch)
+        except BaseException as e:
+            # No connection, the retry transaction itself failed to commit, or shutdown
+            for _, future in batch:
+                self.resolve(future, error=e)
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        committed = [record for (record, _), (_, error) in zip(batch, outcomes) if error is None]
+        self.stats["rows"] += len(committed)
+        try:
+            if committed and self.on_commit is not None:
+                await self.on_commit(committed)
+        except Exception:
+            # The rows are committed either way; don't fail their callers
+            logger.exception("Post-commit hook failed", extra={"batcher": self.name})
+        finally:
+            for (_, future), (row_id, error) in zip(batch, outcomes):
+                self.resolve(future, result=row_id, error=error)
+
+    async def retry_rows(self, conn, batch: List[Tuple[Any, asyncio.Future]]) -> List[Tuple[Any, Optional[Exception]]]:
+        """Insert a failed batch row by row; a savepoint per row keeps the good ones"""
+        outcomes = []
+        async with conn.transaction():
+            for record, _ in batch:
+                try:
+                    async with conn.transaction():
+                        (row_id,) = await self.insert(conn, [record])
+                    outcomes.append((row_id, None))
+                except Exception as e:
+                    outcomes.append((None, e))
+        return outcomes
+
+    @staticmethod
+    def resolve(future: asyncio.Future, result=None, error: Optional[BaseException] = None):
+        # The caller may have gone away (cancelled request); the row is still written
+        if future.done():
+            return
+        if isinstance(error, asyncio.CancelledError):
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def drain(self):
+        """Flush anything buffered and wait for in-flight batches (shutdown)"""
+        self.flush_pending()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        if stats["batches"]:
+            stats["avg_batch"] = stats["rows"] / stats["batches"]
+        stats["max_batch"] = self.max_batch
+        stats["linger_ms"] = self.linger * 1000
+        return stats
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+from redis.exceptions import RedisError
+
+from ai import analysis_cache, jobs
+from ai.jobs import JobRunner, MemoryJobStore, fake_acquire, tile_field
+from ai.stub_analyzer import StubAnalyzer
+
+BBOX = (-40.0, -20.0, 40.0, 20.0)
+
+
+@pytest.fixture(autouse=True)
+def no_redis(monkeypatch):
+    async def unavailable():
+        raise RedisError("no redis in tests")
+
+    monkeypatch.setattr(analysis_cache, "get_redis_client", unavailable)
+
+
+def make_runner(store=None, latency_ms=1, acquire=fake_acquire):
+    stub = StubAnalyzer(latency_ms=latency_ms)
+    return JobRunner(store or MemoryJobStore(), lambda: stub, acquire=acquire, concurrency=2)
+
+
+async def finish(runner):
+    await asyncio.gather(*runner.tasks.values(), return_exceptions=True)
+
+
+def test_job_runs_every_tile():
+    async def main():
+        runner = make_runner()
+        job = await runner.submit("global", BBOX, 3, ["craters"], "test")
+        await finish(runner)
+        return job, await runner.store.get(job["id"])
+
+    job, stored = asyncio.run(main())
+    assert job["total"] > 2
+    assert stored["status"] == "done"
+    assert stored["completed"] == job["total"]
+
+
+def test_resume_skips_tiles_with_results():
+    acquired = []
+
+    async def counting_acquire(dataset, z, x, y):
+        acquired.append((x, y))
+        return await fake_acquire(dataset, z, x, y)
+
+    async def main():
+        store = MemoryJobStore()
+        first = make_runner(store, latency_ms=20)
+        job = await first.submit("global", BBOX, 3, ["craters"], "test")
+        await asyncio.sleep(0.03)
+        await first.stop()
+        # The interrupted job is still active; a later worker picks it up
+        assert job["id"] in await store.active_ids()
+        already = set(store.tile_results[job["id"]])
+        second = make_runner(store, acquire=counting_acquire)
+        await second.start(job["id"])
+        await finish(second)
+        return job, already, await store.get(job["id"])
+
+    job, already, stored = asyncio.run(main())
+    assert stored["status"] == "done"
+    assert not already & {tile_field(tile) for tile in acquired}
+    assert len(acquired) == job["total"] - len(already)
+
+
+def test_lost_lease_stops_the_job_and_leaves_it_active(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LEASE_MS", 30)
+
+    async def main():
+        store = MemoryJobStore()
+        runner = make_runner(store, latency_ms=50)
+        job = await runner.submit("global", BBOX, 3, ["craters"], "test")
+        await asyncio.sleep(0.02)
+        store.leases[job["id"]] = "another worker"
+        await finish(runner)
+        return job, store
+
+    job, store = asyncio.run(main())
+    assert store.jobs[job["id"]]["status"] == "running"
+    assert len(store.tile_results[job["id"]]) < job["total"]
+    # The new owner's lease is left alone
+    assert store.leases[job["id"]] == "another worker"
+
+
+def test_cancel_stops_remaining_tiles():
+    async def main():
+        runner = make_runner(latency_ms=20)
+        job = await runner.submit("global", BBOX, 3, ["craters"], "test")
+        await asyncio.sleep(0.03)
+        assert await runner.cancel(job["id"])
+        await finish(runner)
+        assert not await runner.cancel(job["id"])
+        return job, runner.store
+
+    job, store = asyncio.run(main())
+    assert store.jobs[job["id"]]["status"] == "cancelled"
+    assert len(store.tile_results[job["id"]]) < job["total"]
+
+
+def test_store_error_fails_the_job_and_stops_siblings():
+    fetched_after_failure = []
+
+    class FailingStore(MemoryJobStore):
+        async def record(self, job_id, tile, result):
+            if self.order[job_id]:
+                raise RedisError("connection lost")
+            await super().record(job_id, tile, result)
+
+    async def main():
+        store = FailingStore()
+
+        async def watching_acquire(dataset, z, x, y):
+            if store.jobs[job_id]["status"] == "failed":
+                fetched_after_failure.append((x, y))
+            return await fake_acquire(dataset, z, x, y)
+
+        runner = make_runner(store, latency_ms=10, acquire=watching_acquire)
+        job = await runner.submit("global", BBOX, 3, ["craters"], "test")
+        job_id = job["id"]
+        await finish(runner)
+        # Nothing keeps running once the job has failed
+        await asyncio.sleep(0.1)
+        return store.jobs[job_id]
+
+    stored = asyncio.run(main())
+    assert stored["status"] == "failed"
+    assert "connection lost" in stored["error"]
+    assert not fetched_after_failure
+
+
+def test_tile_fetch_error_is_a_tile_result():
+    async def flaky_acquire(dataset, z, x, y):
+        if x == 6:
+            raise OSError("upstream reset")
+        return await fake_acquire(dataset, z, x, y)
+
+    async def main():
+        runner = make_runner(acquire=flaky_acquire)
+        job = await runner.submit("global", BBOX, 3, ["craters"], "test")
+        await finish(runner)
+        return await runner.store.get(job["id"])
+
+    stored = asyncio.run(main())
+    assert stored["status"] == "done"
+    assert stored["failed"] >= 1 and stored["completed"] >= 1
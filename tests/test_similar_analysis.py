@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+
+from redis.exceptions import RedisError
+
+from ai import analysis_cache
+from ai.routes import gemeni
+
+
+def setup(monkeypatch, match):
+    calls = []
+
+    async def no_redis():
+        raise RedisError("down")
+
+    async def slow_fingerprint(lookup, model, image):
+        # Stands in for the pHash round trip through the process pool
+        await asyncio.sleep(0.01)
+        return match, 1
+
+    async def engine_run(key, call, request=None):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return await call()
+
+    async def no_remember(*args):
+        pass
+
+    monkeypatch.setattr(analysis_cache, "get_redis_client", no_redis)
+    monkeypatch.setattr(gemeni, "find_similar", slow_fingerprint)
+    monkeypatch.setattr(gemeni, "remember", no_remember)
+    monkeypatch.setattr(gemeni, "get_analyzer", lambda: SimpleNamespace(model_name="test-model"))
+    monkeypatch.setattr(gemeni, "client_key", lambda request: "client")
+    monkeypatch.setattr(gemeni.analysis_engine, "run", engine_run)
+    return calls
+
+
+def run_twice():
+    async def call():
+        return "analysis"
+
+    async def main():
+        return await asyncio.gather(*(
+            gemeni.run_similar_analysis(None, "analyze_mars_tile", b"tile", {}, call) for _ in range(2)
+        ))
+    return asyncio.run(main())
+
+
+def test_identical_misses_share_one_call(monkeypatch):
+    calls = setup(monkeypatch, None)
+    results = run_twice()
+    assert len(calls) == 1
+    assert sorted(status for _, status, _ in results) == ["MISS", "SHARED"]
+    assert not analysis_cache.in_flight
+
+
+def test_similar_match_is_handed_to_waiters(monkeypatch):
+    match = SimpleNamespace(text="similar analysis", marker=lambda: {"distance": 2})
+    calls = setup(monkeypatch, match)
+    results = run_twice()
+    assert not calls
+    assert [text for text, _, _ in results] == ["similar analysis"] * 2
+    assert not analysis_cache.in_flight
@@ -0,0 +1,63 @@
+import asyncio
+
+from planets.cache import tile_lease
+
+
+def test_foreground_request_does_not_inherit_skipped_prefetch(monkeypatch):
+    """A prefetch that loses the lease must not hand None to a concurrent tile request"""
+    async def lease_held_elsewhere(dataset, z, x, y):
+        await asyncio.sleep(0.01)
+        return None
+
+    async def filled_by_other_node(dataset, z, x, y):
+        return b"tile"
+
+    async def no_upstream(url):
+        raise AssertionError("the lease holder fills this tile")
+
+    monkeypatch.setattr(tile_lease, "acquire_tile_lease", lease_held_elsewhere)
+    monkeypatch.setattr(tile_lease, "wait_for_tile_fill", filled_by_other_node)
+
+    async def main():
+        prefetch = asyncio.create_task(
+            tile_lease.fetch_tile_single_flight("global", 3, 1, 2, no_upstream, wait=False)
+        )
+        await asyncio.sleep(0)
+        foreground = await tile_lease.fetch_tile_single_flight("global", 3, 1, 2, no_upstream)
+        return await prefetch, foreground
+
+    skipped, data = asyncio.run(main())
+    assert skipped is None
+    assert data == b"tile"
+    assert not tile_lease.in_flight
+
+
+def test_waiting_owner_result_is_shared(monkeypatch):
+    calls = []
+
+    async def lease_acquired(dataset, z, x, y):
+        return "token"
+
+    async def release(dataset, z, x, y, token):
+        pass
+
+    async def upstream(url):
+        calls.append(url)
+        await asyncio.sleep(0.01)
+        return None
+
+    async def no_cache(*args):
+        pass
+
+    monkeypatch.setattr(tile_lease, "acquire_tile_lease", lease_acquired)
+    monkeypatch.setattr(tile_lease, "release_tile_lease", release)
+    monkeypatch.setattr(tile_lease, "cache_tile_data", no_cache)
+
+    async def main():
+        return await asyncio.gather(*(
+            tile_lease.fetch_tile_single_flight("global", 3, 1, 2, upstream) for _ in range(3)
+        ))
+
+    # A missing tile from a waiting owner is final: one upstream call, no retries
+    assert asyncio.run(main()) == [None, None, None]
+    assert len(calls) == 1
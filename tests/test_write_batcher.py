@@ -0,0 +1,71 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from service.write_batcher import InsertBatcher
+
+
+class FakeTransaction:
+
+    def __init__(self, log):
+        self.log = log
+
+    async def __aenter__(self):
+        self.log.append("begin")
+
+    async def __aexit__(self, *exc):
+        self.log.append("rollback" if exc[0] else "commit")
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.log = []
+
+    def transaction(self):
+        return FakeTransaction(self.log)
+
+
+def make_batcher(on_commit=None):
+    connections = []
+
+    @asynccontextmanager
+    async def connect():
+        connections.append(FakeConnection())
+        yield connections[-1]
+
+    async def insert(conn, records):
+        if "bad" in records:
+            raise ValueError("bad row")
+        return [f"id-{record}" for record in records]
+
+    return InsertBatcher("test", insert, connect, on_commit, linger_ms=1), connections
+
+
+async def submit_all(batcher, records):
+    return await asyncio.gather(*(batcher.submit(record) for record in records), return_exceptions=True)
+
+
+def test_failed_batch_is_retried_row_by_row_on_one_connection():
+    committed = []
+
+    async def on_commit(records):
+        committed.extend(records)
+
+    batcher, connections = make_batcher(on_commit)
+    results = asyncio.run(submit_all(batcher, ["a", "bad", "c"]))
+
+    assert results[0] == "id-a" and results[2] == "id-c"
+    assert isinstance(results[1], ValueError)
+    assert len(connections) == 1
+    assert committed == ["a", "c"]
+    stats = batcher.get_stats()
+    assert stats["failed_batches"] == 1 and stats["rows"] == 2
+
+
+def test_callers_get_their_ids_when_on_commit_fails():
+    async def on_commit(records):
+        raise RuntimeError("cache down")
+
+    batcher, _ = make_batcher(on_commit)
+    results = asyncio.run(asyncio.wait_for(submit_all(batcher, ["a", "b"]), 1))
+    assert results == ["id-a", "id-b"]
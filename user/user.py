@@ -1,9 +1,13 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from db import register_user, authenticate_user, get_user_details
+from service.password_service import PasswordPoolOverloaded
 
 router = APIRouter()
 
+def overloaded() -> HTTPException:
+    return HTTPException(status_code=503, detail="Server busy, please retry.", headers={"Retry-After": "1"})
+
 class RegisterInput(BaseModel):
     username: str
     email: str
@@ -14,28 +18,34 @@ class LoginInput(BaseModel):
     password: str
 
 @router.post("/register")
-def register(data: RegisterInput):
+async def register(data: RegisterInput):
     try:
-        user_id = register_user(data.username, data.email, data.password)
+        user_id = await register_user(data.username, data.email, data.password)
         return {"message": "User registered successfully", "user_id": user_id}
+    except PasswordPoolOverloaded:
+        raise overloaded()
     except Exception as e:
         raise HTTPException(status_code=400, detail="Registration failed. Username or email may already exist.")
 
 @router.post("/login")
-def login(data: LoginInput):
+async def login(data: LoginInput):
     try:
-        user_id = authenticate_user(data.username, data.password)
+        user_id = await authenticate_user(data.username, data.password)
         if user_id:
             return {"message":  "Login Successfull", "user_id": user_id}
         else:
             raise HTTPException(status_code=401, detail="Invalid credentials")
+    except HTTPException:
+        raise
+    except PasswordPoolOverloaded:
+        raise overloaded()
     except Exception as e:
         raise HTTPException(status_code=500, detail="Login error")
 
 @router.get("/user_id/{user_id}")
-def get_user(user_id: int):
+async def get_user(user_id: int):
     try:
-        user = get_user_details(user_id)
+        user = await get_user_details(user_id)
         if user:
             return user
         else: